@@ -1,21 +1,111 @@
 from enum import Enum
+import os
 from pathlib import Path
 
-from repository import RedisRepository
+from repository import RedisRepository, RedisLRUCache, MemoryRepository, MemoryLRUCache
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
 UPLOADS_DIR = Path("./uploaded_files_temp")
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-CONVERSATION_EXPIRY_MINUTES = 30
+CONVERSATION_EXPIRY_MINUTES = 30  # pages without activity (chat, summary refresh or upload) for longer are deleted
+CONVERSATION_EXPIRY_INTERVAL = 5 * 60  # seconds between two sweeps of the expired pages
+CONVERSATION_EXPIRY_BATCH_SIZE = 100  # pages deleted per transaction, their sources go with them
+CONVERSATION_EXPIRY_BATCH_INTERVAL = 1.0  # seconds between two batches, keeps the sweep off the hot tables
+CONVERSATION_EXPIRY_MAX_BATCHES = 50  # per sweep, the rest is left to the next one
 
 SUMMARIZER_MODEL = "gemini-2.0-flash"
 CHAT_AGENT_MODEL = "gemini-2.5-flash-preview-04-17"
 MIND_MAP_MODEL = "gemini-2.0-flash"
 FLOW_MODEL = "gemini-2.0-flash"
 
-REDIS_HOST = "redis"
+RETRIEVAL_TOKEN_BUDGET = 8000  # max tokens returned by a single source retrieval tool call
+FETCH_PAGE_DEFAULT_LIMIT = 100  # sources per page of /fetch-page when paginated
+FETCH_PAGE_MAX_LIMIT = 1000
+CITATION_CHUNK_CHARS = 1500  # size of the source chunks a citation is resolved to
+
+CHAT_HISTORY_WINDOW = 6  # most recent turns sent verbatim to the chat agent
+CHAT_HISTORY_TURN_MAX_CHARS = 4000  # per query/answer cap when a turn is replayed
+CHAT_SUMMARY_MAX_WORDS = 300  # size cap of the running summary of older turns
+PAGE_SUMMARY_MAX_WORDS = 200  # size cap of the page summary returned by /fetch-page
+PAGE_SUMMARY_DEBOUNCE = 30  # seconds between an upload and the page summary refresh, later uploads join it
+
+MCP_STARTUP_TIMEOUT = 60  # seconds the first chat waits for an MCP server still starting
+MCP_HEALTH_CHECK_INTERVAL = 30  # seconds between pings of each MCP server
+MCP_HEALTH_CHECK_TIMEOUT = 10
+MCP_RESTART_BACKOFF = 2  # first restart delay in seconds, doubled on consecutive failures
+MCP_RESTART_BACKOFF_MAX = 60
+
+MCP_TOOL_CACHE_TTLS = {  # result cache TTL in seconds, per MCP tool
+    "search": 60 * 60,
+    "fetch_content": 60 * 60,
+    "search_papers": 24 * 60 * 60,
+    "get_paper_info": 7 * 24 * 60 * 60,  # papers are immutable once published
+    "scrape_recent_category_papers": 30 * 60,
+    "analyze_trends": 60 * 60,
+}
+MCP_SERVER_CACHE_TTLS = {  # result cache TTL in seconds of the tools of a server missing above
+    "search": 60 * 60,
+    "arXivPaper": 60 * 60,
+}
+MCP_TOOL_CACHE_DEFAULT_TTL = 60 * 60
+MCP_TOOL_CACHE_FREE_TEXT_ARGUMENTS = {"query", "keyword"}  # compared ignoring case and whitespace in cache keys
+MCP_TOOL_CACHE_MAX_ENTRIES = 50000
+
+ANSWER_CACHE_TTL = 24 * 60 * 60  # seconds
+ANSWER_CACHE_MAX_ENTRIES = 10000
+
+MIND_MAP_CONCURRENCY = 4  # per-source mind maps generated at the same time by one job
+MIND_MAP_OUTLINE_MAX_HEADINGS = 100  # headings of a source outline sent along with its summary
+MIND_MAP_CACHE_TTL = 7 * 24 * 60 * 60  # seconds, one entry per page holding its latest mind map
+MIND_MAP_CACHE_MAX_ENTRIES = 10000
+FLOW_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+FLOW_CACHE_MAX_ENTRIES = 10000
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")  # none | console | file
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")  # JSON lines, one span per line
+
+# queued: chats run on the dramatiq workers and their state lives in Redis
+# embedded: chats run as asyncio tasks of the API process and their state lives in memory, for a
+#   single process deployment without Redis or workers
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "queued")
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9191"))
+
+# dramatiq queues, a worker process consumes the queues given with `--queues` (all by default)
+CHAT_QUEUE = "chat"
+GENERATION_QUEUE = "generation"  # mind maps and flows
+INGESTION_QUEUE = "ingestion"  # source parsing and summarization
+QUEUE_PRIORITIES = {  # lower runs first when a process consumes several queues
+    CHAT_QUEUE: 0,
+    GENERATION_QUEUE: 10,
+    INGESTION_QUEUE: 20,
+}
+QUEUE_CONCURRENCY = {  # messages of a queue processed at the same time by one worker process
+    CHAT_QUEUE: int(os.getenv("MAX_INFLIGHT_CHATS", "8")),
+    GENERATION_QUEUE: 2,
+    INGESTION_QUEUE: 2,
+}
+
+# admission control, token buckets are (burst capacity, refilled tokens per second)
+CHAT_RATE_LIMITS = {"page": (10, 0.5), "client": (30, 1)}
+UPLOAD_RATE_LIMITS = {"page": (10, 0.2), "client": (20, 0.5)}
+# peers whose X-Forwarded-For is trusted by uvicorn to set the client address, the rate limits are per address
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+MAX_CHAT_BACKLOG = 200  # queued plus in-flight chats above which new chats are refused
+CHAT_BACKLOG_RETRY_AFTER = 10  # seconds
+CHAT_MAX_DURATION = 10 * 60  # seconds after which an unfinished chat no longer counts as in flight
+MAX_INFLIGHT_UPLOADS = 8  # uploads parsed and summarized at the same time by one API process
+UPLOAD_RETRY_AFTER = 5  # seconds
+
+CHAT_CANCEL_POLL_INTERVAL = 0.5  # seconds between checks of the cancellation flag of a running chat
+RECORD_WAIT_MAX = 25  # seconds a long poll of GET /chat is kept open at most
+RECORD_WAIT_POLL_INTERVAL = 0.2  # seconds between version checks of a long poll
+RESPONSE_COMPRESSION_MIN_SIZE = 1024  # bytes, smaller responses are sent uncompressed
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PREFIX = "zynapse.service"
 MERGE_TYPE = "message"
+RECORD_MAX_UPDATES = 1000  # cap of the update log of a chat record
 
 
 class SourceTypeEnum(Enum):
@@ -24,7 +114,34 @@ class SourceTypeEnum(Enum):
     WEB = "web"
 
 
-redis_repo = RedisRepository(
-    REDIS_PREFIX, REDIS_HOST,
-    MERGE_TYPE
-)
\ No newline at end of file
+if EXECUTION_MODE == "embedded":
+    redis_repo = MemoryRepository(MERGE_TYPE, max_updates=RECORD_MAX_UPDATES)
+    answer_cache = MemoryLRUCache(ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES)
+    mind_map_cache = MemoryLRUCache(MIND_MAP_CACHE_TTL, MIND_MAP_CACHE_MAX_ENTRIES)
+    flow_cache = MemoryLRUCache(FLOW_CACHE_TTL, FLOW_CACHE_MAX_ENTRIES)
+    tool_cache = MemoryLRUCache(
+        max([MCP_TOOL_CACHE_DEFAULT_TTL, *MCP_TOOL_CACHE_TTLS.values(), *MCP_SERVER_CACHE_TTLS.values()]), MCP_TOOL_CACHE_MAX_ENTRIES
+    )
+elif EXECUTION_MODE == "queued":
+    redis_repo = RedisRepository(
+        REDIS_PREFIX, REDIS_HOST,
+        MERGE_TYPE, max_updates=RECORD_MAX_UPDATES
+    )
+    answer_cache = RedisLRUCache(
+        redis_repo.redis_client, f"{REDIS_PREFIX}:answer-cache",
+        ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES
+    )
+    mind_map_cache = RedisLRUCache(
+        redis_repo.redis_client, f"{REDIS_PREFIX}:mind-map-cache",
+        MIND_MAP_CACHE_TTL, MIND_MAP_CACHE_MAX_ENTRIES
+    )
+    flow_cache = RedisLRUCache(
+        redis_repo.redis_client, f"{REDIS_PREFIX}:flow-cache",
+        FLOW_CACHE_TTL, FLOW_CACHE_MAX_ENTRIES
+    )
+    tool_cache = RedisLRUCache(
+        redis_repo.redis_client, f"{REDIS_PREFIX}:mcp-cache",
+        max([MCP_TOOL_CACHE_DEFAULT_TTL, *MCP_TOOL_CACHE_TTLS.values(), *MCP_SERVER_CACHE_TTLS.values()]), MCP_TOOL_CACHE_MAX_ENTRIES
+    )
+else:
+    raise ValueError(f"Unknown EXECUTION_MODE - {EXECUTION_MODE}")
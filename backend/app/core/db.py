@@ -1,18 +1,30 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exists, func, tuple_
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
+from datetime import datetime
 from typing import Dict, Any
 import os
 
 from .models import Base, Source, Conversation
+from .metrics import DB_CALL_DURATION, timed
+from .tracing import traced
+from .logger import get_logger
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set")
+logger = get_logger(__name__)
 engine = create_engine(DATABASE_URL, echo=False, pool_recycle=3600)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def instrumented(operation: str):
+    """decorator that traces and times a database helper"""
+    def decorator(func):
+        return traced(f"db.{operation}")(timed(DB_CALL_DURATION, operation=operation)(func))
+    return decorator
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -22,12 +34,12 @@ def get_db():
 
 
 def create_db_and_tables():
-    print("Creating database tables (if they don't exist)...")
+    logger.info("Creating database tables (if they don't exist)...")
     try:
         Base.metadata.create_all(bind=engine)
-        print("Tables checked/created.")
+        logger.info("Tables checked/created.")
     except Exception as e:
-        print(f"Error creating tables: {e}")
+        logger.error("Error creating tables: %s", e)
         raise
 
 
@@ -47,6 +59,7 @@ def db_session():
         connection.close()
 
 
+@instrumented("create_conversation")
 def create_conversation(conversation: Conversation):
     with db_session() as session:
         session.add(conversation)
@@ -55,19 +68,24 @@ def create_conversation(conversation: Conversation):
     return conv_id
 
 
+@instrumented("get_conversation")
 def get_conversation(conversation_id: int):
     with db_session() as session:
         return session.query(Conversation).filter(Conversation.id == conversation_id).first()
 
 
+@instrumented("create_source")
 def create_source(source: Source):
     with db_session() as session:
         session.add(source)
         session.flush()
         source_id = source.id
+        session.query(Conversation).filter(Conversation.id == source.conversation_id).update(
+            {Conversation.source_count: Conversation.source_count + 1}, synchronize_session=False)
     return source_id
 
 
+@instrumented("update_conversation")
 def update_conversation(conversation_id: str, update_data: Dict[str, Any]):
     with db_session() as session:
         conv = session.query(Conversation).filter(
@@ -83,11 +101,204 @@ def update_conversation(conversation_id: str, update_data: Dict[str, Any]):
         return conv
 
 
+@instrumented("get_conversation_data")
+def get_conversation_data(conversation_id: str) -> Dict[str, Any]:
+    with db_session() as session:
+        conversation_data = session.query(Conversation.conversation_data).filter(
+            Conversation.id == conversation_id).scalar()
+    return conversation_data or {}
+
+
+@instrumented("append_conversation_turn")
+def append_conversation_turn(conversation_id: str, turn: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    appends a turn to the conversation history, the row is locked so that concurrent
+    chats on the same page do not overwrite each other's turns
+
+    Args:
+        conversation_id (str): conversation id
+        turn (Dict[str, Any]): turn to be appended
+
+    Returns:
+        Dict[str, Any]: updated conversation data
+    """
+    with db_session() as session:
+        conv = session.query(Conversation).filter(
+            Conversation.id == conversation_id).with_for_update().first()
+
+        if not conv:
+            return {}
+
+        conversation_data = dict(conv.conversation_data or {})
+        conversation_data["history"] = list(conversation_data.get("history", [])) + [turn]
+        conv.conversation_data = conversation_data
+    return conversation_data
+
+
+@instrumented("compact_conversation_history")
+def compact_conversation_history(conversation_id: str, compacted_turns: list[Dict[str, Any]], summary: str) -> bool:
+    """
+    replaces the oldest turns of the conversation history with the running summary,
+    nothing is changed if the history no longer starts with `compacted_turns`
+
+    Args:
+        conversation_id (str): conversation id
+        compacted_turns (list[Dict[str, Any]]): turns folded into the summary
+        summary (str): updated running summary
+
+    Returns:
+        bool: True if the history was compacted
+    """
+    with db_session() as session:
+        conv = session.query(Conversation).filter(
+            Conversation.id == conversation_id).with_for_update().first()
+
+        if not conv:
+            return False
+
+        conversation_data = dict(conv.conversation_data or {})
+        history = list(conversation_data.get("history", []))
+        if history[:len(compacted_turns)] != compacted_turns:
+            return False
+
+        conversation_data["history"] = history[len(compacted_turns):]
+        conversation_data["summary"] = summary
+        conv.conversation_data = conversation_data
+    return True
+
+
+@instrumented("get_page_summary")
+def get_page_summary(conversation_id: str) -> Dict[str, Any] | None:
+    """
+    Returns:
+        Dict[str, Any] | None: `title`, `summary`, `summary_version` and `source_count` of the conversation,
+            None if it does not exist
+    """
+    with db_session() as session:
+        row = session.query(
+            Conversation.title, Conversation.summary, Conversation.summary_version, Conversation.source_count
+        ).filter(Conversation.id == conversation_id).first()
+    return row._asdict() if row else None
+
+
+@instrumented("get_unsummarized_sources")
+def get_unsummarized_sources(conversation_id: str) -> list[Dict[str, Any]]:
+    """
+    Args:
+        conversation_id (str): conversation id
+
+    Returns:
+        list[Dict[str, Any]]: `id`, `title` and `summary` of the sources not folded into the page summary yet,
+            oldest first
+    """
+    with db_session() as session:
+        rows = session.query(Source.id, Source.title, Source.summary).filter(
+            Source.conversation_id == conversation_id, Source.in_page_summary.is_(False)
+        ).order_by(Source.created_at, Source.id).all()
+    return [row._asdict() for row in rows]
+
+
+@instrumented("update_page_summary")
+def update_page_summary(conversation_id: str, summary: str, source_ids: list, previous_version: int) -> bool:
+    """
+    stores the page summary and marks its sources as folded, nothing is changed if another refresh
+    stored the summary meanwhile
+
+    Args:
+        conversation_id (str): conversation id
+        summary (str): updated page summary
+        source_ids (list): ids of the sources folded into the summary
+        previous_version (int): `summary_version` the summary was folded from
+
+    Returns:
+        bool: True if the summary was stored
+    """
+    with db_session() as session:
+        updated = session.query(Conversation).filter(
+            Conversation.id == conversation_id, Conversation.summary_version == previous_version
+        ).update({Conversation.summary: summary, Conversation.summary_version: previous_version + 1},
+                 synchronize_session=False)
+        if updated != 1:
+            return False
+        session.query(Source).filter(Source.id.in_(source_ids)).update(
+            {Source.in_page_summary: True}, synchronize_session=False)
+    return True
+
+
+@instrumented("delete_expired_conversations")
+def delete_expired_conversations(cutoff: datetime, limit: int) -> Dict[str, int]:
+    """
+    deletes up to `limit` conversations without activity since `cutoff`, their sources are deleted by
+    the cascade of the foreign key. Rows locked by a running request are skipped.
+
+    Args:
+        cutoff (datetime): conversations updated and given sources before it are expired
+        limit (int): max number of conversations deleted
+
+    Returns:
+        Dict[str, int]: number of deleted `conversations` and `sources`, and `content_bytes` of the sources
+    """
+    with db_session() as session:
+        conversation_ids = [conversation_id for (conversation_id,) in session.query(Conversation.id).filter(
+            Conversation.updated_at < cutoff,
+            ~exists().where(Source.conversation_id == Conversation.id, Source.created_at >= cutoff)
+        ).order_by(Conversation.updated_at).limit(limit).with_for_update(skip_locked=True).all()]
+        if not conversation_ids:
+            return {"conversations": 0, "sources": 0, "content_bytes": 0}
+
+        sources, content_bytes = session.query(
+            func.count(Source.id), func.coalesce(func.sum(func.octet_length(Source.content)), 0)
+        ).filter(Source.conversation_id.in_(conversation_ids)).one()
+        session.query(Conversation).filter(Conversation.id.in_(conversation_ids)).delete(synchronize_session=False)
+    return {"conversations": len(conversation_ids), "sources": sources, "content_bytes": int(content_bytes)}
+
+
+@instrumented("get_mind_map_sources")
+def get_mind_map_sources(conversation_id: str) -> list[Dict[str, Any]]:
+    """
+    Args:
+        conversation_id (str): conversation id
+
+    Returns:
+        list[Dict[str, Any]]: `id`, `title`, `summary`, `outline` and `mind_map` of the sources in creation order,
+            without their content
+    """
+    with db_session() as session:
+        rows = session.query(Source.id, Source.title, Source.summary, Source.outline, Source.mind_map).filter(
+            Source.conversation_id == conversation_id).order_by(Source.created_at, Source.id).all()
+    return [row._asdict() for row in rows]
+
+
+@instrumented("set_source_mind_map")
+def set_source_mind_map(source_id: str, mind_map: Dict[str, Any]):
+    with db_session() as session:
+        session.query(Source).filter(Source.id == source_id).update({Source.mind_map: mind_map})
+
+
+@instrumented("get_citation_indexes")
+def get_citation_indexes(conversation_id: str, source_ids: list[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Args:
+        conversation_id (str): conversation id
+        source_ids (list[str]): ids of the sources
+
+    Returns:
+        Dict[str, Dict[str, Any]]: citation index by source id, empty for a source without one,
+            the sources that are not part of the conversation are left out
+    """
+    with db_session() as session:
+        rows = session.query(Source.id, Source.citation_index).filter(
+            Source.id.in_(source_ids), Source.conversation_id == conversation_id).all()
+    return {str(row.id): row.citation_index or {} for row in rows}
+
+
+@instrumented("get_source")
 def get_source(source_id: str):
     with db_session() as session:
         return session.query(Source).filter(Source.id == source_id).first()
 
 
+@instrumented("get_sources")
 def get_sources(source_ids: list[str]):
     with db_session() as session:
         sources = session.query(Source).filter(Source.id.in_(source_ids)).all()
@@ -95,10 +306,62 @@ def get_sources(source_ids: list[str]):
             session.expunge(source)
     return sources
 
+@instrumented("get_source_count")
+def get_source_count(conversation_id: str) -> int:
+    with db_session() as session:
+        source_count = session.query(Conversation.source_count).filter(
+            Conversation.id == conversation_id).scalar()
+    return source_count or 0
+
+
+@instrumented("get_source_summaries")
+def get_source_summaries(conversation_id: str, source_ids: list[str] | None = None) -> list[Dict[str, Any]]:
+    """
+    Args:
+        conversation_id (str): conversation id
+        source_ids (list[str] | None): sources to return, all the sources of the conversation when None
+
+    Returns:
+        list[Dict[str, Any]]: `id`, `title` and `summary` of the sources ordered by id, without their content
+    """
+    with db_session() as session:
+        query = session.query(Source.id, Source.title, Source.summary).filter(Source.conversation_id == conversation_id)
+        if source_ids is not None:
+            query = query.filter(Source.id.in_(source_ids))
+        rows = query.order_by(Source.id).all()
+    return [row._asdict() for row in rows]
+
+
+@instrumented("get_sources_page")
+def get_sources_page(conversation_id: str, limit: int | None = None,
+                     after: tuple[datetime, str] | None = None) -> list[Dict[str, Any]]:
+    """
+    lists the sources of a conversation in creation order, a page at a time, with keyset pagination
+    on (created_at, id) so that deep pages cost the same as the first one
+
+    Args:
+        conversation_id (str): conversation id
+        limit (int | None): max number of sources returned, all of them when None
+        after (tuple[datetime, str] | None): `created_at` and `id` of the last source of the previous page
+
+    Returns:
+        list[Dict[str, Any]]: `id`, `title`, `type`, `link` and `created_at` of the sources, the content
+            is not loaded
+    """
+    with db_session() as session:
+        query = session.query(Source.id, Source.title, Source.type, Source.link, Source.created_at).filter(
+            Source.conversation_id == conversation_id)
+        if after is not None:
+            query = query.filter(tuple_(Source.created_at, Source.id) > after)
+        rows = query.order_by(Source.created_at, Source.id).limit(limit).all()
+    return [row._asdict() for row in rows]
+
+
+@instrumented("get_all_sources")
 def get_all_sources(conversation_id: str):
     with db_session() as session:
         sources = session.query(Source).filter(
-            Source.conversation_id == conversation_id).all()
+            Source.conversation_id == conversation_id).order_by(Source.created_at, Source.id).all()
         for source in sources:
             session.expunge(source)
     return sources
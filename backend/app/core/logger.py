@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+import json
+import logging
+import os
+import random
+import sys
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "200"))
+# fraction of the per-update debug records that are kept, the rest are dropped
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+page_id_var: ContextVar[Optional[str]] = ContextVar("page_id", default=None)
+
+_CONTEXT_FIELDS = ("request_id", "page_id")
+# attributes of every LogRecord, anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "context", "sample_rate"}
+
+
+@contextmanager
+def log_context(request_id: Optional[str] = None, page_id: Optional[str] = None):
+    """
+    tags every record logged inside the block (and in tasks created from it) with the request and page
+
+    Args:
+        request_id (Optional[str]): chat request id
+        page_id (Optional[str]): page (conversation) id
+    """
+    tokens = []
+    if request_id is not None:
+        tokens.append((request_id_var, request_id_var.set(str(request_id))))
+    if page_id is not None:
+        tokens.append((page_id_var, page_id_var.set(str(page_id))))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class truncate:
+    """
+    Payload wrapper for log arguments, it is converted to a string cut to `max_chars` (with the number
+    of dropped characters) only when the record is emitted, so disabled records cost nothing
+
+    Args:
+        value (Any): payload to be logged
+        max_chars (int): maximum number of characters kept
+    """
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value: Any, max_chars: int = LOG_PAYLOAD_MAX_CHARS):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else repr(self.value)
+        if len(text) <= self.max_chars:
+            return text
+        return f"{text[:self.max_chars]}...(+{len(text) - self.max_chars} chars)"
+
+
+class ContextFilter(logging.Filter):
+    """Adds the request context to the records and drops sampled records that lost the draw."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample_rate = getattr(record, "sample_rate", None)
+        if sample_rate is not None and random.random() >= sample_rate:
+            return False
+        record.request_id = request_id_var.get()
+        record.page_id = page_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({
+            key: value for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES and value is not None
+        })
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(context)s - %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {field: getattr(record, field, None) for field in _CONTEXT_FIELDS}
+        fields.update({
+            key: value for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES and key not in fields and key != "context"
+        })
+        context = " ".join(f"{key}={value}" for key, value in fields.items() if value is not None)
+        record.context = f" [{context}]" if context else ""
+        return super().format(record)
+
+
+def _configure() -> logging.Logger:
+    root = logging.getLogger("zynapse")
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(ContextFilter())
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    return root
+
+
+_root = _configure()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Args:
+        name (str): module name, records are emitted as `zynapse.<name>`
+
+    Returns:
+        logging.Logger: logger sharing the handler, level and request context of the application
+    """
+    return _root.getChild(name)
+
+
+def sampled(rate: float = LOG_SAMPLE_RATE) -> dict:
+    """
+    `extra` for records on per-update hot paths, only a `rate` fraction of them is emitted
+
+    Returns:
+        dict: extra fields of the record
+    """
+    return {"sample_rate": rate}
@@ -0,0 +1,189 @@
+from functools import wraps
+from typing import Any, Iterable, Optional
+import asyncio
+import json
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess, start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+STORE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+INGESTION_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HTTP_REQUESTS = Counter(
+    "zynapse_http_requests_total", "HTTP requests handled by the API", ["method", "route", "status"])
+HTTP_REQUEST_DURATION = Histogram(
+    "zynapse_http_request_duration_seconds", "HTTP request latency of the API", ["method", "route"])
+
+INGESTIONS = Counter(
+    "zynapse_ingestions_total", "Sources ingested by `upload_source`", ["source_type", "outcome"])
+INGESTION_DURATION = Histogram(
+    "zynapse_ingestion_duration_seconds", "Time spent per ingestion stage (fetch, summarize, total)",
+    ["source_type", "stage"], buckets=INGESTION_BUCKETS)
+
+ADMISSION_REJECTIONS = Counter(
+    "zynapse_admission_rejections_total", "Requests refused with a 429 by admission control",
+    ["endpoint", "reason"])
+
+CHAT_REQUESTS = Counter(
+    "zynapse_chat_requests_total", "Chat requests received by the API (queued, cached or error)", ["outcome"])
+CHAT_DURATION = Histogram(
+    "zynapse_chat_duration_seconds", "Time spent on a chat in the worker, by outcome (success, error, cancelled)",
+    ["outcome"], buckets=LLM_BUCKETS)
+CHATS_IN_PROGRESS = Gauge(
+    "zynapse_chats_in_progress", "Chats currently streamed by the worker", multiprocess_mode="livesum")
+
+LLM_LATENCY = Histogram(
+    "zynapse_llm_latency_seconds", "LLM latency by operation, to the first token and in total",
+    ["operation", "phase"], buckets=LLM_BUCKETS)
+LLM_TOKENS = Counter(
+    "zynapse_llm_tokens_total", "LLM tokens reported by the model", ["operation", "direction"])
+
+REDIS_CALL_DURATION = Histogram(
+    "zynapse_redis_call_duration_seconds", "Latency of the Redis repository calls", ["operation"],
+    buckets=STORE_BUCKETS)
+DB_CALL_DURATION = Histogram(
+    "zynapse_db_call_duration_seconds", "Latency of the database helpers", ["operation"], buckets=STORE_BUCKETS)
+
+EXPIRED_CONVERSATIONS = Counter(
+    "zynapse_expired_conversations_total", "Expired conversations deleted by the expiry sweep")
+EXPIRED_SOURCES = Counter(
+    "zynapse_expired_sources_total", "Sources deleted along with the expired conversations")
+EXPIRED_CONTENT_BYTES = Counter(
+    "zynapse_expired_content_bytes_total", "Bytes of source content reclaimed by the expiry sweep")
+EXPIRY_BATCH_DURATION = Histogram(
+    "zynapse_expiry_batch_duration_seconds", "Time spent deleting a batch of expired conversations",
+    buckets=STORE_BUCKETS)
+
+TOOL_CACHE_LOOKUPS = Counter(
+    "zynapse_tool_cache_lookups_total", "MCP tool calls by result cache outcome (hit, miss, shared)",
+    ["tool", "outcome"])
+
+ACTOR_MESSAGES = Counter(
+    "zynapse_dramatiq_messages_total", "Messages processed by the dramatiq worker", ["actor", "outcome"])
+ACTOR_DURATION = Histogram(
+    "zynapse_dramatiq_message_duration_seconds", "Time spent processing a dramatiq message", ["actor"],
+    buckets=LLM_BUCKETS)
+
+
+def timed(histogram: Histogram, **labels: str):
+    """
+    decorator that observes the duration of every call of a function, sync or async
+
+    Args:
+        histogram (Histogram): histogram to observe
+        **labels: label values of the observed series
+    """
+    metric = histogram.labels(**labels) if labels else histogram
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with metric.time():
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with metric.time():
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def record_llm_usage(operation: str, usage_metadata: Optional[dict]):
+    """adds the token usage reported on an AI message (or message chunk) to `LLM_TOKENS`"""
+    if not usage_metadata:
+        return
+    LLM_TOKENS.labels(operation, "input").inc(usage_metadata.get("input_tokens", 0))
+    LLM_TOKENS.labels(operation, "output").inc(usage_metadata.get("output_tokens", 0))
+
+
+class DramatiqQueueCollector:
+    """
+    Reports the depth and lag of the dramatiq queues at scrape time, read straight from the
+    Redis broker so the values are the same whichever worker process is scraped.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def _oldest_timestamp(self, queue_name: str) -> Optional[int]:
+        queue_key = f"{self.broker.namespace}:{queue_name}"
+        message_id = self.broker.client.lindex(queue_key, 0)
+        if message_id is None:
+            return None
+        data = self.broker.client.hget(f"{queue_key}.msgs", message_id)
+        return json.loads(data)["message_timestamp"] if data else None
+
+    def collect(self) -> Iterable[Any]:
+        depth = GaugeMetricFamily(
+            "zynapse_dramatiq_queue_depth", "Messages waiting in a dramatiq queue", labels=["queue"])
+        lag = GaugeMetricFamily(
+            "zynapse_dramatiq_queue_lag_seconds", "Age of the oldest message waiting in a dramatiq queue",
+            labels=["queue"])
+
+        now = time.time() * 1000
+        for queue_name in sorted(self.broker.get_declared_queues()):
+            for name in (queue_name, f"{queue_name}.DQ"):
+                depth.add_metric([name], self.broker.client.llen(f"{self.broker.namespace}:{name}"))
+            oldest = self._oldest_timestamp(queue_name)
+            lag.add_metric([queue_name], max(0, now - oldest) / 1000 if oldest else 0)
+
+        yield depth
+        yield lag
+
+
+def metrics_registry() -> CollectorRegistry:
+    """
+    Returns:
+        CollectorRegistry: registry to expose, it aggregates all processes when
+            `PROMETHEUS_MULTIPROC_DIR` is set (several dramatiq worker processes)
+    """
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    Returns:
+        tuple[bytes, str]: metrics of the process in the Prometheus text format and its content type
+    """
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int, collectors: Iterable[Any] = ()) -> bool:
+    """
+    serves the metrics on `port` from a background thread, when another worker process of the same
+    host already serves them the call is a no-op
+
+    Args:
+        port (int): port of the metrics endpoint
+        collectors (Iterable[Any]): extra collectors evaluated at scrape time
+
+    Returns:
+        bool: True if this process serves the metrics
+    """
+    registry = metrics_registry()
+    try:
+        start_http_server(port, registry=registry)
+    except OSError as e:
+        logger.info("Metrics port %s not available, served by another process - %s", port, e)
+        return False
+    for collector in collectors:
+        registry.register(collector)
+    return True
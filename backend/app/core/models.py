@@ -1,6 +1,6 @@
 from sqlalchemy import (
-    String, DateTime, 
-    ForeignKey, Text, Enum as SQLEnum
+    String, DateTime, Integer, Boolean,
+    ForeignKey, Text, Index, Enum as SQLEnum
 )
 from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID, JSONB
@@ -29,8 +29,11 @@ class Conversation(Base):
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         server_default=func.now(),
+        onupdate=func.now(),
         server_onupdate=func.now(),
         nullable=False,
+        index=True,
+        comment="Last activity on the page, the page expires `CONVERSATION_EXPIRY_MINUTES` after it."
     )
     conversation_data: Mapped[Dict[str, Any]] = mapped_column(
         "conversation",
@@ -38,6 +41,23 @@ class Conversation(Base):
         nullable=False,
         server_default='{}'
     )
+    summary: Mapped[Optional[str]] = mapped_column(
+        Text,
+        nullable=True,
+        comment="Summary of the page, the summaries of new sources are folded into it after ingestion."
+    )
+    source_count: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        server_default="0",
+        comment="Number of sources of the page, sources are only removed with their page so it versions the source set."
+    )
+    summary_version: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        server_default="0",
+        comment="Number of times the page summary was refreshed, refreshes compare-and-set it."
+    )
     sources: Mapped[List["Source"]] = relationship(
         "Source", back_populates="conversation", cascade="all, delete-orphan", lazy="selectin"
     )
@@ -49,6 +69,10 @@ class Conversation(Base):
 class Source(Base):
     """Represents a source document/link associated with a temporary conversation."""
     __tablename__ = "sources"
+    __table_args__ = (
+        # keyset pagination of the sources of a page, also serves the lookups by conversation
+        Index("ix_sources_conversation_id_created_at_id", "conversation_id", "created_at", "id"),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(
         PG_UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
@@ -57,7 +81,6 @@ class Source(Base):
         PG_UUID(as_uuid=True),
         ForeignKey("conversations.id", ondelete="CASCADE"),
         nullable=False,
-        index=True,
     )
     type: Mapped[SourceTypeEnum] = mapped_column(
         SQLEnum(SourceTypeEnum, name="sourcetypeenum",
@@ -78,6 +101,34 @@ class Source(Base):
     title: Mapped[str] = mapped_column(String(512), nullable=False)
     brief: Mapped[str] = mapped_column(Text, nullable=False)
     summary: Mapped[str] = mapped_column(Text, nullable=False)
+    token_count: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        server_default="0",
+        comment="Estimated number of LLM tokens in the content, computed at ingestion."
+    )
+    outline: Mapped[Optional[List[Dict[str, Any]]]] = mapped_column(
+        JSONB,
+        nullable=True,
+        comment="Heading hierarchy of the markdown content with character offsets of each section."
+    )
+    citation_index: Mapped[Optional[Dict[str, Any]]] = mapped_column(
+        JSONB,
+        nullable=True,
+        deferred=True,
+        comment="Chunk spans of the content and inverted index of their terms, used to resolve citations."
+    )
+    mind_map: Mapped[Optional[Dict[str, Any]]] = mapped_column(
+        JSONB,
+        nullable=True,
+        comment="Mind map tree of the source, generated on first use and kept since sources never change."
+    )
+    in_page_summary: Mapped[bool] = mapped_column(
+        Boolean,
+        nullable=False,
+        server_default="false",
+        comment="Whether the summary of the source was folded into the page summary."
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), nullable=False
     )
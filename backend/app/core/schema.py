@@ -1,6 +1,6 @@
 from fastapi import UploadFile
 from pydantic import BaseModel
-from typing import Any
+from typing import Any, Optional
 
 from config import SourceTypeEnum
 
@@ -20,6 +20,20 @@ class ChatRequest(BaseModel):
     page_id: str
 
 
+class CancelChatRequest(BaseModel):
+    request_id: str
+
+
+class MindMapRequest(BaseModel):
+    page_id: str
+
+
+class FlowRequest(BaseModel):
+    page_id: str
+    instructions: str
+    source_ids: Optional[list[str]] = None  # all the sources of the page by default
+
+
 class UpdateState(BaseModel):
     type: str
     content: Any
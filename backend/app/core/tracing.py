@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Optional
+import asyncio
+import sys
+
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.trace import Status, StatusCode
+
+from config import TRACING_EXPORTER, TRACING_FILE
+
+tracer = trace.get_tracer("zynapse")
+
+
+def setup_tracing(service_name: str):
+    """
+    installs the tracer provider of the process, spans are exported as JSON lines to the
+    console or to `TRACING_FILE` depending on `TRACING_EXPORTER`, with "none" they are not recorded
+
+    Args:
+        service_name (str): name reported as `service.name` on every span
+    """
+    if TRACING_EXPORTER == "none":
+        return
+
+    if TRACING_EXPORTER == "file":
+        out = open(TRACING_FILE, "a", buffering=1)
+    elif TRACING_EXPORTER == "console":
+        out = sys.stdout
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER - {TRACING_EXPORTER}")
+
+    exporter = ConsoleSpanExporter(
+        service_name=service_name, out=out,
+        formatter=lambda span: span.to_json(indent=None) + "\n")
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+def inject_context() -> dict[str, str]:
+    """
+    Returns:
+        dict[str, str]: W3C trace context headers of the current span, to be sent along with a message
+    """
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def extract_context(carrier: Optional[dict[str, str]]) -> context.Context:
+    """
+    Args:
+        carrier (Optional[dict[str, str]]): headers built by `inject_context`
+
+    Returns:
+        context.Context: context whose current span is the remote parent
+    """
+    return propagate.extract(carrier or {})
+
+
+@contextmanager
+def attached_context(ctx: context.Context):
+    """makes `ctx` the current context for the duration of the block"""
+    token = context.attach(ctx)
+    try:
+        yield
+    finally:
+        context.detach(token)
+
+
+def record_exception(span: trace.Span, exception: BaseException):
+    span.record_exception(exception)
+    span.set_status(Status(StatusCode.ERROR, str(exception)))
+
+
+def traced(name: Optional[str] = None, **attributes: Any) -> Callable:
+    """
+    decorator that runs a function, sync or async, inside a span
+
+    Args:
+        name (Optional[str]): span name, defaults to the qualified name of the function
+        **attributes: static attributes set on the span
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.start_as_current_span(span_name, attributes=attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(span_name, attributes=attributes):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
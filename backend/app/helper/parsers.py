@@ -7,6 +7,10 @@ import pymupdf4llm
 import markdownify
 import re
 
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
 
 def parse_pdf(file_path: str):
     md_content = pymupdf4llm.to_markdown(file_path)
@@ -33,13 +37,13 @@ def get_web_content(url: str):
         if response.status_code == 200:
             response = response.text
         else:
-            print(f"Failed with status code: {response.status_code}")
+            logger.warning("Fetching %s failed with status code: %s", url, response.status_code)
             return None
 
         return markdownify.markdownify(response)
 
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.warning("Fetching %s failed - %s", url, e)
         return None
 
 
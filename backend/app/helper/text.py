@@ -0,0 +1,251 @@
+from datetime import datetime, timedelta, timezone
+import re
+import uuid
+
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def count_tokens(text: str) -> int:
+    """
+    estimates the number of LLM tokens in the text, words longer than a few characters
+    are counted as multiple tokens to approximate sub-word tokenization
+
+    Args:
+        text (str): text to be measured
+
+    Returns:
+        int: estimated token count
+    """
+    if not text:
+        return 0
+    return sum(1 + (len(piece) - 1) // 6 for piece in _TOKEN_PATTERN.findall(text))
+
+
+def normalize_query(query: str) -> str:
+    """
+    normalizes a user query for cache lookups, case, repeated whitespace and
+    trailing punctuation are ignored
+
+    Args:
+        query (str): user query
+
+    Returns:
+        str: normalized query
+    """
+    return _WHITESPACE_PATTERN.sub(" ", query).strip().rstrip("?!.").strip().lower()
+
+
+def encode_cursor(source_id: str, offset: int) -> str:
+    """
+    builds a continuation cursor pointing at a character offset inside a source
+
+    Args:
+        source_id (str): id of the source to continue from
+        offset (int): character offset inside the source content
+
+    Returns:
+        str: opaque cursor string
+    """
+    return f"{source_id}:{offset}"
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """
+    parses a cursor built by `encode_cursor`
+
+    Args:
+        cursor (str): cursor string
+
+    Returns:
+        tuple[str, int]: source id and character offset
+    """
+    source_id, _, offset = cursor.rpartition(":")
+    if not source_id or not offset.isdigit():
+        raise ValueError(f"Invalid cursor - {cursor}")
+    return source_id, int(offset)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_page_cursor(created_at: datetime, source_id: str) -> str:
+    """
+    builds a keyset cursor pointing after a source in the (created_at, id) order of a page
+
+    Args:
+        created_at (datetime): creation time of the last source returned
+        source_id (str): id of the last source returned
+
+    Returns:
+        str: opaque cursor string
+    """
+    return f"{(created_at - _EPOCH) // timedelta(microseconds=1)}:{source_id}"
+
+
+def decode_page_cursor(cursor: str) -> tuple[datetime, str]:
+    """
+    parses a cursor built by `encode_page_cursor`
+
+    Args:
+        cursor (str): cursor string
+
+    Returns:
+        tuple[datetime, str]: creation time and id of the last source returned, ValueError is raised
+            for a malformed cursor
+    """
+    timestamp, _, source_id = cursor.partition(":")
+    try:
+        if not timestamp.isdigit():
+            raise ValueError(f"Invalid cursor - {cursor}")
+        # ids are compared with a uuid column, a malformed one would fail the query instead of the request
+        return _EPOCH + timedelta(microseconds=int(timestamp)), str(uuid.UUID(source_id))
+    except (ValueError, OverflowError):
+        raise ValueError(f"Invalid cursor - {cursor}")
+
+
+def cut_at_boundary(content: str, start: int, length: int) -> int:
+    """
+    finds the end offset of a slice of roughly `length` characters starting at `start`,
+    preferring to cut at a paragraph or line break and falling back to whitespace
+
+    Args:
+        content (str): full text
+        start (int): start offset of the slice
+        length (int): approximate length of the slice
+
+    Returns:
+        int: end offset of the slice (exclusive)
+    """
+    end = min(len(content), start + max(length, 1))
+    if end >= len(content):
+        return len(content)
+
+    # Do not shrink the slice below half its size just to find a nicer boundary
+    floor = start + max(length // 2, 1)
+    for separator in ("\n\n", "\n", " "):
+        position = content.rfind(separator, floor, end)
+        if position != -1:
+            return position + len(separator)
+    return end
+
+
+_TERM_PATTERN = re.compile(r"[^\W_]{3,}")
+_STOP_WORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has him his how its may new now old see "
+    "two who did get let say she too use with that this from they have were been will what when where which "
+    "their there these those than then them into more most some such only also very just over about after "
+    "before other could would should because while being does each".split()
+)
+
+
+def index_terms(text: str) -> list[str]:
+    """
+    Returns:
+        list[str]: lowercase words of the text used for citation matching, short words and stop words left out
+    """
+    return [term for term in _TERM_PATTERN.findall(text.lower()) if term not in _STOP_WORDS]
+
+
+def build_citation_index(content: str, chunk_chars: int) -> dict:
+    """
+    splits the content into chunks cut at paragraph or line breaks and builds an inverted index
+    of their terms, so that a cited passage can be located without reading the content again
+
+    Args:
+        content (str): source content
+        chunk_chars (int): approximate size of a chunk
+
+    Returns:
+        dict: `chunks`, the [start, end) character span of every chunk, and `terms`, the indexes of the
+            chunks holding each term. Terms found in more than half of the chunks are left out.
+    """
+    chunks = []
+    postings: dict[str, list[int]] = {}
+    start = 0
+    while start < len(content):
+        end = cut_at_boundary(content, start, chunk_chars)
+        for term in set(index_terms(content[start:end])):
+            postings.setdefault(term, []).append(len(chunks))
+        chunks.append([start, end])
+        start = end
+
+    max_chunks = max(len(chunks) // 2, 1)
+    terms = {term: ids for term, ids in postings.items() if len(chunks) < 3 or len(ids) <= max_chunks}
+    return {"chunks": chunks, "terms": terms}
+
+
+_ATX_HEADING_PATTERN = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$")
+_SETEXT_UNDERLINE_PATTERN = re.compile(r"^(=+|-+)[ \t]*$")
+_FENCE_PATTERN = re.compile(r"^(```|~~~)")
+
+
+def parse_outline(markdown: str) -> list[dict]:
+    """
+    parses the heading hierarchy of a markdown document, both `#` style and underlined
+    headings are recognized and headings inside fenced code blocks are ignored
+
+    Args:
+        markdown (str): markdown content
+
+    Returns:
+        list[dict]: headings in document order with keys `level`, `title`, `start` and `end`,
+            where `start`-`end` is the character span of the section including its subsections
+    """
+    if not markdown:
+        return []
+
+    headings = []
+    in_fence = False
+    offset = 0
+    previous = None  # (offset, line) of the previous non-blank line, used for underlined headings
+    for line in markdown.splitlines(keepends=True):
+        stripped = line.strip()
+
+        if _FENCE_PATTERN.match(stripped):
+            in_fence = not in_fence
+        elif not in_fence:
+            atx = _ATX_HEADING_PATTERN.match(stripped)
+            underline = _SETEXT_UNDERLINE_PATTERN.match(stripped)
+            if atx:
+                headings.append({"level": len(atx.group(1)), "title": atx.group(2).strip(), "start": offset})
+            elif underline and previous and not _ATX_HEADING_PATTERN.match(previous[1].strip()):
+                level = 1 if stripped.startswith("=") else 2
+                headings.append({"level": level, "title": previous[1].strip(), "start": previous[0]})
+
+        previous = (offset, line) if stripped else None
+        offset += len(line)
+
+    for index, heading in enumerate(headings):
+        heading["end"] = next(
+            (following["start"] for following in headings[index + 1:] if following["level"] <= heading["level"]),
+            len(markdown)
+        )
+        heading["title"] = heading["title"].strip("*_ ") or heading["title"]
+
+    return headings
+
+
+def find_section(outline: list[dict], section: str) -> dict | None:
+    """
+    finds a section in an outline by its title, exact (case-insensitive) matches are preferred
+    over partial ones
+
+    Args:
+        outline (list[dict]): outline built by `parse_outline`
+        section (str): title (or part of the title) of the section
+
+    Returns:
+        dict | None: matching outline entry, None when nothing matches
+    """
+    query = section.strip().lower()
+    if not query:
+        return None
+    for heading in outline:
+        if heading["title"].lower() == query:
+            return heading
+    for heading in outline:
+        if query in heading["title"].lower():
+            return heading
+    return None
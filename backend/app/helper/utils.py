@@ -1,5 +1,4 @@
-
-from core.db import get_all_sources
+from core.db import get_all_sources, get_source_count
 
 
 def build_sources_description(conversation_id: str) -> str:
@@ -25,3 +24,17 @@ def build_sources_description(conversation_id: str) -> str:
         sources_description += f"| {source_id} | {source_title} | {source_description} |\n"
 
     return sources_description
+
+
+def source_set_version(conversation_id: str) -> str:
+    """
+    computes a version identifier of the set of sources attached to a conversation,
+    it changes whenever a source is added (sources are only removed along with the conversation)
+
+    Args:
+        conversation_id (str): conversation id for retrieving the sources
+
+    Returns:
+        str: version of the source set
+    """
+    return str(get_source_count(conversation_id))
@@ -1,7 +1,13 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
 from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from contextlib import asynccontextmanager, contextmanager
 from typing import Any, Dict, Optional
+import asyncio
+import hashlib
+import math
+import time
 import traceback
 import uvicorn
 import os
@@ -9,14 +15,43 @@ import shutil
 from dotenv import load_dotenv
 load_dotenv()
 
-from config import SourceTypeEnum, redis_repo
-from core.db import create_conversation, create_source, get_all_sources
+from opentelemetry import trace
+
+from config import (
+    SourceTypeEnum, EXECUTION_MODE, CHAT_QUEUE, GENERATION_QUEUE, INGESTION_QUEUE, PAGE_SUMMARY_DEBOUNCE,
+    MAX_INFLIGHT_UPLOADS, UPLOAD_RETRY_AFTER, CITATION_CHUNK_CHARS, RECORD_WAIT_MAX, RECORD_WAIT_POLL_INTERVAL,
+    RESPONSE_COMPRESSION_MIN_SIZE, FORWARDED_ALLOW_IPS, FETCH_PAGE_DEFAULT_LIMIT, FETCH_PAGE_MAX_LIMIT, redis_repo
+)
+from core.db import (
+    create_conversation, create_source, append_conversation_turn, get_page_summary, get_source_count, get_sources_page
+)
 from core.models import Conversation, Source
 from services.summarizer import get_brief_summary
-from helper.parsers import get_web_content, get_youtube_info, parse_pdf
-from worker import async_chat_task
+from services.answer_cache import get_cached_answer
+from services.citations import CitationResolver
+from services.admission import admit_chat, admit_upload, InFlightLimiter
+from services.mind_map import build_mind_map, get_cached_mind_map
+from services.flow import build_flow, flow_cache_key, get_cached_flow
+from services.page_summary import claim_page_summary_refresh, refresh_page_summary
+from services.expiry import start_expiry_scheduler
+from helper.text import count_tokens, parse_outline, build_citation_index, encode_page_cursor, decode_page_cursor
+from core.tracing import tracer, setup_tracing, extract_context
+from core.logger import get_logger, log_context, truncate
+from core.metrics import (
+    render_metrics, HTTP_REQUESTS, HTTP_REQUEST_DURATION, INGESTIONS, INGESTION_DURATION, CHAT_REQUESTS,
+    ADMISSION_REJECTIONS
+)
 from core.schema import *
 
+if EXECUTION_MODE == "embedded":
+    from services import embedded
+    from services.chat_runner import run_chat
+else:
+    from worker import async_chat_task, generate_mind_map_task, generate_flow_task, refresh_page_summary_task
+
+logger = get_logger(__name__)
+
+
 class ExceptionHandler:
     @staticmethod
     def handle_exception() -> Dict[str, Any]:
@@ -33,7 +68,20 @@ class ExceptionHandler:
         return error_info
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if EXECUTION_MODE == "embedded":
+        await embedded.start()
+    expiry_scheduler = start_expiry_scheduler()
+    yield
+    expiry_scheduler.shutdown(wait=False)
+    if EXECUTION_MODE == "embedded":
+        await embedded.stop()
+
+
+setup_tracing("zynapse-api")
+app = FastAPI(lifespan=lifespan)
+upload_slots = InFlightLimiter(MAX_INFLIGHT_UPLOADS)
 
 
 origins = [
@@ -46,7 +94,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_COMPRESSION_MIN_SIZE)
+
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    started = time.perf_counter()
+    # continues the trace of the caller when it sends a `traceparent` header
+    with tracer.start_as_current_span(
+            f"{request.method} {request.url.path}", context=extract_context(dict(request.headers)),
+            kind=trace.SpanKind.SERVER,
+            attributes={"http.method": request.method, "http.route": request.url.path}) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+
+    # unmatched paths share one label so that scanners cannot blow up the series count
+    route = request.scope.get("route")
+    route = route.path if route is not None else "unmatched"
+    HTTP_REQUESTS.labels(request.method, route, response.status_code).inc()
+    HTTP_REQUEST_DURATION.labels(request.method, route).observe(time.perf_counter() - started)
+    return response
+
+
+def client_address(request: Request) -> str:
+    # behind a proxy listed in FORWARDED_ALLOW_IPS, uvicorn has already replaced the peer with the forwarded client
+    return request.client.host if request.client else "unknown"
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """True if the client already holds the representation tagged `etag` (`If-None-Match`)"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def too_many_requests(retry_after: float, detail: str) -> JSONResponse:
+    return JSONResponse(
+        {"error": True, "message": detail}, status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+@contextmanager
+def ingestion_stage(source_type: str, stage: str):
+    """traces and times a stage of `upload_source`"""
+    with tracer.start_as_current_span(f"ingest.{stage}", attributes={"source_type": source_type}), \
+            INGESTION_DURATION.labels(source_type, stage).time():
+        yield
 
 
 @app.post("/initiate-page")
@@ -62,6 +158,7 @@ async def initiate_page(request: InitiatePage):
 
 @app.post("/upload-source")
 async def upload_source(
+    http_request: Request,
     source: Optional[UploadFile] = File(None,
                                         description="The PDF file to upload"),
     url: Optional[str] = Form(None, description="The URL to upload"),
@@ -77,6 +174,20 @@ async def upload_source(
     if source and source.content_type != "application/pdf":
         raise HTTPException(400, detail="Only PDF files are allowed")
 
+    retry_after = admit_upload(page_id, client_address(http_request))
+    if retry_after is not None:
+        return too_many_requests(retry_after, "Too many uploads, retry later")
+
+    # the parsers pull in pymupdf, bs4 and the YouTube clients, imported with the first upload
+    from helper.parsers import get_web_content, get_youtube_info, parse_pdf
+
+    metric_source_type = source_type if source_type in {
+        member.value for member in SourceTypeEnum} else "unknown"
+    started = time.perf_counter()
+    # nothing between taking the slot and the `try` releasing it may raise
+    if not upload_slots.try_acquire():
+        ADMISSION_REJECTIONS.labels("upload", "in_flight").inc()
+        return too_many_requests(UPLOAD_RETRY_AFTER, "The server is busy processing uploads, retry later")
     try:
         if source_type == SourceTypeEnum.DOCUMENT.value and source:
             file = source
@@ -90,10 +201,11 @@ async def upload_source(
             file_path = os.path.join(upload_dir, filename)
 
             with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+                await asyncio.to_thread(shutil.copyfileobj, file.file, buffer)
 
             try:
-                content = parse_pdf(file_path)
+                with ingestion_stage(metric_source_type, "fetch"):
+                    content = await asyncio.to_thread(parse_pdf, file_path)
                 title = filename
             except Exception as e:
                 os.remove(file_path)
@@ -101,84 +213,299 @@ async def upload_source(
 
             os.remove(file_path)
         elif url and source_type == SourceTypeEnum.WEB.value:
-            response = get_web_content(url)
+            with ingestion_stage(metric_source_type, "fetch"):
+                response = await asyncio.to_thread(get_web_content, url)
             title, content = url, response
             doc_type = SourceTypeEnum.WEB
         elif url and source_type == SourceTypeEnum.YOUTUBE.value:
-            response = get_youtube_info(url)
+            with ingestion_stage(metric_source_type, "fetch"):
+                response = await asyncio.to_thread(get_youtube_info, url)
 
             response = response if response and isinstance(
                 response, dict) else {}
             title = response.get('title', url)
             content = response.get("transcript", "Not Available").strip()
             doc_type = SourceTypeEnum.YOUTUBE
-            print(title, content)
+            logger.debug("Fetched YouTube source %s - %s", title, truncate(content))
             # else:
             #     raise Exception("Failed to fetch Youtube transcript" + str(response['error']))
         else:
             raise Exception("Unknown type of the source")
 
-        response = await get_brief_summary(source_type, content)
+        with ingestion_stage(metric_source_type, "summarize"):
+            response = await get_brief_summary(source_type, content)
+        # fetching, parsing and indexing walk the whole document, they run off the event loop
+        with ingestion_stage(metric_source_type, "outline"):
+            token_count = await asyncio.to_thread(count_tokens, content)
+            outline = await asyncio.to_thread(parse_outline, content)
+        with ingestion_stage(metric_source_type, "index"):
+            citation_index = await asyncio.to_thread(build_citation_index, content, CITATION_CHUNK_CHARS)
         source_entry = Source(
             conversation_id=page_id, type=doc_type,
             link=url,
             content=content, title=title, brief=response.get(
                 "brief", "Not available"),
-            summary=response.get("summary", "Not available")
+            summary=response.get("summary", "Not available"),
+            token_count=token_count,
+            outline=outline,
+            citation_index=citation_index
         )
 
         source_id = create_source(source_entry)
+        schedule_page_summary(page_id)
 
+        INGESTIONS.labels(metric_source_type, "success").inc()
+        INGESTION_DURATION.labels(metric_source_type, "total").observe(time.perf_counter() - started)
         return {"source_id": source_id}
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Failed to ingest %s source for page %s", metric_source_type, page_id)
+        INGESTIONS.labels(metric_source_type, "error").inc()
         return ExceptionHandler.handle_exception()
+    finally:
+        upload_slots.release()
+
+
+def schedule_page_summary(page_id: str):
+    if not claim_page_summary_refresh(page_id):
+        return
+    if EXECUTION_MODE == "embedded":
+        embedded.submit_later(
+            PAGE_SUMMARY_DEBOUNCE, INGESTION_QUEUE, "refresh_page_summary", refresh_page_summary, page_id)
+    else:
+        refresh_page_summary_task.send_with_options(args=(page_id,), delay=PAGE_SUMMARY_DEBOUNCE * 1000)
 
 
 @app.get("/fetch-page")
-async def fetch_page(page_id: str):
+async def fetch_page(http_request: Request, page_id: str, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    returns the page with its sources in creation order, all of them unless `limit` or `cursor` is given,
+    in which case a page of `limit` sources is returned along with the `next_cursor` to pass for the next one
+    """
     try:
-        sources = get_all_sources(page_id)
+        paginated = limit is not None or cursor is not None
+        try:
+            after = decode_page_cursor(cursor) if cursor else None
+        except ValueError:
+            return Response(status_code=400, content="Invalid cursor")
+        page = get_page_summary(page_id)
+        if page is None:
+            return Response(status_code=404, content="Page not found")
+        limit = min(max(limit or FETCH_PAGE_DEFAULT_LIMIT, 1), FETCH_PAGE_MAX_LIMIT) if paginated else None
+        # sources never change once ingested and are only added, the source count versions the source set.
+        # A revalidation costs the lookup of the page row, the tag is scoped to the requested slice
+        page_version = f"{page['source_count']}:{page['summary_version']}:{page['title']}:{limit}:{cursor}"
+        etag = f'"{hashlib.sha256(page_version.encode()).hexdigest()[:16]}"'
+        if not_modified(http_request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        # one extra source tells whether there is a next page
+        sources = get_sources_page(page_id, limit=limit + 1 if paginated else None, after=after)
+        next_cursor = None
+        if paginated and len(sources) > limit:
+            sources = sources[:limit]
+            next_cursor = encode_page_cursor(sources[-1]["created_at"], str(sources[-1]["id"]))
         sources = [
             {
-                "id": source.id,
-                "title": source.title,
-                "type": source.type.value,
-                "link": source.link
+                "id": str(source["id"]),
+                "title": source["title"],
+                "type": source["type"].value,
+                "link": source["link"]
             }
             for source in sources
         ]
-        return {"sources": sources, "title": "Sample", "summary": "This is a sample summary of sources."}
+        # the summary is refreshed in the background after uploads, it is empty until the first refresh
+        content = {"sources": sources, "title": page["title"], "summary": page["summary"] or ""}
+        if paginated:
+            content["next_cursor"] = next_cursor
+        return JSONResponse(content, headers={"ETag": etag})
     except Exception:
         return ExceptionHandler.handle_exception()
 
 
 @app.post("/chat")
-async def chat_request(request: ChatRequest):
+async def chat_request(request: ChatRequest, http_request: Request):
     try:
+        cached_answer = get_cached_answer(request.query, request.page_id)
+        retry_after = admit_chat(
+            request.page_id, client_address(http_request), queued=cached_answer is None)
+        if retry_after is not None:
+            return too_many_requests(retry_after, "Too many chat requests, retry later")
+
         request_id = redis_repo.create_record()
-        response = async_chat_task.send(
-            request_id, request.model_dump_json()
-        )
-        print(response)
+        trace.get_current_span().set_attributes({
+            "request_id": request_id, "page_id": request.page_id, "answer_cache.hit": cached_answer is not None})
+        if cached_answer is not None:
+            # served without the agent, the turn is still recorded for follow-up questions
+            redis_repo.update_record(
+                record_id=request_id, record={"type": "message", "content": cached_answer})
+            citations = await CitationResolver(request.page_id).resolve(cached_answer)
+            if citations:
+                redis_repo.update_record(
+                    record_id=request_id, record={"type": "citations", "content": citations})
+            redis_repo.update_record(
+                record_id=request_id, record={"type": "status", "content": "finished"})
+            append_conversation_turn(
+                request.page_id, {"query": request.query, "answer": cached_answer})
+            CHAT_REQUESTS.labels("cached").inc()
+            return JSONResponse({"request_id": request_id})
+
+        with log_context(request_id=request_id, page_id=request.page_id):
+            if EXECUTION_MODE == "embedded":
+                embedded.submit(CHAT_QUEUE, "async_chat", run_chat, request_id, request)
+                logger.info("Chat submitted to the embedded pool")
+            else:
+                response = async_chat_task.send(
+                    request_id, request.model_dump_json()
+                )
+                logger.info("Chat queued as message %s", response.message_id)
+        CHAT_REQUESTS.labels("queued").inc()
         return JSONResponse({"request_id": request_id})
     except Exception:
+        CHAT_REQUESTS.labels("error").inc()
         return ExceptionHandler.handle_exception()
 
 
-@app.get("/chat")
-async def chat_update(request_id: str):
+@app.post("/chat/cancel")
+async def cancel_chat(request: CancelChatRequest):
+    try:
+        status = redis_repo.cancel_record(record_id=request.request_id)
+        if status is None:
+            return Response(status_code=404, content="Record not found")
+        with log_context(request_id=request.request_id):
+            logger.info("Chat cancellation requested, record %s", status)
+        # a chat that already ended is left as it is, its terminal status is reported instead
+        return JSONResponse(
+            {"request_id": request.request_id, "cancelled": status == "cancelling", "status": status})
+    except Exception:
+        return ExceptionHandler.handle_exception()
+
+
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+def record_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+async def wait_for_version(request_id: str, version: int, timeout: float) -> Optional[int]:
+    """
+    waits until the version of the record moves past `version`
+
+    Returns:
+        Optional[int]: latest version of the record, unchanged on timeout, None if the record expired
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(RECORD_WAIT_POLL_INTERVAL)
+        latest = redis_repo.get_version(request_id)
+        if latest != version:
+            return latest
+    return version
+
+
+async def record_response(http_request: Request, request_id: str, after: Optional[str] = None, wait: float = 0):
+    """
+    answers a poll of a record, `304 Not Modified` when the client holds the current version
+    (`If-None-Match` with the `ETag` of its previous poll)
+
+    Args:
+        http_request (Request): poll request
+        request_id (str): record id
+        after (Optional[str]): `last_update_id` of the previous poll, only the newer updates are returned
+        wait (float): seconds to hold a poll of the current version open until the record changes
+    """
     try:
-        record = redis_repo.get_record(record_id=request_id)
-        print("record: ")
-        print(record)
+        version = redis_repo.get_version(request_id)
+        if version is not None and wait > 0 and not_modified(http_request, record_etag(version)):
+            version = await wait_for_version(request_id, version, min(wait, RECORD_WAIT_MAX))
+        if version is None:
+            return Response(status_code=404, content="Record not found")
+        if not_modified(http_request, record_etag(version)):
+            return Response(status_code=304, headers={"ETag": record_etag(version)})
+
+        try:
+            record = redis_repo.get_record(record_id=request_id, after=after)
+        except ValueError:
+            return Response(status_code=400, content="Invalid after")
         if record:
-            return JSONResponse(record)
+            return JSONResponse(record, headers={"ETag": record_etag(record["version"])})
         else:
             return Response(status_code=404, content="Record not found")
     except Exception:
         return ExceptionHandler.handle_exception()
 
 
+@app.get("/chat")
+async def chat_update(http_request: Request, request_id: str, after: Optional[str] = None, wait: float = 0):
+    return await record_response(http_request, request_id, after, wait)
+
+
+@app.post("/mind-map")
+async def mind_map_request(request: MindMapRequest):
+    try:
+        request_id = redis_repo.create_record()
+        cached_map = get_cached_mind_map(request.page_id)
+        trace.get_current_span().set_attributes({
+            "request_id": request_id, "page_id": request.page_id, "mind_map_cache.hit": cached_map is not None})
+        if cached_map is not None:
+            redis_repo.update_record(
+                record_id=request_id, record={"type": "mind_map", "content": cached_map})
+            redis_repo.update_record(
+                record_id=request_id, record={"type": "status", "content": "finished"})
+            return JSONResponse({"request_id": request_id})
+
+        if EXECUTION_MODE == "embedded":
+            embedded.submit(GENERATION_QUEUE, "generate_mind_map", build_mind_map, request_id, request.page_id)
+        else:
+            generate_mind_map_task.send(request_id, request.page_id)
+        return JSONResponse({"request_id": request_id})
+    except Exception:
+        return ExceptionHandler.handle_exception()
+
+
+@app.get("/mind-map")
+async def mind_map_update(http_request: Request, request_id: str, after: Optional[str] = None):
+    return await record_response(http_request, request_id, after)
+
+
+@app.post("/flow")
+async def flow_request(request: FlowRequest):
+    try:
+        # the context is built by the job, a selection matching none of the sources fails the record
+        source_count = get_source_count(request.page_id)
+        if not source_count or request.source_ids == []:
+            raise HTTPException(400, detail="No sources to build the flow from")
+        request_id = redis_repo.create_record()
+        cached_flow = get_cached_flow(
+            flow_cache_key(request.page_id, source_count, request.source_ids, request.instructions))
+        trace.get_current_span().set_attributes({
+            "request_id": request_id, "page_id": request.page_id, "flow_cache.hit": cached_flow is not None})
+        if cached_flow is not None:
+            redis_repo.update_record(
+                record_id=request_id, record={"type": "message", "content": cached_flow})
+            redis_repo.update_record(
+                record_id=request_id, record={"type": "status", "content": "finished"})
+            return JSONResponse({"request_id": request_id})
+
+        if EXECUTION_MODE == "embedded":
+            embedded.submit(
+                GENERATION_QUEUE, "generate_flow", build_flow,
+                request_id, request.page_id, request.source_ids, request.instructions)
+        else:
+            generate_flow_task.send(request_id, request.page_id, request.source_ids, request.instructions)
+        return JSONResponse({"request_id": request_id})
+    except HTTPException:
+        raise
+    except Exception:
+        return ExceptionHandler.handle_exception()
+
+
+@app.get("/flow")
+async def flow_update(http_request: Request, request_id: str, after: Optional[str] = None):
+    return await record_response(http_request, request_id, after)
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, proxy_headers=True, forwarded_allow_ips=FORWARDED_ALLOW_IPS)
@@ -1,19 +1,125 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
 from datetime import timedelta
+from typing import Optional
+import heapq
 import redis
 import json
+import re
+import threading
+import time
 import uuid
 
-class RedisRepository:
-    def __init__(self, prefix: str, redis_host: str, merge_type: str, redis_port: int = 6379, ttl: int = 300):
+from core.metrics import REDIS_CALL_DURATION, timed
+from core.logger import get_logger, sampled, truncate
+
+logger = get_logger(__name__)
+_STREAM_ID_PATTERN = re.compile(r"^\d+(-\d+)?$")
+_TERMINAL_STATUSES = ("finished", "cancelled")
+
+
+def terminal_status(state: dict) -> Optional[str]:
+    """
+    Returns:
+        Optional[str]: "finished", "cancelled" or "error" when the record state ends its record, None otherwise
+    """
+    if state.get("type") == "error":
+        return "error"
+    if state.get("type") == "status" and state.get("content") in _TERMINAL_STATUSES:
+        return state["content"]
+    return None
+
+
+class StateRepository(ABC):
+    """
+    Storage of the chat records polled by the clients. A record holds the current state, its
+    version and an update log of the superseded states.
+    """
+
+    @abstractmethod
+    def create_record(self, record: dict = None) -> str:
+        ...
+
+    @abstractmethod
+    def update_record(self, record_id: str, record: dict) -> bool:
+        ...
+
+    @abstractmethod
+    def get_record(self, record_id: str, after: str = None) -> dict:
+        ...
+
+    @abstractmethod
+    def get_version(self, record_id: str) -> Optional[int]:
+        """version of the record without reading it, None if the record does not exist"""
+
+    @abstractmethod
+    def cancel_record(self, record_id: str) -> Optional[str]:
+        """
+        flags a record as cancelled, the worker producing it stops at its next check
+
+        Args:
+            record_id (str): record id
+
+        Returns:
+            Optional[str]: "cancelling" when the record was flagged, its terminal status (see `terminal_status`)
+                when it already ended and nothing was flagged, None if the record does not exist
+        """
+
+    @abstractmethod
+    def is_cancelled(self, record_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def acquire_lock(self, name: str, ttl: int) -> bool:
+        """takes the lock `name` for `ttl` seconds unless it is already held, returns True if taken"""
+
+    @abstractmethod
+    def release_lock(self, name: str):
+        ...
+
+
+# Replaces the current state of a record. The superseded state is appended to the update log,
+# unless both states have the merge type (a streamed message replacing its previous chunk).
+# Returns the new version of the record, 0 if the record does not exist.
+_UPDATE_RECORD_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+local current_type = redis.call("HGET", KEYS[1], "type")
+if not (ARGV[2] == ARGV[3] and current_type == ARGV[3]) then
+    redis.call("XADD", KEYS[2], "MAXLEN", ARGV[5], "*", "state", redis.call("HGET", KEYS[1], "state"))
+    redis.call("EXPIRE", KEYS[2], ARGV[4])
+end
+local version = redis.call("HINCRBY", KEYS[1], "version", 1)
+redis.call("HSET", KEYS[1], "type", ARGV[2], "state", ARGV[1])
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+return version
+"""
+
+
+class RedisRepository(StateRepository):
+    """
+    Chat records: a small hash with the current state and its version, next to a capped stream
+    (the update log) holding the superseded states, so a write costs the same at any point of a chat.
+    """
+
+    def __init__(self, prefix: str, redis_host: str, merge_type: str, redis_port: int = 6379, ttl: int = 300,
+                 max_updates: int = 1000):
         self.redis_client = redis.StrictRedis(
             host=redis_host, port=redis_port, decode_responses=True)
         self.ttl = ttl
         self.prefix = prefix
         self.merge_type = merge_type
+        self.max_updates = max_updates
+        self._update_record = self.redis_client.register_script(_UPDATE_RECORD_SCRIPT)
 
     def _generate_key(self, record_id: str) -> str:
         return f"{self.prefix}:{record_id}"
 
+    def _updates_key(self, record_id: str) -> str:
+        return f"{self.prefix}:{record_id}:updates"
+
+    @timed(REDIS_CALL_DURATION, operation="create_record")
     def create_record(self, record: dict = None) -> str:
         record_id = str(uuid.uuid4())
         if not record:
@@ -22,41 +128,293 @@ class RedisRepository:
                 "content": "queued"
             }
         key = self._generate_key(record_id)
-        self.redis_client.setex(key, timedelta(
-            seconds=self.ttl), json.dumps(record))
+        with self.redis_client.pipeline() as pipe:
+            pipe.hset(key, mapping={"type": record.get("type", ""), "state": json.dumps(record), "version": 0})
+            pipe.expire(key, timedelta(seconds=self.ttl))
+            pipe.execute()
         return record_id
 
+    @timed(REDIS_CALL_DURATION, operation="update_record")
     def update_record(self, record_id: str, record: dict) -> bool:
-        key = self._generate_key(record_id)
-        print("Updating record: ", record)
-        if self.redis_client.exists(key):
-            existing_record = json.loads(self.redis_client.get(key))
+        logger.debug("Updating record %s - %s", record_id, truncate(record), extra=sampled())
+        version = self._update_record(
+            keys=[self._generate_key(record_id), self._updates_key(record_id)],
+            args=[json.dumps(record), record.get("type", ""), self.merge_type, self.ttl, self.max_updates]
+        )
+        return bool(version)
 
-            if 'updates' not in existing_record:
-                existing_record['updates'] = []
+    @timed(REDIS_CALL_DURATION, operation="get_version")
+    def get_version(self, record_id: str) -> Optional[int]:
+        version = self.redis_client.hget(self._generate_key(record_id), "version")
+        return None if version is None else int(version)
 
-            updates = existing_record.pop("updates")
+    def _cancel_key(self, record_id: str) -> str:
+        return f"{self.prefix}:{record_id}:cancel"
 
-            if ("type" in record and record['type'] == self.merge_type) and \
-                    ("type" in existing_record and existing_record['type'] == self.merge_type):
-                pass
-            else:
-                # Add current state to history
-                updates.append(existing_record.copy())
-            record['updates'] = updates
+    @timed(REDIS_CALL_DURATION, operation="cancel_record")
+    def cancel_record(self, record_id: str) -> Optional[str]:
+        state = self.redis_client.hget(self._generate_key(record_id), "state")
+        if state is None:
+            return None
+        status = terminal_status(json.loads(state))
+        if status is not None:
+            return status
+        self.redis_client.setex(self._cancel_key(record_id), timedelta(seconds=self.ttl), 1)
+        return "cancelling"
 
-            self.redis_client.setex(key, timedelta(
-                seconds=self.ttl), json.dumps(record))
+    @timed(REDIS_CALL_DURATION, operation="is_cancelled")
+    def is_cancelled(self, record_id: str) -> bool:
+        return bool(self.redis_client.exists(self._cancel_key(record_id)))
 
-            return True
-        return False
+    @timed(REDIS_CALL_DURATION, operation="acquire_lock")
+    def acquire_lock(self, name: str, ttl: int) -> bool:
+        return bool(self.redis_client.set(f"{self.prefix}:lock:{name}", 1, nx=True, ex=ttl))
 
-    def get_record(self, record_id: str) -> dict:
-        key = self._generate_key(record_id)
-        record = self.redis_client.get(key)
-        if record:
-            print("Fetching record: ")
-            print(record)
-            return json.loads(record)
-        print("No record found for id - ", record_id)
-        return None
+    @timed(REDIS_CALL_DURATION, operation="release_lock")
+    def release_lock(self, name: str):
+        self.redis_client.delete(f"{self.prefix}:lock:{name}")
+
+    @timed(REDIS_CALL_DURATION, operation="get_record")
+    def get_record(self, record_id: str, after: str = None) -> dict:
+        """
+        reads the current state of a record along with its update log
+
+        Args:
+            record_id (str): record id
+            after (str): id of the last update already seen, only newer updates are returned
+
+        Returns:
+            dict: current state with `updates` (the superseded states, oldest first), `version` and
+                `last_update_id` (to be passed as `after` on the next read), None if the record does not exist,
+                ValueError is raised when `after` is not an update id
+        """
+        if after and not _STREAM_ID_PATTERN.match(after):
+            raise ValueError(f"Invalid update id - {after}")
+        with self.redis_client.pipeline() as pipe:
+            pipe.hmget(self._generate_key(record_id), "state", "version")
+            pipe.xrange(self._updates_key(record_id), min=f"({after}" if after else "-")
+            (state, version), entries = pipe.execute()
+
+        if state is None:
+            logger.debug("No record found for id - %s", record_id)
+            return None
+        logger.debug("Fetched record %s - %s", record_id, truncate(state), extra=sampled())
+
+        record = json.loads(state)
+        record["updates"] = [json.loads(fields["state"]) for _, fields in entries]
+        record["version"] = int(version)
+        record["last_update_id"] = entries[-1][0] if entries else after
+        return record
+
+
+class RedisLRUCache:
+    """JSON value cache with a TTL per entry and least-recently-used eviction beyond `max_entries`."""
+
+    def __init__(self, redis_client: redis.StrictRedis, namespace: str, ttl: int, max_entries: int):
+        self.redis_client = redis_client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # sorted sets of the cache keys scored by their last access time and by their expiry time
+        self.index_key = f"{namespace}:index"
+        self.expiry_key = f"{namespace}:expiry"
+
+    def _generate_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    @timed(REDIS_CALL_DURATION, operation="cache_get")
+    def get(self, key: str):
+        value = self.redis_client.get(self._generate_key(key))
+        if value is None:
+            return None
+        self.redis_client.zadd(self.index_key, {key: time.time()})
+        return json.loads(value)
+
+    @timed(REDIS_CALL_DURATION, operation="cache_set")
+    def set(self, key: str, value, ttl: int = None):
+        ttl = ttl or self.ttl
+        now = time.time()
+        with self.redis_client.pipeline() as pipe:
+            pipe.setex(self._generate_key(key), timedelta(seconds=ttl), json.dumps(value))
+            pipe.zadd(self.index_key, {key: now})
+            pipe.zadd(self.expiry_key, {key: now + ttl})
+            pipe.zrangebyscore(self.expiry_key, 0, now)
+            expired = pipe.execute()[-1]
+
+        # entries that expired on their own are dropped from the index before counting
+        with self.redis_client.pipeline() as pipe:
+            if expired:
+                pipe.zrem(self.index_key, *expired)
+                pipe.zrem(self.expiry_key, *expired)
+            pipe.zcard(self.index_key)
+            size = pipe.execute()[-1]
+
+        if size > self.max_entries:
+            evicted = self.redis_client.zrange(self.index_key, 0, size - self.max_entries - 1)
+            if evicted:
+                with self.redis_client.pipeline() as pipe:
+                    pipe.delete(*[self._generate_key(evicted_key) for evicted_key in evicted])
+                    pipe.zrem(self.index_key, *evicted)
+                    pipe.zrem(self.expiry_key, *evicted)
+                    pipe.execute()
+
+    @timed(REDIS_CALL_DURATION, operation="cache_delete")
+    def delete(self, key: str):
+        with self.redis_client.pipeline() as pipe:
+            pipe.delete(self._generate_key(key))
+            pipe.zrem(self.index_key, key)
+            pipe.zrem(self.expiry_key, key)
+            pipe.execute()
+
+
+class MemoryRepository(StateRepository):
+    """
+    In-process `StateRepository` for the embedded mode, the records are only visible to the
+    process that created them.
+    """
+
+    def __init__(self, merge_type: str, ttl: int = 300, max_updates: int = 1000):
+        self.ttl = ttl
+        self.merge_type = merge_type
+        self.max_updates = max_updates
+        self._records: dict[str, dict] = {}
+        self._cancelled: dict[str, float] = {}
+        self._locks: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _purge(self, now: float):
+        for record_id in [record_id for record_id, entry in self._records.items() if entry["expires"] <= now]:
+            self._records.pop(record_id)
+            self._cancelled.pop(record_id, None)
+        for name in [name for name, expires in self._locks.items() if expires <= now]:
+            self._locks.pop(name)
+
+    def _get_entry(self, record_id: str) -> dict:
+        entry = self._records.get(record_id)
+        if entry is None or entry["expires"] <= time.monotonic():
+            return None
+        return entry
+
+    def create_record(self, record: dict = None) -> str:
+        record_id = str(uuid.uuid4())
+        if not record:
+            record = {
+                "type": "status",
+                "content": "queued"
+            }
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            self._records[record_id] = {
+                "state": json.dumps(record), "type": record.get("type", ""), "version": 0, "sequence": 0,
+                "updates": deque(maxlen=self.max_updates), "expires": now + self.ttl
+            }
+        return record_id
+
+    def update_record(self, record_id: str, record: dict) -> bool:
+        with self._lock:
+            entry = self._get_entry(record_id)
+            if entry is None:
+                return False
+            if not (record.get("type") == self.merge_type and entry["type"] == self.merge_type):
+                entry["sequence"] += 1
+                entry["updates"].append((entry["sequence"], entry["state"]))
+            entry["state"] = json.dumps(record)
+            entry["type"] = record.get("type", "")
+            entry["version"] += 1
+            entry["expires"] = time.monotonic() + self.ttl
+        return True
+
+    def get_record(self, record_id: str, after: str = None) -> dict:
+        with self._lock:
+            entry = self._get_entry(record_id)
+            if entry is None:
+                return None
+            if after and not after.isdigit():
+                raise ValueError(f"Invalid update id - {after}")
+            after_sequence = int(after) if after else 0
+            updates = [(sequence, state) for sequence, state in entry["updates"] if sequence > after_sequence]
+            record = json.loads(entry["state"])
+            record["version"] = entry["version"]
+
+        record["updates"] = [json.loads(state) for _, state in updates]
+        record["last_update_id"] = str(updates[-1][0]) if updates else after
+        return record
+
+    def get_version(self, record_id: str) -> Optional[int]:
+        with self._lock:
+            entry = self._get_entry(record_id)
+            return None if entry is None else entry["version"]
+
+    def cancel_record(self, record_id: str) -> Optional[str]:
+        with self._lock:
+            entry = self._get_entry(record_id)
+            if entry is None:
+                return None
+            status = terminal_status(json.loads(entry["state"]))
+            if status is not None:
+                return status
+            self._cancelled[record_id] = time.monotonic()
+        return "cancelling"
+
+    def is_cancelled(self, record_id: str) -> bool:
+        return record_id in self._cancelled
+
+    def acquire_lock(self, name: str, ttl: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._locks.get(name, 0) > now:
+                return False
+            self._locks[name] = now + ttl
+        return True
+
+    def release_lock(self, name: str):
+        with self._lock:
+            self._locks.pop(name, None)
+
+
+class MemoryLRUCache:
+    """In-process counterpart of `RedisLRUCache` for the embedded mode."""
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._expiries: list[tuple[float, str]] = []  # heap of (expiry, key), stale items are skipped
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(value)
+
+    def set(self, key: str, value, ttl: int = None):
+        # values are serialized like in Redis so callers never share mutable objects with the cache
+        now = time.monotonic()
+        entry = (now + (ttl or self.ttl), json.dumps(value))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            heapq.heappush(self._expiries, (entry[0], key))
+            # entries that expired on their own go first, so they never push out live ones
+            while self._expiries and self._expiries[0][0] <= now:
+                expires, expired_key = heapq.heappop(self._expiries)
+                current = self._entries.get(expired_key)
+                if current is not None and current[0] == expires:
+                    del self._entries[expired_key]
+            if len(self._expiries) > 2 * self.max_entries:
+                self._expiries = [(expires, entry_key) for entry_key, (expires, _) in self._entries.items()]
+                heapq.heapify(self._expiries)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
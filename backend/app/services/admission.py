@@ -0,0 +1,202 @@
+from typing import Optional
+import threading
+import time
+
+import redis
+
+from config import (
+    redis_repo, EXECUTION_MODE, REDIS_PREFIX, CHAT_QUEUE, CHAT_RATE_LIMITS, UPLOAD_RATE_LIMITS,
+    MAX_CHAT_BACKLOG, CHAT_BACKLOG_RETRY_AFTER, CHAT_MAX_DURATION
+)
+from core.metrics import ADMISSION_REJECTIONS
+
+RATE_LIMIT_PREFIX = f"{REDIS_PREFIX}:rate-limit"
+CHATS_IN_FLIGHT_KEY = f"{REDIS_PREFIX}:chats-in-flight"
+# dramatiq keeps the ids of the queued messages in a list named after the namespace and queue
+CHAT_QUEUE_KEY = f"{REDIS_PREFIX}:{CHAT_QUEUE}"
+
+# Takes one token from every bucket in KEYS, or from none of them when one is empty.
+# ARGV holds the capacity and refill rate (tokens per second) of each bucket.
+# Returns 0 when admitted, otherwise the seconds until all buckets have a token again.
+_TOKEN_BUCKET_SCRIPT = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local bucket = redis.call("HMGET", key, "tokens", "ts")
+    local available = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local available = tokens[i]
+    if wait == 0 then
+        available = available - 1
+    end
+    redis.call("HSET", key, "tokens", tostring(available), "ts", tostring(now))
+    redis.call("PEXPIRE", key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return tostring(wait)
+"""
+
+
+class RedisTokenBuckets:
+    """Token buckets shared by all API processes, updated by `_TOKEN_BUCKET_SCRIPT`."""
+
+    def __init__(self, redis_client: redis.StrictRedis):
+        self._take_tokens = redis_client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    def take(self, buckets: dict[str, tuple[float, float]]) -> float:
+        args = [value for limits in buckets.values() for value in limits]
+        return float(self._take_tokens(keys=list(buckets), args=args))
+
+
+class MemoryTokenBuckets:
+    """Token buckets of this process, same semantics as `RedisTokenBuckets` for the embedded mode."""
+
+    def __init__(self, max_buckets: int = 100000):
+        self.max_buckets = max_buckets
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets: dict[str, tuple[float, float]]) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens = {}
+            wait = 0
+            for key, (capacity, rate) in buckets.items():
+                available, ts = self._buckets.get(key, (capacity, now))
+                available = min(capacity, available + max(0, now - ts) * rate)
+                tokens[key] = available
+                if available < 1:
+                    wait = max(wait, (1 - available) / rate)
+            for key, available in tokens.items():
+                self._buckets[key] = (available - 1 if wait == 0 else available, now)
+            if len(self._buckets) > self.max_buckets:
+                # drops the least recently used half, a dropped bucket starts full again like an expired Redis one
+                for key in sorted(self._buckets, key=lambda key: self._buckets[key][1])[:len(self._buckets) // 2]:
+                    del self._buckets[key]
+        return wait
+
+
+if EXECUTION_MODE == "embedded":
+    token_buckets = MemoryTokenBuckets()
+else:
+    token_buckets = RedisTokenBuckets(redis_repo.redis_client)
+
+
+def take_tokens(buckets: dict[str, tuple[float, float]]) -> float:
+    """
+    takes a token from each of the given token buckets, atomically
+
+    Args:
+        buckets (dict[str, tuple[float, float]]): capacity and refill rate (tokens per second) by bucket key
+
+    Returns:
+        float: 0 if the tokens were taken, otherwise seconds to wait before retrying
+    """
+    return token_buckets.take(buckets)
+
+
+def _rate_limit_buckets(endpoint: str, limits: dict[str, tuple[float, float]], page_id: str, client_id: str):
+    scopes = {"page": page_id, "client": client_id}
+    return {f"{RATE_LIMIT_PREFIX}:{endpoint}:{scope}:{scopes[scope]}": limit for scope, limit in limits.items()}
+
+
+def chat_backlog() -> int:
+    """
+    Returns:
+        int: chats waiting in the chat queue plus chats being generated by the workers
+    """
+    if EXECUTION_MODE == "embedded":
+        from services.embedded import chat_pool
+        return chat_pool.backlog
+
+    # chats that never reported their end (worker crash) are dropped after the longest chat duration
+    with redis_repo.redis_client.pipeline() as pipe:
+        pipe.zremrangebyscore(CHATS_IN_FLIGHT_KEY, 0, time.time() - CHAT_MAX_DURATION)
+        pipe.zcard(CHATS_IN_FLIGHT_KEY)
+        pipe.llen(CHAT_QUEUE_KEY)
+        _, in_flight, queued = pipe.execute()
+    return in_flight + queued
+
+
+def track_chat_started(request_id: str):
+    # the embedded pool knows its chats, only the workers report theirs
+    if EXECUTION_MODE == "embedded":
+        return
+    redis_repo.redis_client.zadd(CHATS_IN_FLIGHT_KEY, {request_id: time.time()})
+
+
+def track_chat_finished(request_id: str):
+    if EXECUTION_MODE == "embedded":
+        return
+    redis_repo.redis_client.zrem(CHATS_IN_FLIGHT_KEY, request_id)
+
+
+def admit_chat(page_id: str, client_id: str, queued: bool = True) -> Optional[float]:
+    """
+    decides whether a chat request is accepted, based on the per page and per client rate limits
+    and, for chats that go through the queue, on the chat backlog
+
+    Args:
+        page_id (str): page of the chat
+        client_id (str): address of the client
+        queued (bool): False when the chat is answered without the worker (cached answer)
+
+    Returns:
+        Optional[float]: None if admitted, otherwise seconds the client should wait before retrying
+    """
+    # the backlog is checked first so that a chat refused for it does not cost the client a token
+    if queued and chat_backlog() >= MAX_CHAT_BACKLOG:
+        ADMISSION_REJECTIONS.labels("chat", "backlog").inc()
+        return CHAT_BACKLOG_RETRY_AFTER
+    retry_after = take_tokens(_rate_limit_buckets("chat", CHAT_RATE_LIMITS, page_id, client_id))
+    if retry_after:
+        ADMISSION_REJECTIONS.labels("chat", "rate_limit").inc()
+        return retry_after
+    return None
+
+
+def admit_upload(page_id: str, client_id: str) -> Optional[float]:
+    """
+    decides whether an upload is accepted, based on the per page and per client rate limits
+
+    Args:
+        page_id (str): page the source is added to
+        client_id (str): address of the client
+
+    Returns:
+        Optional[float]: None if admitted, otherwise seconds the client should wait before retrying
+    """
+    retry_after = take_tokens(_rate_limit_buckets("upload", UPLOAD_RATE_LIMITS, page_id, client_id))
+    if retry_after:
+        ADMISSION_REJECTIONS.labels("upload", "rate_limit").inc()
+        return retry_after
+    return None
+
+
+class InFlightLimiter:
+    """Counts the requests of a kind running in this process and refuses new ones above `limit`."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
@@ -0,0 +1,45 @@
+from typing import Optional
+import hashlib
+
+from config import answer_cache
+from core.db import get_conversation_data
+from helper.text import normalize_query
+from helper.utils import source_set_version
+
+
+def answer_cache_key(query: str, page_id: str) -> Optional[str]:
+    """
+    builds the answer cache key of a query, the key changes whenever the sources of the page change.
+    Only queries asked without conversation context are cached and served, an answer to a follow-up
+    depends on the turns before it
+
+    Args:
+        query (str): user query
+        page_id (str): conversation id of the page
+
+    Returns:
+        Optional[str]: cache key, None when the conversation has a history or a running summary
+    """
+    conversation_data = get_conversation_data(page_id)
+    if conversation_data.get("history") or conversation_data.get("summary"):
+        return None
+    query_hash = hashlib.sha256(normalize_query(query).encode()).hexdigest()
+    return f"{page_id}:{source_set_version(page_id)}:{query_hash}"
+
+
+def get_cached_answer(query: str, page_id: str) -> Optional[str]:
+    cache_key = answer_cache_key(query, page_id)
+    entry = answer_cache.get(cache_key) if cache_key else None
+    return entry["answer"] if entry else None
+
+
+def cache_answer(cache_key: Optional[str], answer: str):
+    """
+    Args:
+        cache_key (Optional[str]): key taken by `answer_cache_key` before the answer was generated,
+            the turn of the answer is already in the conversation history by now
+        answer (str): generated answer
+    """
+    if not cache_key or not answer:
+        return
+    answer_cache.set(cache_key, {"answer": answer})
@@ -1,58 +1,98 @@
-from langgraph.prebuilt import create_react_agent
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
 from langchain_core.prompts import PromptTemplate
+from typing import Any, Dict
+import asyncio
+import time
 
-from config import CHAT_AGENT_MODEL
+from config import (
+    CHAT_AGENT_MODEL, CHAT_HISTORY_WINDOW,
+    CHAT_HISTORY_TURN_MAX_CHARS, CHAT_SUMMARY_MAX_WORDS
+)
+from core.db import get_conversation_data, append_conversation_turn, compact_conversation_history
+from core.tracing import tracer
+from core.logger import get_logger
+from core.metrics import LLM_LATENCY, record_llm_usage
 from helper.utils import build_sources_description
 from core.schema import UpdateState
 from .tools import create_tools_for_request
-from .mcp import create_mcp_tools
 from .prompts import CHAT_AGENT_PROMPT
+from .summarizer import summarize_history
+from .citations import CitationResolver
+from .llm import get_chat_model
 
-llm = ChatGoogleGenerativeAI(model=CHAT_AGENT_MODEL, temperature=0.7)
 prompt = PromptTemplate(
     template=CHAT_AGENT_PROMPT,
-    input_variables=['sources']
+    input_variables=['sources', 'conversation_summary']
 )
+logger = get_logger(__name__)
+# keeps references to fire-and-forget tasks so they are not garbage collected mid-run
+_background_tasks = set()
+
+def _clip(text: str, max_chars: int) -> str:
+    return text if len(text) <= max_chars else text[:max_chars] + " ...[truncated]"
+
+
+def build_history_messages(conversation_data: Dict[str, Any]) -> list[BaseMessage]:
+    """
+    builds the chat messages replayed to the agent from the most recent turns of the conversation,
+    the window and the size of every turn are capped so the prompt size does not grow with the conversation
+
+    Args:
+        conversation_data (Dict[str, Any]): conversation data holding the `history` of turns
+
+    Returns:
+        list[BaseMessage]: alternating human and AI messages
+    """
+    messages = []
+    for turn in conversation_data.get("history", [])[-CHAT_HISTORY_WINDOW:]:
+        messages.append(HumanMessage(content=_clip(turn["query"], CHAT_HISTORY_TURN_MAX_CHARS)))
+        messages.append(AIMessage(content=_clip(turn["answer"], CHAT_HISTORY_TURN_MAX_CHARS)))
+    return messages
+
+
+async def compact_history(conversation_id: str, conversation_data: Dict[str, Any]):
+    """
+    folds the turns that fell out of the history window into the running summary of the conversation
+
+    Args:
+        conversation_id (str): conversation id
+        conversation_data (Dict[str, Any]): conversation data after the latest turn was appended
+    """
+    history = conversation_data.get("history", [])
+    if len(history) <= CHAT_HISTORY_WINDOW:
+        return
+
+    compacted_turns = history[:len(history) - CHAT_HISTORY_WINDOW]
+    clipped_turns = [
+        {"query": _clip(turn["query"], CHAT_HISTORY_TURN_MAX_CHARS),
+         "answer": _clip(turn["answer"], CHAT_HISTORY_TURN_MAX_CHARS)}
+        for turn in compacted_turns
+    ]
+    try:
+        summary = await summarize_history(conversation_data.get("summary", ""), clipped_turns)
+        compact_conversation_history(conversation_id, compacted_turns, summary)
+    except Exception as e:
+        logger.warning("Exception in history compaction - %r", e)
+
+
+async def agent_response(query: str, sources: str, tools: list,
+                         history: list[BaseMessage] = None, conversation_summary: str = ""):
+    # langgraph is imported with the first chat, it is the slowest import of the API
+    from langgraph.prebuilt import create_react_agent
 
-class MCPToolsManager:
-    _instance = None
-    _tools = None
-    _cleanup = None
-    _initialized = False
-    
-    @classmethod
-    async def get_instance(cls):
-        if cls._instance is None:
-            cls._instance = MCPToolsManager()
-        return cls._instance
-    
-    async def ensure_initialized(self):
-        if not self._initialized:
-            print("Retrying, you stupid")
-            self._tools, self._cleanup = await create_mcp_tools()
-            self._initialized = True
-    
-    def get_tools(self):
-        return self._tools
-    
-    async def cleanup_resources(self):
-        if self._cleanup and self._initialized:
-            await self._cleanup()
-            self._tools = None
-            self._cleanup = None
-            self._initialized = False
-
-
-async def agent_response(query: str, sources: str, tools: list):
     agent = create_react_agent(
-        llm, tools, prompt=prompt.format(sources=sources))
+        get_chat_model(CHAT_AGENT_MODEL, 0.7), tools, prompt=prompt.format(
+            sources=sources, conversation_summary=conversation_summary or "None"))
     response_generator = agent.astream(
-        {"messages": query}, stream_mode="messages")
+        {"messages": (history or []) + [HumanMessage(content=query)]}, stream_mode="messages")
 
     message = ""
-    async for chunk in response_generator:
-        chunk = chunk[0].content
+    async for chunk, _ in response_generator:
+        # tool results are streamed as well, only the text of the model is part of the answer
+        if not isinstance(chunk, AIMessageChunk):
+            continue
+        record_llm_usage("chat_agent", chunk.usage_metadata)
+        chunk = chunk.content
 
         if chunk:
             message += chunk
@@ -61,27 +101,44 @@ async def agent_response(query: str, sources: str, tools: list):
 
 async def chat(query: str, conversation_id: str, request_id: str, redis_repo):
     yield UpdateState(type="status", content="Started Response generation")
-    sources_description = build_sources_description(conversation_id)
+    with tracer.start_as_current_span("chat.build_sources_description"):
+        sources_description = build_sources_description(conversation_id)
+    with tracer.start_as_current_span("chat.load_history"):
+        conversation_data = get_conversation_data(conversation_id)
+        history = build_history_messages(conversation_data)
+    # the word cap is enforced by the summarizer prompt, clip as a safeguard against overlong output
+    conversation_summary = _clip(conversation_data.get("summary", ""), CHAT_SUMMARY_MAX_WORDS * 10)
     tools = create_tools_for_request(request_id, redis_repo)
-    
-    mcp_manager = await MCPToolsManager.get_instance()
-    await mcp_manager.ensure_initialized()
-    mcp_tools = mcp_manager.get_tools()
-    
-    try:
-        agent_generator = agent_response(
-            query, sources_description, tools + mcp_tools)
+    with tracer.start_as_current_span("chat.mcp_tools"):
+        from .mcp import create_mcp_tools
+        mcp_tools = await create_mcp_tools()
+
+    answer = ""
+    citations = CitationResolver(conversation_id)
+    agent_generator = agent_response(
+        query, sources_description, tools + mcp_tools,
+        history=history, conversation_summary=conversation_summary)
+    # tool calls of the agent are recorded as children of this span
+    with tracer.start_as_current_span("chat.agent", attributes={"history.turns": len(history) // 2}) as span:
+        started = time.perf_counter()
         async for response in agent_generator:
+            if not answer:
+                time_to_first_token = time.perf_counter() - started
+                span.set_attribute("llm.time_to_first_token_ms", round(time_to_first_token * 1000))
+                LLM_LATENCY.labels("chat_agent", "first_token").observe(time_to_first_token)
+            answer = response.content
             yield response
-    except Exception as e:
-        await mcp_manager.cleanup_resources()
-        raise e
-    finally:
-        pass
+            resolved = await citations.resolve(answer)
+            if resolved:
+                yield UpdateState(type="citations", content=resolved)
+        span.set_attribute("answer.chars", len(answer))
+        LLM_LATENCY.labels("chat_agent", "total").observe(time.perf_counter() - started)
 
-    yield UpdateState(type="status", content="Finished Response generation")
+    conversation_data = append_conversation_turn(
+        conversation_id, {"query": query, "answer": answer})
+    if len(conversation_data.get("history", [])) > CHAT_HISTORY_WINDOW:
+        task = asyncio.create_task(compact_history(conversation_id, conversation_data))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
-
-async def shutdown_mcp_tools():
-    mcp_manager = await MCPToolsManager.get_instance()
-    await mcp_manager.cleanup_resources()
+    yield UpdateState(type="status", content="Finished Response generation")
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+from opentelemetry import trace
+
+from config import CHAT_CANCEL_POLL_INTERVAL, redis_repo
+from core.schema import ChatRequest
+from core.tracing import tracer
+from core.logger import get_logger, log_context, sampled, truncate
+from core.metrics import CHAT_DURATION, CHATS_IN_PROGRESS
+from services.chat_agent import chat
+from services.admission import track_chat_started, track_chat_finished
+from services.answer_cache import answer_cache_key, cache_answer
+
+logger = get_logger(__name__)
+
+
+async def run_chat(request_id: str, request: ChatRequest):
+    """
+    streams the answer of a chat into its record, until it finishes, fails or is cancelled
+
+    Args:
+        request_id (str): id of the chat record
+        request (ChatRequest): chat request
+    """
+    trace.get_current_span().set_attributes({"request_id": request_id, "page_id": request.page_id})
+    with log_context(request_id=request_id, page_id=request.page_id):
+        track_chat_started(request_id)
+        try:
+            await _run_chat(request_id, request)
+        finally:
+            track_chat_finished(request_id)
+
+
+async def _watch_cancellation(request_id: str, task: asyncio.Task) -> bool:
+    """cancels `task` once the chat is flagged as cancelled, returns True if it did"""
+    while True:
+        await asyncio.sleep(CHAT_CANCEL_POLL_INTERVAL)
+        if redis_repo.is_cancelled(request_id):
+            task.cancel()
+            return True
+
+
+def _mark_cancelled(request_id: str):
+    redis_repo.update_record(record_id=request_id, record={"type": "status", "content": "cancelled"})
+
+
+async def _run_chat(request_id: str, request: ChatRequest):
+    if redis_repo.is_cancelled(request_id):
+        logger.info("Chat cancelled before it started")
+        _mark_cancelled(request_id)
+        return
+    logger.info("Chat started - %s", truncate(request.query))
+
+    # the key is taken before generation so the answer is cached against the sources and the context it was built from
+    cache_key = answer_cache_key(request.query, request.page_id)
+    response_generator = chat(request.query, request.page_id, request_id, redis_repo)
+
+    answer = ""
+    updates = 0
+    started = time.perf_counter()
+    outcome = "error"
+    task = asyncio.current_task()
+    watcher = asyncio.create_task(_watch_cancellation(request_id, task))
+    with CHATS_IN_PROGRESS.track_inprogress():
+        try:
+            # cancelling this task stops the agent stream together with its running tool calls
+            async for state in response_generator:
+                logger.debug("Received state - %s", truncate(state), extra=sampled())
+                if state.type == "message":
+                    answer = state.content
+                state = state.model_dump()
+
+                with tracer.start_as_current_span("redis.update_record", attributes={"update.type": state["type"]}):
+                    redis_repo.update_record(record_id=request_id, record=state)
+                updates += 1
+            outcome = "success"
+        except asyncio.CancelledError:
+            if not (watcher.done() and not watcher.cancelled() and watcher.result()):
+                raise
+            task.uncancel()
+            outcome = "cancelled"
+        except Exception:
+            logger.exception("Chat failed after %d updates", updates)
+            raise
+        finally:
+            # no await until here, so the watcher cannot cancel the task past the stream
+            watcher.cancel()
+            CHAT_DURATION.labels(outcome).observe(time.perf_counter() - started)
+
+    if outcome == "cancelled":
+        logger.info("Chat cancelled after %.2fs and %d updates", time.perf_counter() - started, updates)
+        _mark_cancelled(request_id)
+        return
+
+    cache_answer(cache_key, answer)
+    with tracer.start_as_current_span("redis.update_record", attributes={"update.type": "status"}):
+        redis_repo.update_record(record_id=request_id, record={"type": "status", "content": "finished"})
+    logger.info("Chat finished in %.2fs with %d updates, answer of %d chars",
+                time.perf_counter() - started, updates, len(answer))
@@ -0,0 +1,125 @@
+from collections import defaultdict
+from typing import Any, Optional
+import asyncio
+import math
+import re
+import uuid
+
+from core.db import get_citation_indexes
+from core.logger import get_logger
+from helper.text import index_terms
+
+logger = get_logger(__name__)
+_CITATION_PATTERN = re.compile(r"\[Source ID:\s*([^\]]+)\]")
+_SENTENCE_BOUNDARY_PATTERN = re.compile(r"[.!?](?:\s+|$)|\n+")
+_CLAIM_WINDOW = 1000  # characters before a citation searched for the sentence it supports
+
+
+def cited_claim(answer: str, position: int) -> str:
+    """
+    Returns:
+        str: sentence of the answer ending at `position`, or the previous one when the citation follows
+            the end of its sentence, without the citation markers
+    """
+    text = _CITATION_PATTERN.sub(" ", answer[max(0, position - _CLAIM_WINDOW):position]).rstrip()
+    boundaries = [match.end() for match in _SENTENCE_BOUNDARY_PATTERN.finditer(text)]
+    start = next((boundary for boundary in reversed(boundaries) if text[boundary:].strip()), 0)
+    return text[start:].strip()
+
+
+def match_chunk(index: dict, claim: str) -> Optional[tuple[int, float]]:
+    """
+    finds the chunk of a source sharing the most distinctive terms with a claim, terms are weighted
+    by how rare they are among the chunks of the source
+
+    Args:
+        index (dict): citation index built by `build_citation_index`
+        claim (str): cited text
+
+    Returns:
+        Optional[tuple[int, float]]: index and score of the best chunk, None when no term matches
+    """
+    chunks = index.get("chunks") or []
+    scores = defaultdict(float)
+    for term in set(index_terms(claim)):
+        chunk_ids = index["terms"].get(term)
+        if chunk_ids:
+            weight = math.log(1 + len(chunks) / len(chunk_ids))
+            for chunk_id in chunk_ids:
+                scores[chunk_id] += weight
+    if not scores:
+        return None
+    best = max(scores, key=lambda chunk_id: (scores[chunk_id], -chunk_id))
+    return best, scores[best]
+
+
+class CitationResolver:
+    """
+    Resolves the `[Source ID: ...]` citations of a streamed answer to the source chunk they most likely
+    refer to. The answer is fed as it grows, every citation is resolved once, as soon as it is complete.
+    """
+
+    def __init__(self, conversation_id: str):
+        self.conversation_id = conversation_id
+        self._indexes: dict[str, Optional[dict]] = {}
+        self._resolved_until = 0  # end offset of the last resolved citation in the answer
+
+    async def _load_indexes(self, source_ids: set[str]):
+        """loads the indexes of the sources not loaded yet in one query, off the event loop"""
+        normalized = {}
+        for source_id in source_ids - self._indexes.keys():
+            try:
+                normalized[source_id] = str(uuid.UUID(source_id))
+            except ValueError:
+                self._indexes[source_id] = None
+        if not normalized:
+            return
+        try:
+            indexes = await asyncio.to_thread(
+                get_citation_indexes, self.conversation_id, list(normalized.values()))
+        except Exception:
+            # the citations are still emitted, without a span, the next call tries to load the indexes again
+            logger.warning("Failed to load the citation indexes of %s", list(normalized), exc_info=True)
+            return
+        for source_id, normalized_id in normalized.items():
+            self._indexes[source_id] = indexes.get(normalized_id)
+
+    async def resolve(self, answer: str) -> list[dict[str, Any]]:
+        """
+        resolves the citations completed since the previous call
+
+        Args:
+            answer (str): answer streamed so far
+
+        Returns:
+            list[dict[str, Any]]: new citations with the `source_id`, the `offset` [start, end) of the
+                marker in the answer, the `chunk` index, the `span` [start, end) of the chunk in the source
+                content and the match `score`, the last three are None when no chunk matches.
+                Citations of sources that are not part of the page are left out.
+        """
+        matches = list(_CITATION_PATTERN.finditer(answer, self._resolved_until))
+        if not matches:
+            return []
+        cited = [[part.strip() for part in match.group(1).split(",")] for match in matches]
+        await self._load_indexes({source_id for source_ids in cited for source_id in source_ids})
+
+        citations = []
+        for match, source_ids in zip(matches, cited):
+            claim = cited_claim(answer, match.start())
+            for source_id in source_ids:
+                # a source whose index failed to load is cited without a span
+                index = self._indexes.get(source_id, {})
+                if index is None:
+                    logger.debug("Citation of unknown source %s", source_id)
+                    continue
+                citation = {"source_id": source_id, "offset": [match.start(), match.end()],
+                            "chunk": None, "span": None, "score": None}
+                try:
+                    best = match_chunk(index, claim) if index else None
+                    if best:
+                        citation.update(chunk=best[0], span=index["chunks"][best[0]], score=round(best[1], 3))
+                except Exception:
+                    logger.warning("Failed to resolve a citation of %s", source_id, exc_info=True)
+                citations.append(citation)
+            self._resolved_until = match.end()
+        return citations
@@ -0,0 +1,102 @@
+from typing import Any, Awaitable, Callable
+import asyncio
+import time
+
+from opentelemetry import trace
+
+from config import CHAT_QUEUE, GENERATION_QUEUE, INGESTION_QUEUE, QUEUE_CONCURRENCY
+from core.tracing import tracer, record_exception
+from core.logger import get_logger
+from core.metrics import ACTOR_MESSAGES, ACTOR_DURATION
+
+logger = get_logger(__name__)
+
+
+class TaskPool:
+    """
+    Runs the jobs of a queue as asyncio tasks of the API process in the embedded mode, at most
+    `concurrency` of them at the same time, the others wait their turn in submission order.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def backlog(self) -> int:
+        """jobs waiting for a slot plus jobs running"""
+        return len(self._tasks)
+
+    def submit(self, name: str, function: Callable[..., Awaitable[Any]], *args: Any) -> asyncio.Task:
+        """
+        schedules a job on the event loop of the caller
+
+        Args:
+            name (str): job name, reported like the actor name of the queued mode
+            function (Callable[..., Awaitable[Any]]): coroutine function of the job
+            *args: arguments of the job
+
+        Returns:
+            asyncio.Task: task running the job
+        """
+        task = asyncio.create_task(self._run(name, function, args, time.time()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, name: str, function: Callable[..., Awaitable[Any]], args: tuple, submitted: float):
+        async with self._semaphore:
+            started = time.perf_counter()
+            outcome = "error"
+            with tracer.start_as_current_span(
+                    f"embedded.process {name}", kind=trace.SpanKind.CONSUMER,
+                    attributes={"messaging.queue_wait_ms": int((time.time() - submitted) * 1000)}) as span:
+                try:
+                    await function(*args)
+                    outcome = "success"
+                except Exception as e:
+                    # nobody awaits the task, the error stops here
+                    logger.exception("Job %s failed", name)
+                    record_exception(span, e)
+                finally:
+                    ACTOR_MESSAGES.labels(name, outcome).inc()
+                    ACTOR_DURATION.labels(name).observe(time.perf_counter() - started)
+
+    async def shutdown(self):
+        """cancels the jobs still pending or running and waits for them to stop"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+pools = {
+    queue_name: TaskPool(QUEUE_CONCURRENCY[queue_name])
+    for queue_name in (CHAT_QUEUE, GENERATION_QUEUE, INGESTION_QUEUE)
+}
+chat_pool = pools[CHAT_QUEUE]
+
+
+def submit(queue_name: str, name: str, function: Callable[..., Awaitable[Any]], *args: Any) -> asyncio.Task:
+    """schedules a job on the pool of `queue_name`, see `TaskPool.submit`"""
+    return pools[queue_name].submit(name, function, *args)
+
+
+def submit_later(delay: float, queue_name: str, name: str, function: Callable[..., Awaitable[Any]], *args: Any):
+    """schedules a job on the pool of `queue_name` in `delay` seconds, like a delayed dramatiq message"""
+    asyncio.get_running_loop().call_later(delay, submit, queue_name, name, function, *args)
+
+
+async def start():
+    """starts the MCP servers used by the chats, in place of the worker boot of the queued mode"""
+    from services.mcp import mcp_pool
+    await mcp_pool.start(wait=False)
+    logger.info("Embedded mode, MCP servers starting: %s", list(mcp_pool.servers))
+
+
+async def stop():
+    from services.mcp import mcp_pool
+    for pool in pools.values():
+        await pool.shutdown()
+    await mcp_pool.stop()
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+import time
+
+from config import (
+    CONVERSATION_EXPIRY_MINUTES, CONVERSATION_EXPIRY_INTERVAL, CONVERSATION_EXPIRY_BATCH_SIZE,
+    CONVERSATION_EXPIRY_BATCH_INTERVAL, CONVERSATION_EXPIRY_MAX_BATCHES, redis_repo
+)
+from core.db import delete_expired_conversations
+from core.logger import get_logger
+from core.metrics import EXPIRED_CONVERSATIONS, EXPIRED_SOURCES, EXPIRED_CONTENT_BYTES, EXPIRY_BATCH_DURATION
+from core.tracing import tracer
+
+logger = get_logger(__name__)
+_LOCK_NAME = "conversation-expiry"
+
+
+def expire_conversations():
+    """
+    deletes the conversations without activity for `CONVERSATION_EXPIRY_MINUTES`, in batches of
+    `CONVERSATION_EXPIRY_BATCH_SIZE` spaced by `CONVERSATION_EXPIRY_BATCH_INTERVAL` seconds, so that
+    a large backlog never holds locks on the tables for long. Every API process schedules the sweep,
+    only one of them runs it per interval.
+    """
+    # the lease is left to expire, it keeps the other processes from sweeping again in this interval
+    if not redis_repo.acquire_lock(_LOCK_NAME, CONVERSATION_EXPIRY_INTERVAL):
+        return
+
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=CONVERSATION_EXPIRY_MINUTES)
+    conversations = sources = content_bytes = 0
+    with tracer.start_as_current_span("expiry.sweep") as span:
+        for batch in range(CONVERSATION_EXPIRY_MAX_BATCHES):
+            if batch:
+                time.sleep(CONVERSATION_EXPIRY_BATCH_INTERVAL)
+            with EXPIRY_BATCH_DURATION.time():
+                deleted = delete_expired_conversations(cutoff, CONVERSATION_EXPIRY_BATCH_SIZE)
+
+            EXPIRED_CONVERSATIONS.inc(deleted["conversations"])
+            EXPIRED_SOURCES.inc(deleted["sources"])
+            EXPIRED_CONTENT_BYTES.inc(deleted["content_bytes"])
+            conversations += deleted["conversations"]
+            sources += deleted["sources"]
+            content_bytes += deleted["content_bytes"]
+            if deleted["conversations"] < CONVERSATION_EXPIRY_BATCH_SIZE:
+                break
+        span.set_attributes({
+            "expiry.conversations": conversations, "expiry.sources": sources, "expiry.content_bytes": content_bytes})
+
+    if conversations:
+        logger.info("Expired %d conversations and %d sources, %d bytes of content reclaimed",
+                    conversations, sources, content_bytes)
+
+
+def start_expiry_scheduler():
+    """
+    schedules `expire_conversations` every `CONVERSATION_EXPIRY_INTERVAL` seconds on a background thread
+
+    Returns:
+        BackgroundScheduler: running scheduler, to be shut down with the process
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    scheduler = BackgroundScheduler(timezone=timezone.utc)
+    scheduler.add_job(
+        expire_conversations, "interval", seconds=CONVERSATION_EXPIRY_INTERVAL,
+        id="expire_conversations", max_instances=1, coalesce=True)
+    scheduler.start()
+    return scheduler
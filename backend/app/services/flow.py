@@ -0,0 +1,105 @@
+from typing import Optional
+import asyncio
+import hashlib
+import re
+import uuid
+
+from config import flow_cache, redis_repo
+from core.db import get_source_count, get_source_summaries
+from core.logger import get_logger, sampled, truncate
+from core.tracing import tracer
+from helper.text import normalize_query
+from .flow_agent import generate_flow
+
+logger = get_logger(__name__)
+_FENCE_PATTERN = re.compile(r"^```(?:mermaid)?\s*|\s*```$")
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+def flow_context(page_id: str, source_ids: Optional[list[str]] = None) -> str:
+    """
+    builds the source material of a flow diagram from the summaries of the sources of a page
+
+    Args:
+        page_id (str): page (conversation) id
+        source_ids (Optional[list[str]]): sources to include, all the sources of the page when None
+
+    Returns:
+        str: context of the diagram, empty when no source matched
+    """
+    if source_ids is not None:
+        source_ids = [source_id for source_id in source_ids if _is_uuid(source_id)]
+        if not source_ids:
+            return ""
+    sources = get_source_summaries(page_id, source_ids)
+    return "\n\n".join(f"### {source['title']}\n{source['summary']}" for source in sources)
+
+
+def flow_cache_key(page_id: str, source_count: int, source_ids: Optional[list[str]], instructions: str) -> str:
+    """
+    sources never change once ingested and are only added, so the selection of sources and the
+    source count of the page identify the context of the diagram without building it
+
+    Args:
+        page_id (str): page (conversation) id
+        source_count (int): number of sources of the page
+        source_ids (Optional[list[str]]): sources to include, all the sources of the page when None
+        instructions (str): instructions of the user, compared like chat queries
+
+    Returns:
+        str: cache key of the diagram
+    """
+    selection = "*" if source_ids is None else ",".join(sorted({source_id.lower() for source_id in source_ids}))
+    selection_hash = hashlib.sha256(selection.encode()).hexdigest()
+    instructions_hash = hashlib.sha256(normalize_query(instructions).encode()).hexdigest()
+    return f"{page_id}:{source_count}:{selection_hash}:{instructions_hash}"
+
+
+def get_cached_flow(cache_key: str) -> Optional[str]:
+    entry = flow_cache.get(cache_key)
+    return entry["flow"] if entry else None
+
+
+async def build_flow(request_id: str, page_id: str, source_ids: Optional[list[str]], instructions: str):
+    """
+    streams a flow diagram into a record, the diagram generated so far is written as "message"
+    updates (merged in place like a chat answer) and the record ends with a "finished" status
+
+    Args:
+        request_id (str): id of the record
+        page_id (str): page (conversation) id
+        source_ids (Optional[list[str]]): sources the diagram is built from, all the sources of the page when None
+        instructions (str): what the diagram should show
+    """
+    # the key is taken before the context is read, like the answer cache key
+    cache_key = flow_cache_key(page_id, await asyncio.to_thread(get_source_count, page_id), source_ids, instructions)
+    context = await asyncio.to_thread(flow_context, page_id, source_ids)
+    if not context:
+        redis_repo.update_record(
+            record_id=request_id, record={"type": "error", "content": "No sources to build the flow from"})
+        return
+
+    redis_repo.update_record(record_id=request_id, record={"type": "status", "content": "Generating flow"})
+    diagram = ""
+    try:
+        with tracer.start_as_current_span("flow.generate", attributes={"flow.context_chars": len(context)}):
+            async for diagram in generate_flow(context, instructions):
+                logger.debug("Flow chunk - %s", truncate(diagram), extra=sampled())
+                redis_repo.update_record(record_id=request_id, record={"type": "message", "content": diagram})
+    except Exception as e:
+        logger.warning("Exception in Flow - %r", e)
+        redis_repo.update_record(record_id=request_id, record={"type": "error", "content": "Flow generation failed"})
+        return
+
+    diagram = _FENCE_PATTERN.sub("", diagram.strip())
+    if diagram:
+        flow_cache.set(cache_key, {"flow": diagram})
+    redis_repo.update_record(record_id=request_id, record={"type": "message", "content": diagram})
+    redis_repo.update_record(record_id=request_id, record={"type": "status", "content": "finished"})
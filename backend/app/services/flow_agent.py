@@ -1,7 +1,8 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import PromptTemplate
 
 from config import FLOW_MODEL
+from core.metrics import record_llm_usage
+from .llm import get_chat_model
 from .prompts import FLOW_PROMPT
 
 
@@ -9,15 +10,23 @@ prompt = PromptTemplate(
     template=FLOW_PROMPT,
     input_variables=['context', 'instructions']
 )
-llm = ChatGoogleGenerativeAI(model=FLOW_MODEL, temperature=0)
-chain = prompt | llm
 
 
 async def generate_flow(context: str, instructions: str):
-    try:
-        response = await chain.ainvoke({"context": context, "instructions": instructions})
-        response = response.content
-    except Exception as e:
-        print("Exception in Mind Map - ", e)
-        response = {}
-    return response
+    """
+    streams a Mermaid flow diagram of the context following the instructions
+
+    Args:
+        context (str): source material of the diagram
+        instructions (str): what the diagram should show
+
+    Yields:
+        str: the diagram generated so far, the last value is the complete diagram
+    """
+    chain = prompt | get_chat_model(FLOW_MODEL, 0)
+    diagram = ""
+    async for chunk in chain.astream({"context": context, "instructions": instructions}):
+        record_llm_usage("flow", chunk.usage_metadata)
+        if chunk.content:
+            diagram += chunk.content
+            yield diagram
@@ -0,0 +1,18 @@
+from functools import cache
+
+
+@cache
+def get_chat_model(model: str, temperature: float):
+    """
+    returns the Gemini chat client of a model and temperature, built on first use and shared by
+    every service asking for the same pair, so importing a service does not import the Gemini SDK
+
+    Args:
+        model (str): Gemini model name
+        temperature (float): sampling temperature
+
+    Returns:
+        ChatGoogleGenerativeAI: chat client
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model, temperature=temperature)
@@ -1,10 +1,26 @@
-from langchain_mcp_tools import convert_mcp_to_langchain_tools
+from contextlib import AsyncExitStack
+from typing import Any, NoReturn, Optional
+import asyncio
+import os
+import sys
+
+from jsonschema_pydantic import jsonschema_to_pydantic
+from langchain_core.tools import BaseTool, ToolException
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+import mcp.types as mcp_types
+
+from .tool_cache import cached_tools
+from core.logger import get_logger
+from config import (
+    MCP_STARTUP_TIMEOUT, MCP_HEALTH_CHECK_INTERVAL,
+    MCP_HEALTH_CHECK_TIMEOUT, MCP_RESTART_BACKOFF, MCP_RESTART_BACKOFF_MAX
+)
 
 mcp_servers = {
     "search": {  # https://github.com/nickclyde/duckduckgo-mcp-server/tree/main
         "command": "uvx",
-        "args": ["duckduckgo-mcp-server"],
-        "errlog": True
+        "args": ["duckduckgo-mcp-server"]
     },
     "arXivPaper": {  # https://github.com/daheepk/arxiv-paper-mcp
         "command": "uvx",
@@ -12,13 +28,243 @@ mcp_servers = {
             "--from",
             "arxiv-paper-mcp",
             "arxiv-mcp"
-        ],
-        "errlog": True
+        ]
     }
 }
 
+logger = get_logger(__name__)
+
+
+def _fix_schema(schema: Any) -> Any:
+    # `"type": [...]` unions are not understood by jsonschema_pydantic, they are rewritten as `anyOf`
+    if isinstance(schema, dict):
+        schema = {key: _fix_schema(value) for key, value in schema.items()}
+        if isinstance(schema.get("type"), list):
+            schema["anyOf"] = [{"type": schema_type} for schema_type in schema.pop("type")]
+    elif isinstance(schema, list):
+        schema = [_fix_schema(item) for item in schema]
+    return schema
+
+
+async def _spawn_server(config: dict, exit_stack: AsyncExitStack):
+    """starts the server process of `config` (`command`, `args`, `env`, `cwd`) and returns its stdio transport"""
+    server_parameters = StdioServerParameters(
+        command=config["command"],
+        args=config.get("args", []),
+        # the server is found on the PATH of the worker unless the config sets its own
+        env={"PATH": os.environ.get("PATH", ""), **config.get("env", {})},
+        cwd=config.get("cwd"),
+    )
+    return await exit_stack.enter_async_context(stdio_client(server_parameters, errlog=sys.stderr))
+
+
+class MCPTool(BaseTool):
+    """LangChain tool that calls a tool of a supervised MCP server, surviving server restarts."""
+
+    server: Any
+    handle_tool_error: bool = True
+
+    def _run(self, **kwargs: Any) -> NoReturn:
+        raise NotImplementedError("MCP tools only support async operations")
+
+    async def _arun(self, **kwargs: Any) -> str:
+        result = await self.server.call_tool(self.name, kwargs)
+
+        if result.isError:
+            raise ToolException(f"Tool execution failed: {result.content}")
+
+        result_content_text = "\n\n".join(
+            item.text for item in result.content if isinstance(item, mcp_types.TextContent))
+        return result_content_text or "No text content available in response"
+
+
+class MCPServer:
+    """
+    Supervises a single MCP server: spawns it, health-checks the session with pings and
+    restarts it with a backoff when it stops responding. Its tools keep their identity across
+    restarts and report the server as unavailable while it is down.
+    """
+
+    def __init__(self, name: str, config: dict,
+                 startup_timeout: float = MCP_STARTUP_TIMEOUT,
+                 health_check_interval: float = MCP_HEALTH_CHECK_INTERVAL,
+                 health_check_timeout: float = MCP_HEALTH_CHECK_TIMEOUT,
+                 restart_backoff: float = MCP_RESTART_BACKOFF):
+        self.name = name
+        self.config = config
+        self.startup_timeout = startup_timeout
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.restart_backoff = restart_backoff
+
+        self.session: Optional[ClientSession] = None
+        self.tools: dict[str, MCPTool] = {}
+        self.restarts = 0
+        self._ready: Optional[asyncio.Event] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.session is not None
+
+    async def start(self, wait: bool = True) -> bool:
+        """
+        starts supervising the server and waits up to `startup_timeout` for it to come up,
+        the server keeps retrying in the background when it is not ready in time
+
+        Args:
+            wait (bool): False to return right away, the tools of the server appear once it is up
+
+        Returns:
+            bool: True if the server is healthy
+        """
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._supervise(), name=f"mcp-{self.name}")
+
+        if not wait:
+            return self.healthy
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.startup_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("MCP server %s not ready after %ss, continuing without it", self.name, self.startup_timeout)
+        return self.healthy
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _supervise(self):
+        failures = 0
+        while not self._stopping.is_set():
+            try:
+                async with AsyncExitStack() as exit_stack:
+                    read, write = await _spawn_server(self.config, exit_stack)
+                    session = await exit_stack.enter_async_context(ClientSession(read, write))
+                    await asyncio.wait_for(session.initialize(), self.startup_timeout)
+                    tools_response = await asyncio.wait_for(session.list_tools(), self.startup_timeout)
+                    self._sync_tools(tools_response.tools)
+
+                    self.session = session
+                    self._ready.set()
+                    failures = 0
+                    logger.info("MCP server %s is up with %d tool(s)", self.name, len(self.tools))
+
+                    await self._monitor(session)
+            except Exception as e:
+                logger.warning("MCP server %s failed - %r", self.name, e)
+            finally:
+                self.session = None
+                self._ready.clear()
+
+            if self._stopping.is_set():
+                break
+
+            failures += 1
+            self.restarts += 1
+            backoff = min(self.restart_backoff * 2 ** (failures - 1), MCP_RESTART_BACKOFF_MAX)
+            logger.info("Restarting MCP server %s in %ss", self.name, backoff)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _monitor(self, session: ClientSession):
+        """returns when the server must be restarted or the supervisor is stopping"""
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.health_check_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await asyncio.wait_for(session.send_ping(), self.health_check_timeout)
+            except Exception as e:
+                logger.warning("MCP server %s failed its health check - %r", self.name, e)
+                return
+
+    def _sync_tools(self, mcp_tools: list[mcp_types.Tool]):
+        for tool in mcp_tools:
+            if tool.name in self.tools:
+                continue
+            self.tools[tool.name] = MCPTool(
+                name=tool.name,
+                description=tool.description or "",
+                args_schema=jsonschema_to_pydantic(_fix_schema(tool.inputSchema)),
+                server=self
+            )
+
+    async def call_tool(self, tool_name: str, arguments: dict) -> mcp_types.CallToolResult:
+        session = self.session
+        if session is None:
+            raise ToolException(f"The {self.name} server is temporarily unavailable, try again later")
+        try:
+            return await session.call_tool(tool_name, arguments)
+        except Exception as e:
+            # a dying server closes the session streams under the running call
+            raise ToolException(f"The {self.name} server failed while running {tool_name} - {e!r}") from e
+
+
+class MCPServerPool:
+    """Set of supervised MCP servers shared by all chats of a worker process."""
+
+    def __init__(self, server_configs: dict[str, dict], **server_options):
+        self.servers = {
+            name: MCPServer(name, config, **server_options)
+            for name, config in server_configs.items()
+        }
+        self._starting: Optional[asyncio.Future] = None
+        self._cached_tools: list[BaseTool] = []
+
+    async def start(self, wait: bool = True):
+        """
+        starts the servers, the startup is shared: concurrent and later callers wait for the same one
+        instead of spawning the servers twice
+
+        Args:
+            wait (bool): False to let the servers come up in the background, their tools are reported
+                unavailable until then
+        """
+        if self._starting is None:
+            self._starting = asyncio.gather(*(server.start() for server in self.servers.values()))
+        if wait:
+            await asyncio.shield(self._starting)
+
+    async def stop(self):
+        await asyncio.gather(*(server.stop() for server in self.servers.values()))
+        self._starting = None
+
+    def get_tools(self) -> list[BaseTool]:
+        return [tool for server in self.servers.values() for tool in server.tools.values()]
+
+    def get_cached_tools(self) -> list[BaseTool]:
+        """tools wrapped with the shared result cache, the wrappers are rebuilt only when new tools appear"""
+        tools_count = sum(len(server.tools) for server in self.servers.values())
+        if len(self._cached_tools) != tools_count:
+            self._cached_tools = cached_tools(
+                {name: list(server.tools.values()) for name, server in self.servers.items()})
+        return self._cached_tools
+
+    def health(self) -> dict[str, bool]:
+        return {name: server.healthy for name, server in self.servers.items()}
+
+
+mcp_pool = MCPServerPool(mcp_servers)
+
+
+async def create_mcp_tools() -> list[BaseTool]:
+    """
+    returns the tools of the shared MCP server pool, the pool is started here when the
+    worker boot hook did not start it already
 
-async def create_mcp_tools():
-    tools, cleanup = await convert_mcp_to_langchain_tools(mcp_servers)
-    print(True)
-    return tools, cleanup
+    Returns:
+        list[BaseTool]: cached tools of all servers that came up at least once
+    """
+    await mcp_pool.start()
+    return mcp_pool.get_cached_tools()
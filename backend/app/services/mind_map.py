@@ -0,0 +1,219 @@
+from typing import Optional
+import asyncio
+import re
+
+from config import MIND_MAP_CONCURRENCY, MIND_MAP_OUTLINE_MAX_HEADINGS, mind_map_cache, redis_repo
+from core.db import get_mind_map_sources, set_source_mind_map
+from core.logger import get_logger
+from core.tracing import tracer
+from helper.utils import source_set_version
+from .mind_map_agent import Node, generate_clusters, generate_map
+
+logger = get_logger(__name__)
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def _source_context(source: dict) -> str:
+    # the outline gives the structure of long sources without sending their content
+    headings = "\n".join(
+        f"{'  ' * (section['level'] - 1)}- {section['title']}"
+        for section in (source["outline"] or [])[:MIND_MAP_OUTLINE_MAX_HEADINGS])
+    context = f"### {source['title']}\n{source['summary']}"
+    return f"{context}\n\nOutline:\n{headings}" if headings else context
+
+
+def _label_key(label: str) -> str:
+    return _WHITESPACE_PATTERN.sub(" ", label).strip().lower()
+
+
+def merge_subtree(tree: Node, subtree: Node) -> Node:
+    """
+    merges the mind map of a single source into the mind map of the page, the subtree becomes a
+    theme of the page unless a node with the same label exists, in which case their children are
+    merged the same way, level by level
+
+    Args:
+        tree (Node): mind map of the page, updated in place
+        subtree (Node): mind map of the added source
+
+    Returns:
+        Node: the updated tree
+    """
+    if _label_key(subtree.label) == _label_key(tree.label):
+        _merge_children(tree, subtree.children)
+    else:
+        _merge_children(tree, [subtree])
+    return tree
+
+
+def _merge_children(parent: Node, children: list[Node]):
+    existing = {_label_key(child.label): child for child in parent.children}
+    for child in children:
+        match = existing.get(_label_key(child.label))
+        if match is None:
+            parent.children.append(child)
+            existing[_label_key(child.label)] = child
+        else:
+            _merge_children(match, child.children)
+
+
+def assign_ids(node: Node, node_id: str = "root") -> Node:
+    """replaces the ids chosen by the LLM with ids derived from the position of each node, unique in the tree"""
+    node.id = node_id
+    for index, child in enumerate(node.children):
+        assign_ids(child, f"{node_id}.{index}")
+    return node
+
+
+def get_cached_mind_map(page_id: str) -> Optional[dict]:
+    """
+    Returns:
+        Optional[dict]: mind map of the page if it was built from its current sources
+    """
+    cached = mind_map_cache.get(page_id)
+    if cached and cached["version"] == source_set_version(page_id):
+        return cached["map"]
+    return None
+
+
+def _progress(request_id: str, message: str):
+    redis_repo.update_record(record_id=request_id, record={"type": "status", "content": message})
+
+
+async def source_map(source: dict, semaphore: asyncio.Semaphore) -> Optional[Node]:
+    """
+    Returns:
+        Optional[Node]: mind map of a single source, generated once and stored on the source
+    """
+    if source["mind_map"]:
+        return Node.model_validate(source["mind_map"])
+    async with semaphore:
+        with tracer.start_as_current_span("mind_map.source", attributes={"source_id": str(source["id"])}):
+            tree = await generate_map(_source_context(source))
+    if tree is not None:
+        set_source_mind_map(source["id"], tree.model_dump())
+    return tree
+
+
+async def source_maps(request_id: str, sources: list[dict]) -> dict[str, Node]:
+    """
+    builds the mind maps of the sources concurrently, at most `MIND_MAP_CONCURRENCY` LLM calls at a time
+
+    Returns:
+        dict[str, Node]: mind map by source id, the sources whose generation failed are left out
+    """
+    semaphore = asyncio.Semaphore(MIND_MAP_CONCURRENCY)
+    done = 0
+
+    async def build(source: dict) -> Optional[Node]:
+        nonlocal done
+        tree = await source_map(source, semaphore)
+        done += 1
+        _progress(request_id, f"Mapped {done}/{len(sources)} sources")
+        return tree
+
+    trees = await asyncio.gather(*(build(source) for source in sources))
+    return {str(source["id"]): tree for source, tree in zip(sources, trees) if tree is not None}
+
+
+async def cluster_maps(trees: list[Node]) -> Node:
+    """
+    combines the mind maps of several sources into the mind map of the page, the sources are
+    grouped into themes by the LLM from their top labels only, so the prompt stays small with
+    dozens of sources. When the clustering fails the maps are merged under a single root.
+
+    Args:
+        trees (list[Node]): mind maps of the sources
+
+    Returns:
+        Node: mind map of the page
+    """
+    if len(trees) == 1:
+        return trees[0]
+
+    context = "\n".join(
+        f"{index}. {tree.label}: {', '.join(child.label for child in tree.children)}"
+        for index, tree in enumerate(trees, start=1))
+    with tracer.start_as_current_span("mind_map.cluster", attributes={"mind_map.sources": len(trees)}):
+        clusters = await generate_clusters(context)
+
+    root = Node(id="root", label=clusters.label if clusters else "Sources")
+    placed = set()
+    for cluster in clusters.clusters if clusters else []:
+        indexes = [index - 1 for index in cluster.sources if 0 < index <= len(trees) and index - 1 not in placed]
+        if not indexes:
+            continue
+        theme = Node(id="theme", label=cluster.label)
+        for index in indexes:
+            merge_subtree(theme, trees[index])
+            placed.add(index)
+        merge_subtree(root, theme)
+    for index, tree in enumerate(trees):
+        if index not in placed:
+            merge_subtree(root, tree)
+    return root
+
+
+async def _generate(request_id: str, sources: list[dict], cached: Optional[dict]) -> tuple[Optional[Node], list[str]]:
+    source_ids = {str(source["id"]) for source in sources}
+    cached_ids = set(cached["source_ids"]) if cached else set()
+
+    if cached and cached_ids and cached_ids <= source_ids:
+        added = [source for source in sources if str(source["id"]) not in cached_ids]
+        _progress(request_id, f"Adding {len(added)} sources to the mind map")
+        tree = Node.model_validate(cached["map"])
+        trees = await source_maps(request_id, added)
+        for subtree in trees.values():
+            merge_subtree(tree, subtree)
+        return tree, [*cached["source_ids"], *trees]
+
+    # first map of the page, or a source was removed: the page map is rebuilt from the source maps
+    _progress(request_id, f"Generating the mind maps of {len(sources)} sources")
+    trees = await source_maps(request_id, sources)
+    if not trees:
+        return None, []
+    _progress(request_id, "Combining the mind maps")
+    return await cluster_maps(list(trees.values())), list(trees)
+
+
+async def build_mind_map(request_id: str, page_id: str):
+    """
+    builds the mind map of a page from the summaries of its sources and stores it in the record
+    as a "mind_map" update, progress is reported as status updates
+
+    Every source gets its own map, generated concurrently and stored on the source, the maps are then
+    clustered into the page map. The page map is cached along with the source set it was built from,
+    when sources were only added since, the maps of the new sources are merged into the cached one.
+
+    Args:
+        request_id (str): id of the record
+        page_id (str): page (conversation) id
+    """
+    _progress(request_id, "Loading sources")
+    version = source_set_version(page_id)
+    sources = get_mind_map_sources(page_id)
+    if not sources:
+        redis_repo.update_record(
+            record_id=request_id, record={"type": "error", "content": "The page has no sources"})
+        return
+
+    cached = mind_map_cache.get(page_id)
+    if cached and cached["version"] == version:
+        logger.info("Mind map served from cache for version %s", version)
+        tree = Node.model_validate(cached["map"])
+    else:
+        tree, mapped_ids = await _generate(request_id, sources, cached)
+        if tree is None:
+            redis_repo.update_record(
+                record_id=request_id, record={"type": "error", "content": "Mind map generation failed"})
+            return
+        assign_ids(tree)
+        # sources whose map failed are left out of `source_ids`, the next request retries them
+        mind_map_cache.set(page_id, {
+            "version": version if len(mapped_ids) == len(sources) else None,
+            "source_ids": mapped_ids,
+            "map": tree.model_dump()
+        })
+
+    redis_repo.update_record(record_id=request_id, record={"type": "mind_map", "content": tree.model_dump()})
+    redis_repo.update_record(record_id=request_id, record={"type": "status", "content": "finished"})
@@ -1,11 +1,14 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
 from pydantic import BaseModel, Field
 from typing import List
 
 from config import MIND_MAP_MODEL
-from .prompts import MIND_MAP_PROMPT
+from core.logger import get_logger
+from .llm import get_chat_model
+from .prompts import MIND_MAP_PROMPT, MIND_MAP_CLUSTER_PROMPT
+
+logger = get_logger(__name__)
 
 
 class Node(BaseModel):
@@ -20,14 +23,41 @@ prompt = PromptTemplate(
     input_variables=['context'],
     partial_variables={"format_instructions": parser.get_format_instructions()}
 )
-llm = ChatGoogleGenerativeAI(model=MIND_MAP_MODEL, temperature=0)
-chain = prompt | llm | parser
 
 
 async def generate_map(context: str):
     try:
+        chain = prompt | get_chat_model(MIND_MAP_MODEL, 0) | parser
+        response = await chain.ainvoke({"context": context})
+    except Exception as e:
+        logger.warning("Exception in Mind Map - %r", e)
+        response = None
+    return response
+
+
+class Cluster(BaseModel):
+    label: str = Field(description="short label of the theme")
+    sources: List[int] = Field(description="numbers of the sources grouped under the theme")
+
+
+class Clusters(BaseModel):
+    label: str = Field(description="root label naming the overall subject of the sources")
+    clusters: List[Cluster]
+
+
+cluster_parser = PydanticOutputParser(pydantic_object=Clusters)
+cluster_prompt = PromptTemplate(
+    template=MIND_MAP_CLUSTER_PROMPT,
+    input_variables=['context'],
+    partial_variables={"format_instructions": cluster_parser.get_format_instructions()}
+)
+
+
+async def generate_clusters(context: str):
+    try:
+        chain = cluster_prompt | get_chat_model(MIND_MAP_MODEL, 0) | cluster_parser
         response = await chain.ainvoke({"context": context})
     except Exception as e:
-        print("Exception in Mind Map - ", e)
+        logger.warning("Exception in Mind Map clustering - %r", e)
         response = None
     return response
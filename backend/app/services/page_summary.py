@@ -0,0 +1,55 @@
+from config import PAGE_SUMMARY_DEBOUNCE, redis_repo
+from core.db import get_page_summary, get_unsummarized_sources, update_page_summary
+from core.logger import get_logger
+from core.tracing import tracer
+from .summarizer import summarize_page
+
+logger = get_logger(__name__)
+
+
+def _lock_name(page_id: str) -> str:
+    return f"page-summary:{page_id}"
+
+
+def claim_page_summary_refresh(page_id: str) -> bool:
+    """
+    debounces the page summary refreshes, the first upload of a burst claims the refresh and
+    schedules it `PAGE_SUMMARY_DEBOUNCE` seconds later, the other uploads of the burst are folded
+    in by that refresh
+
+    Args:
+        page_id (str): page (conversation) id
+
+    Returns:
+        bool: True if the caller must schedule the refresh
+    """
+    # the refresh releases the claim when it starts, the TTL only covers a refresh that never ran
+    return redis_repo.acquire_lock(_lock_name(page_id), PAGE_SUMMARY_DEBOUNCE * 4)
+
+
+async def refresh_page_summary(page_id: str):
+    """
+    folds the summaries of the sources added since the last refresh into the summary of the page
+
+    Args:
+        page_id (str): page (conversation) id
+    """
+    # uploads from now on schedule their own refresh, the sources folded by this one are marked in the database
+    redis_repo.release_lock(_lock_name(page_id))
+
+    # a refresh running concurrently stores its summary first, fold again from it
+    for _ in range(3):
+        page = get_page_summary(page_id)
+        if page is None:
+            return
+        # sources committed after this read, even with an earlier creation time, are left for the next refresh
+        sources = get_unsummarized_sources(page_id)
+        if not sources:
+            return
+
+        with tracer.start_as_current_span(
+                "page_summary.refresh", attributes={"page_id": page_id, "sources": len(sources)}):
+            summary = await summarize_page(page["summary"] or "", sources)
+        if update_page_summary(page_id, summary, [source["id"] for source in sources], page["summary_version"]):
+            return
+        logger.info("Page summary of %s was refreshed concurrently, folding again", page_id)
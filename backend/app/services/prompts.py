@@ -57,7 +57,9 @@ You are a specialized AI assistant designed to answer user queries accurately. Y
 1.  **User Query:** The specific question or request from the user.
 2.  **Source Table:** A table detailing the initially provided sources:
     {sources}
-3.  **Available Tool Capabilities:** You have access to tools that allow you to perform the following actions:
+3.  **Conversation Summary:** A running summary of the earlier part of this conversation (the most recent turns are provided as messages). Use it to resolve follow-up questions, but never cite it as a source:
+    {conversation_summary}
+4.  **Available Tool Capabilities:** You have access to tools that allow you to perform the following actions:
     *   **Fetch Specific Content from Provided Sources:** Retrieve detailed text snippets, sections, or summaries from the documents listed in the `Source Table` based on their `Source ID` and relevant queries or keywords. This is useful for extracting precise information mentioned in the source description.
     *   **Perform Web Searches:** Conduct searches on the public internet to find current information, definitions, news, or general knowledge relevant to the user's query or the context of the provided sources.
     *   **Fetch Research Papers:** Search academic databases to find scholarly articles, papers, or abstracts related to specific topics, keywords, or research questions.
@@ -86,6 +88,166 @@ You are a specialized AI assistant designed to answer user queries accurately. Y
 
 """
 
-MIND_MAP_PROMPT = """"""
+HISTORY_SUMMARY_PROMPT = """
+## Role: Conversation Memory Specialist
 
-FLOW_PROMPT = """"""
\ No newline at end of file
+**Objective:** Maintain a compact running summary of a conversation between a user and an AI assistant that answers questions about a set of sources.
+
+**Input:** You will be provided with the existing summary (possibly empty) and the conversation turns that are being removed from the assistant's short-term memory.
+
+**Task:**
+
+1.  Fold the new turns into the existing summary, producing a single updated summary.
+2.  Keep the topics the user asked about, the key facts and conclusions of the answers, the Source IDs that were cited and any preferences or instructions stated by the user.
+3.  Drop greetings, repetitions and details that are unlikely to matter for follow-up questions.
+4.  The summary MUST NOT exceed {max_words} words. Prefer dropping the oldest, least relevant details over exceeding the limit.
+
+**Output Format:**
+
+*   Return only the updated summary as plain text, without any introductory text.
+
+---
+
+**Existing Summary:**
+```
+{summary}
+```
+
+---
+
+**Turns to Fold In:**
+```
+{turns}
+```
+"""
+
+PAGE_SUMMARY_PROMPT = """
+## Role: Content Summarization Specialist
+
+**Objective:** Maintain a summary of a page that collects several sources (documents, web articles or YouTube transcripts).
+
+**Input:** You will be provided with the existing page summary (possibly empty) and the summaries of the sources that were just added to the page.
+
+**Task:**
+
+1.  Fold the new sources into the existing summary, producing a single updated summary of the whole page.
+2.  Describe the overall subject of the page and the main topics, findings or arguments covered by its sources. Mention how the new sources relate to the existing content when it helps.
+3.  Keep the existing content unless the new sources make it inaccurate, and do not list the sources one by one.
+4.  The summary MUST NOT exceed {max_words} words. Prefer dropping the least important details over exceeding the limit.
+
+**Output Format:**
+
+*   Return only the updated summary as plain text, without any introductory text.
+
+---
+
+**Existing Summary:**
+```
+{summary}
+```
+
+---
+
+**New Sources:**
+```
+{sources}
+```
+"""
+
+MIND_MAP_PROMPT = """
+## Role: Knowledge Structuring Specialist
+
+**Objective:** Organize the provided source summaries into a hierarchical mind map. Return the output strictly in JSON format.
+
+**Input:** You will be provided with the title and summary of one or more sources (documents, web articles or YouTube transcripts).
+
+**Task:**
+
+1.  Create a single root node naming the overall subject covered by the sources.
+2.  Group the content into main themes as children of the root, and break every theme down into its key concepts, findings or arguments. Use at most 4 levels below the root.
+3.  Merge concepts covered by several sources into one node instead of repeating them.
+4.  Keep every label short (2 to 8 words), specific and free of citations or numbering.
+5.  Only use information present in the summaries, do not invent topics.
+
+**Output Format:**
+
+*   The output MUST be a valid JSON object describing the root node.
+*   Every node has an `id` (any unique string), a `label` and a list of `children` (empty for leaves).
+*   Do not include any introductory text, explanations, or markdown formatting outside the JSON structure itself.
+
+---
+
+**Sources:**
+```
+{context}
+```
+
+---
+
+**Format Instructions:**
+{format_instructions}
+"""
+
+MIND_MAP_CLUSTER_PROMPT = """
+## Role: Knowledge Structuring Specialist
+
+**Objective:** Group the mind maps of several sources into themes, so they can be combined into a single mind map. Return the output strictly in JSON format.
+
+**Input:** You will be provided with a numbered list of sources. Each entry gives the root label of the mind map of the source followed by the labels of its main branches.
+
+**Task:**
+
+1.  Name the overall subject covered by all the sources, it becomes the root label of the combined mind map.
+2.  Group the sources into 2 to 8 themes, sources covering the same topic belong to the same theme.
+3.  Every source number must appear in exactly one theme. A source unrelated to all the others gets its own theme.
+4.  Keep every label short (2 to 8 words) and specific.
+
+**Output Format:**
+
+*   The output MUST be a valid JSON object.
+*   Do not include any introductory text, explanations, or markdown formatting outside the JSON structure itself.
+
+---
+
+**Sources:**
+```
+{context}
+```
+
+---
+
+**Format Instructions:**
+{format_instructions}
+"""
+
+FLOW_PROMPT = """
+## Role: Process Visualization Specialist
+
+**Objective:** Turn the provided source material into a flow diagram written in Mermaid syntax, following the user's instructions.
+
+**Input:** You will be provided with the titles and summaries of one or more sources, and with instructions describing the process, sequence or relationships the diagram should show.
+
+**Task:**
+
+1.  Identify the steps, decisions, actors or concepts requested by the instructions, using only the information present in the sources.
+2.  Connect them in their logical or chronological order. Use decision nodes (`{{...}}`) for branches and label the edges when the transition needs an explanation.
+3.  Keep node labels short (2 to 8 words) and give every node a unique identifier.
+4.  Prefer a top-down layout, use `subgraph` blocks only to group clearly separate phases.
+
+**Output Format:**
+
+*   Return only the Mermaid code, starting with `flowchart TD`.
+*   Do not wrap the code in markdown fences and do not add any explanation before or after it.
+
+---
+
+**Sources:**
+```
+{context}
+```
+
+---
+
+**Instructions:**
+{instructions}
+"""
\ No newline at end of file
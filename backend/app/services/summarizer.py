@@ -1,10 +1,12 @@
-from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pydantic import BaseModel, Field
+import time
 
-from config import SUMMARIZER_MODEL
-from .prompts import SUMMARIZER_PROMPT
+from config import SUMMARIZER_MODEL, CHAT_SUMMARY_MAX_WORDS, PAGE_SUMMARY_MAX_WORDS
+from core.metrics import LLM_LATENCY, record_llm_usage
+from .llm import get_chat_model
+from .prompts import SUMMARIZER_PROMPT, HISTORY_SUMMARY_PROMPT, PAGE_SUMMARY_PROMPT
 
 
 class BriefSummary(BaseModel):
@@ -15,18 +17,68 @@ class BriefSummary(BaseModel):
 
 
 parser = JsonOutputParser(pydantic_object=BriefSummary)
-llm = ChatGoogleGenerativeAI(model=SUMMARIZER_MODEL, temperature=0.7)
 prompt = PromptTemplate(
     template=SUMMARIZER_PROMPT,
     input_variables=['document_type', 'content'],
     partial_variables={"format_instructions": parser.get_format_instructions()}
 )
-chain = prompt | llm | parser
 
 
 async def get_brief_summary(document_type: str, content: str) -> dict:
+    started = time.perf_counter()
     try:
-        response = await chain.ainvoke({"document_type": document_type, "content": content})
+        llm_chain = prompt | get_chat_model(SUMMARIZER_MODEL, 0.7)
+        message = await llm_chain.ainvoke({"document_type": document_type, "content": content})
+        record_llm_usage("brief_summary", message.usage_metadata)
+        response = parser.invoke(message)
     except:
         response = {}
+    LLM_LATENCY.labels("brief_summary", "total").observe(time.perf_counter() - started)
     return response
+
+
+history_prompt = PromptTemplate(
+    template=HISTORY_SUMMARY_PROMPT,
+    input_variables=['summary', 'turns'],
+    partial_variables={"max_words": str(CHAT_SUMMARY_MAX_WORDS)}
+)
+
+
+async def summarize_history(summary: str, turns: list[dict]) -> str:
+    """
+    folds conversation turns into the running summary of the conversation
+
+    Args:
+        summary (str): existing running summary, empty for the first compaction
+        turns (list[dict]): turns with `query` and `answer` keys
+
+    Returns:
+        str: updated running summary
+    """
+    turns_description = "\n\n".join(
+        f"User: {turn['query']}\nAssistant: {turn['answer']}" for turn in turns)
+    history_chain = history_prompt | get_chat_model(SUMMARIZER_MODEL, 0.7) | StrOutputParser()
+    return await history_chain.ainvoke({"summary": summary, "turns": turns_description})
+
+
+page_summary_prompt = PromptTemplate(
+    template=PAGE_SUMMARY_PROMPT,
+    input_variables=['summary', 'sources'],
+    partial_variables={"max_words": str(PAGE_SUMMARY_MAX_WORDS)}
+)
+
+
+async def summarize_page(summary: str, sources: list[dict]) -> str:
+    """
+    folds the summaries of new sources into the summary of the page
+
+    Args:
+        summary (str): existing page summary, empty for the first sources
+        sources (list[dict]): sources with `title` and `summary` keys
+
+    Returns:
+        str: updated page summary
+    """
+    sources_description = "\n\n".join(f"### {source['title']}\n{source['summary']}" for source in sources)
+    page_summary_chain = page_summary_prompt | get_chat_model(SUMMARIZER_MODEL, 0.7) | StrOutputParser()
+    return await page_summary_chain.ainvoke({"summary": summary, "sources": sources_description})
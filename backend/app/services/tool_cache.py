@@ -0,0 +1,128 @@
+from langchain_core.tools import BaseTool
+from typing import Any, NoReturn
+import asyncio
+import hashlib
+import json
+import re
+
+from opentelemetry import trace
+
+from config import (
+    tool_cache, MCP_TOOL_CACHE_TTLS, MCP_SERVER_CACHE_TTLS, MCP_TOOL_CACHE_DEFAULT_TTL,
+    MCP_TOOL_CACHE_FREE_TEXT_ARGUMENTS
+)
+from core.metrics import TOOL_CACHE_LOOKUPS
+from core.tracing import tracer
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+# calls currently running in this process, concurrent identical calls wait for the first one
+_in_flight: dict[str, asyncio.Future] = {}
+
+
+def _normalize(value: Any, free_text: bool = False) -> Any:
+    # urls, ids and categories are case-sensitive, only free text is folded
+    if isinstance(value, str):
+        return _WHITESPACE_PATTERN.sub(" ", value).strip().lower() if free_text else value
+    if isinstance(value, dict):
+        return {key: _normalize(item, key in MCP_TOOL_CACHE_FREE_TEXT_ARGUMENTS)
+                for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item, free_text) for item in value]
+    return value
+
+
+def tool_cache_key(tool_name: str, arguments: dict) -> str:
+    """
+    builds the result cache key of a tool call, the free-text arguments (`MCP_TOOL_CACHE_FREE_TEXT_ARGUMENTS`)
+    are compared case-insensitively and with collapsed whitespace, the others exactly
+
+    Args:
+        tool_name (str): name of the tool
+        arguments (dict): arguments of the call
+
+    Returns:
+        str: cache key
+    """
+    normalized = json.dumps(_normalize(arguments), sort_keys=True, default=str)
+    return f"{tool_name}:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+
+def _record(tool_name: str, outcome: str):
+    trace.get_current_span().set_attribute("tool.cache", outcome)
+    TOOL_CACHE_LOOKUPS.labels(tool_name, outcome).inc()
+
+
+class CachedTool(BaseTool):
+    """Wraps an async tool with a shared, TTL-bound result cache and in-flight deduplication."""
+
+    tool: BaseTool
+    ttl: int
+    handle_tool_error: bool = True
+
+    @classmethod
+    def wrap(cls, tool: BaseTool, ttl: int) -> "CachedTool":
+        return cls(name=tool.name, description=tool.description, args_schema=tool.args_schema, tool=tool, ttl=ttl)
+
+    def _run(self, **kwargs: Any) -> NoReturn:
+        raise NotImplementedError("Cached tools only support async operations")
+
+    async def _arun(self, **kwargs: Any) -> str:
+        with tracer.start_as_current_span(f"tool.{self.name}"):
+            return await self._cached_call(**kwargs)
+
+    async def _cached_call(self, **kwargs: Any) -> str:
+        key = tool_cache_key(self.name, kwargs)
+
+        cached = tool_cache.get(key)
+        if cached is not None:
+            _record(self.name, "hit")
+            return cached["result"]
+
+        in_flight = _in_flight.get(key)
+        if in_flight is not None:
+            _record(self.name, "shared")
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+                # the call we were waiting for was cancelled with its chat, run it ourselves
+
+        _record(self.name, "miss")
+        future = asyncio.get_running_loop().create_future()
+        _in_flight[key] = future
+        try:
+            # errors raise out of the inner tool and are never cached
+            result = await self.tool._arun(**kwargs)
+            tool_cache.set(key, {"result": result}, ttl=self.ttl)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved when nobody else was waiting for it
+            future.exception()
+            raise
+        finally:
+            _in_flight.pop(key, None)
+
+
+def cached_tools(tools_by_server: dict[str, list[BaseTool]]) -> list[BaseTool]:
+    """
+    wraps the tools of each MCP server with the result cache, using the TTL configured for the tool,
+    or else for its server
+
+    Args:
+        tools_by_server (dict[str, list[BaseTool]]): tools grouped by MCP server name
+
+    Returns:
+        list[BaseTool]: cached tools
+    """
+    return [
+        CachedTool.wrap(tool, MCP_TOOL_CACHE_TTLS.get(
+            tool.name, MCP_SERVER_CACHE_TTLS.get(server_name, MCP_TOOL_CACHE_DEFAULT_TTL)))
+        for server_name, tools in tools_by_server.items()
+        for tool in tools
+    ]
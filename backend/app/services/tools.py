@@ -1,15 +1,38 @@
-from langchain.tools import BaseTool
-from typing import Callable, Dict, Any
+from langchain_core.tools import BaseTool
+from typing import Callable, Dict, Any, Optional
 import asyncio
 from pydantic import BaseModel, Field
 
+from config import RETRIEVAL_TOKEN_BUDGET
 from core.schema import UpdateState
-from repository import RedisRepository
+from repository import StateRepository
 from core.db import get_sources
+from core.tracing import tracer
+from core.logger import get_logger
+from helper.text import (
+    count_tokens, cut_at_boundary, decode_cursor, encode_cursor,
+    find_section, parse_outline
+)
 
 class SourceIdsInput(BaseModel):
     source_ids: list[str] = Field(..., description="List of source IDs to retrieve")
 
+
+class SourceIdInput(BaseModel):
+    source_id: str = Field(..., description="ID of the source")
+
+
+class SourceSectionInput(SourceIdInput):
+    section: str = Field(..., description="Title of the section as listed in the source outline")
+
+
+class SourcePageInput(SourceIdsInput):
+    cursor: Optional[str] = Field(
+        None, description="Continuation cursor returned by a previous truncated call, omit for the first call")
+
+logger = get_logger(__name__)
+
+
 def with_redis_updates(func):
     """Decorator that enables Redis state updates from within tool functions."""
     async def wrapper(*args, **kwargs):
@@ -17,7 +40,7 @@ def with_redis_updates(func):
         if not request_id:
             raise ValueError("No request_id provided for tool execution")
 
-        redis_repo: RedisRepository = kwargs.get("redis_repo", None)
+        redis_repo: StateRepository = kwargs.get("redis_repo", None)
         if redis_repo is None:
             raise ValueError("Redis is not accessible")
 
@@ -32,7 +55,7 @@ def with_redis_updates(func):
 
             return result
         except Exception as e:
-            print("Error at tool call - ", e)
+            logger.warning("Error at tool call %s - %r", func.__name__, e)
             raise e
 
     return wrapper
@@ -43,39 +66,89 @@ class RequestTrackedTool(BaseTool):
 
     tool_function: Callable
     request_id: str
-    redis_repo: RedisRepository
+    redis_repo: StateRepository
 
     def _run(self, *args, **kwargs):
         kwargs["request_id"] = self.request_id
         kwargs['redis_repo'] = self.redis_repo
-        return self.tool_function(*args, **kwargs)
+        with tracer.start_as_current_span(f"tool.{self.name}", attributes={"request_id": self.request_id}):
+            return self.tool_function(*args, **kwargs)
 
     async def _arun(self, *args, **kwargs):
         kwargs["request_id"] = self.request_id
         kwargs['redis_repo'] = self.redis_repo
-        return await self.tool_function(*args, **kwargs)
+        with tracer.start_as_current_span(f"tool.{self.name}", attributes={"request_id": self.request_id}):
+            return await self.tool_function(*args, **kwargs)
 
 
 @with_redis_updates
-def retrieve_sources_complete(source_ids: list[str], **kwargs) -> str:
+def retrieve_sources_complete(source_ids: list[str], cursor: Optional[str] = None, **kwargs) -> str:
     """
-    retrieves the list of sources (given by id) and merges the complete content in markdown format
+    retrieves the list of sources (given by id) and merges the complete content in markdown format,
+    the output is limited to `RETRIEVAL_TOKEN_BUDGET` tokens and ends with a continuation cursor
+    when truncated
 
     Args:
         source_ids (list[str]): list of source IDs
+        cursor (Optional[str]): continuation cursor returned by a previous truncated call
 
     Returns:
         str: combined source content in markdown format
     """
     update_state = kwargs['update_state']
     sources = get_sources(source_ids)
+    # keep the requested order so that cursors stay stable between calls
+    order = {source_id: index for index, source_id in enumerate(source_ids)}
+    sources.sort(key=lambda source: order.get(str(source.id), len(order)))
 
-    source_titles = [source.title for source in sources]
+    start_index, start_offset = 0, 0
+    if cursor:
+        try:
+            cursor_source_id, start_offset = decode_cursor(cursor)
+        except ValueError:
+            return f"Invalid cursor - {cursor}, pass the cursor exactly as returned or omit it to start over"
+        start_index = next(
+            (index for index, source in enumerate(sources) if str(source.id) == cursor_source_id), None)
+        if start_index is None:
+            return f"Invalid cursor - source {cursor_source_id} is not part of the requested sources"
+
+    source_titles = [source.title for source in sources[start_index:]]
     update_state(UpdateState(type="sources", content=source_titles))
 
+    budget = RETRIEVAL_TOKEN_BUDGET
     sources_description = ""
-    for source in sources:
-        sources_description += f"**{source.title}:**\n{source.content}\n\n"
+    next_cursor = None
+    for index in range(start_index, len(sources)):
+        source = sources[index]
+        content = source.content or ""
+        offset = start_offset if index == start_index else 0
+        token_count = source.token_count or count_tokens(content)
+        chars_per_token = len(content) / token_count if token_count else 1
+
+        remaining_tokens = (len(content) - offset) / chars_per_token
+        if remaining_tokens <= budget:
+            end = len(content)
+        elif sources_description and budget < RETRIEVAL_TOKEN_BUDGET // 10:
+            # not worth starting a tiny slice of a new source, continue from it on the next page
+            next_cursor = encode_cursor(str(source.id), offset)
+            break
+        else:
+            end = cut_at_boundary(content, offset, int(budget * chars_per_token))
+            next_cursor = encode_cursor(str(source.id), end)
+
+        title = f"{source.title} (continued)" if offset else source.title
+        sources_description += f"**{title}:**\n{content[offset:end]}\n\n"
+        budget -= (end - offset) / chars_per_token
+
+        if next_cursor:
+            break
+
+    if next_cursor:
+        sources_description += (
+            f"[Output truncated at the {RETRIEVAL_TOKEN_BUDGET} token budget. "
+            f"Call retrieve_sources_complete again with the same source_ids and cursor=\"{next_cursor}\" "
+            f"to read the rest.]"
+        )
 
     return sources_description
 
@@ -104,13 +177,99 @@ def retrieve_sources_summary(source_ids: list[str], **kwargs) -> str:
     return sources_description
 
 
-def create_tools_for_request(request_id: str, redis_repo: RedisRepository):
+def _get_outline(source) -> list[dict]:
+    # sources ingested before outlines were stored get theirs parsed on the fly
+    return source.outline if source.outline is not None else parse_outline(source.content or "")
+
+
+@with_redis_updates
+def get_source_outline(source_id: str, **kwargs) -> str:
+    """
+    retrieves the heading outline of a source (given by id) along with the approximate size of each section
+
+    Args:
+        source_id (str): source ID
+
+    Returns:
+        str: indented outline in markdown format
+    """
+    update_state = kwargs['update_state']
+    sources = get_sources([source_id])
+    if not sources:
+        return f"No source found with id - {source_id}"
+    source = sources[0]
+    update_state(UpdateState(type="sources", content=[source.title]))
+
+    content = source.content or ""
+    outline = _get_outline(source)
+    if not outline:
+        return f"**{source.title}** has no headings, use retrieve_sources_complete to read it."
+
+    token_count = source.token_count or count_tokens(content)
+    chars_per_token = len(content) / token_count if token_count else 1
+
+    outline_description = f"**Outline of {source.title}:**\n"
+    for heading in outline:
+        indent = "  " * (heading["level"] - 1)
+        section_tokens = int((heading["end"] - heading["start"]) / chars_per_token)
+        outline_description += f"{indent}- {heading['title']} (~{section_tokens} tokens)\n"
+
+    return outline_description
+
+
+@with_redis_updates
+def retrieve_source_section(source_id: str, section: str, **kwargs) -> str:
+    """
+    retrieves the content of a single section (given by its heading title) of a source, including its
+    subsections, the output is limited to `RETRIEVAL_TOKEN_BUDGET` tokens
+
+    Args:
+        source_id (str): source ID
+        section (str): title of the section
+
+    Returns:
+        str: section content in markdown format
+    """
+    update_state = kwargs['update_state']
+    sources = get_sources([source_id])
+    if not sources:
+        return f"No source found with id - {source_id}"
+    source = sources[0]
+    update_state(UpdateState(type="sources", content=[source.title]))
+
+    content = source.content or ""
+    heading = find_section(_get_outline(source), section)
+    if heading is None:
+        return f"No section named \"{section}\" in {source.title}, use get_source_outline to list the sections."
+
+    token_count = source.token_count or count_tokens(content)
+    chars_per_token = len(content) / token_count if token_count else 1
+
+    start, end = heading["start"], heading["end"]
+    truncated = (end - start) / chars_per_token > RETRIEVAL_TOKEN_BUDGET
+    if truncated:
+        end = cut_at_boundary(content, start, int(RETRIEVAL_TOKEN_BUDGET * chars_per_token))
+
+    section_description = f"**{source.title} - {heading['title']}:**\n{content[start:end]}\n\n"
+    if truncated:
+        section_description += (
+            f"[Output truncated at the {RETRIEVAL_TOKEN_BUDGET} token budget. "
+            f"Call retrieve_sources_complete with source_ids=[\"{source.id}\"] and "
+            f"cursor=\"{encode_cursor(str(source.id), end)}\" to keep reading.]"
+        )
+
+    return section_description
+
+
+def create_tools_for_request(request_id: str, redis_repo: StateRepository):
     tools = [
         RequestTrackedTool(
             name="retrieve_sources_complete",
-            description="retrieves the list of sources (given by id) and merges the complete content in markdown format.     Args: sources (list[str]): list of source IDs",
+            description="retrieves the list of sources (given by id) and merges the complete content in markdown format. "
+                        "Long output is truncated and ends with a cursor, pass it back to read the next part.     "
+                        "Args: sources (list[str]): list of source IDs, cursor (str, optional): continuation cursor",
             tool_function=retrieve_sources_complete,
-            args_schema=SourceIdsInput,
+            args_schema=SourcePageInput,
             request_id=request_id,
             redis_repo=redis_repo
         ),
@@ -121,6 +280,24 @@ def create_tools_for_request(request_id: str, redis_repo: RedisRepository):
             args_schema=SourceIdsInput,
             request_id=request_id,
             redis_repo=redis_repo
+        ),
+        RequestTrackedTool(
+            name="get_source_outline",
+            description="retrieves the heading outline of a source (given by id) with the approximate size of each section. "
+                        "Use it to explore long sources before reading them.  Args: source_id (str): source ID",
+            tool_function=get_source_outline,
+            args_schema=SourceIdInput,
+            request_id=request_id,
+            redis_repo=redis_repo
+        ),
+        RequestTrackedTool(
+            name="retrieve_source_section",
+            description="retrieves the content of one section of a source by its heading title, as listed by get_source_outline.  "
+                        "Args: source_id (str): source ID, section (str): section title",
+            tool_function=retrieve_source_section,
+            args_schema=SourceSectionInput,
+            request_id=request_id,
+            redis_repo=redis_repo
         )
     ]
 
@@ -1,36 +1,166 @@
-from functools import partial
+import threading
+import time
 import dramatiq
+from dramatiq.common import q_name
+from dramatiq.asyncio import get_event_loop_thread
 from dramatiq.brokers.redis import RedisBroker
-from dramatiq.middleware import AsyncIO
+from dramatiq.middleware import AsyncIO, Middleware
+from opentelemetry import context, trace
 
-from config import REDIS_HOST, REDIS_PREFIX, redis_repo
+from config import (
+    REDIS_HOST, REDIS_PREFIX, WORKER_METRICS_PORT, CHAT_QUEUE, GENERATION_QUEUE, INGESTION_QUEUE,
+    QUEUE_PRIORITIES, QUEUE_CONCURRENCY
+)
 from core.schema import ChatRequest
-from services import chat
+from core.tracing import (
+    tracer, setup_tracing, inject_context, extract_context, record_exception
+)
+from core.logger import get_logger
+from core.metrics import (
+    start_metrics_server, DramatiqQueueCollector, ACTOR_MESSAGES, ACTOR_DURATION
+)
+from services.chat_runner import run_chat
+from services.mind_map import build_mind_map
+from services.flow import build_flow
+from services.page_summary import refresh_page_summary
+
+logger = get_logger(__name__)
+
+
+class QueueConcurrency(Middleware):
+    """
+    Bounds the number of messages of each queue processed at the same time by this worker process,
+    so that one process does not take more LLM streams than it can serve. Worker threads over the
+    limit of a queue wait here, run the worker with more threads than the sum of the limits of its
+    queues so the other queues keep being served.
+    """
+
+    def __init__(self, limits: dict[str, int]):
+        self.semaphores = {queue_name: threading.BoundedSemaphore(limit) for queue_name, limit in limits.items()}
+        self._acquired = {}
+
+    def before_process_message(self, broker, message):
+        semaphore = self.semaphores.get(q_name(message.queue_name))
+        if semaphore is None:
+            return
+        semaphore.acquire()
+        self._acquired[message.message_id] = semaphore
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        semaphore = self._acquired.pop(message.message_id, None)
+        if semaphore is not None:
+            semaphore.release()
+
+    after_skip_message = after_process_message
+
+
+class MCPServers(Middleware):
+    """
+    Starts the shared MCP server pool when the worker boots, without waiting for the servers,
+    so that a slow or missing server delays neither the boot nor the chats that do not need it.
+    """
+
+    def after_worker_boot(self, broker, worker):
+        if worker.consumer_whitelist and CHAT_QUEUE not in worker.consumer_whitelist:
+            return
+        # imported here so that the API, which imports this module to send messages, skips the MCP client
+        from services.mcp import mcp_pool
+        get_event_loop_thread().run_coroutine(mcp_pool.start(wait=False))
+        logger.info("MCP servers starting: %s", list(mcp_pool.servers))
+
+    def before_worker_shutdown(self, broker, worker):
+        if worker.consumer_whitelist and CHAT_QUEUE not in worker.consumer_whitelist:
+            return
+        from services.mcp import mcp_pool
+        get_event_loop_thread().run_coroutine(mcp_pool.stop())
+
+
+class TraceContext(Middleware):
+    """
+    Carries the trace context of the sender in the message options and runs every message
+    inside a span parented to it. The span is attached on the worker thread before the actor
+    is called, so the coroutine scheduled on the event loop inherits it.
+    """
+
+    def __init__(self):
+        self._spans = {}
+
+    def before_worker_boot(self, broker, worker):
+        setup_tracing("zynapse-worker")
+
+    def before_enqueue(self, broker, message, delay):
+        message.options["trace_context"] = inject_context()
+
+    def before_process_message(self, broker, message):
+        parent = extract_context(message.options.get("trace_context"))
+        span = tracer.start_span(
+            f"dramatiq.process {message.actor_name}", context=parent, kind=trace.SpanKind.CONSUMER,
+            attributes={
+                "messaging.system": "dramatiq",
+                "messaging.destination": message.queue_name,
+                "messaging.message_id": message.message_id,
+                "messaging.queue_wait_ms": max(0, int(time.time() * 1000) - message.message_timestamp),
+            })
+        token = context.attach(trace.set_span_in_context(span, parent))
+        self._spans[message.message_id] = (span, token)
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        span, token = self._spans.pop(message.message_id, (None, None))
+        if span is None:
+            return
+        if exception is not None:
+            record_exception(span, exception)
+        span.end()
+        context.detach(token)
+
+    after_skip_message = after_process_message
+
+
+class Metrics(Middleware):
+    """Serves the worker metrics on `WORKER_METRICS_PORT` and records the processing time of every message."""
+
+    def __init__(self):
+        self._started = {}
+
+    def after_worker_boot(self, broker, worker):
+        start_metrics_server(WORKER_METRICS_PORT, collectors=[DramatiqQueueCollector(broker)])
+
+    def before_process_message(self, broker, message):
+        self._started[message.message_id] = time.perf_counter()
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        started = self._started.pop(message.message_id, None)
+        ACTOR_MESSAGES.labels(message.actor_name, "error" if exception is not None else "success").inc()
+        if started is not None:
+            ACTOR_DURATION.labels(message.actor_name).observe(time.perf_counter() - started)
+
+    def after_skip_message(self, broker, message):
+        self._started.pop(message.message_id, None)
+        ACTOR_MESSAGES.labels(message.actor_name, "skipped").inc()
 
 
 redis_broker = RedisBroker(host=REDIS_HOST, middleware=[
-                           AsyncIO()], namespace=REDIS_PREFIX)
+                           AsyncIO(), QueueConcurrency(QUEUE_CONCURRENCY), TraceContext(), Metrics(), MCPServers()], namespace=REDIS_PREFIX)
 dramatiq.set_broker(redis_broker)
 
-print(f"Redis broker initialized with host: {REDIS_HOST}")
+logger.info("Redis broker initialized with host: %s", REDIS_HOST)
 
 
 async def async_chat(request_id: str, request: str):
-    print(f"Entering async_chat function with request_id: {request_id}")
-
-    request: ChatRequest = ChatRequest.model_validate_json(request)
-    print(f"Validated chat request: {request.model_dump_json()}")
+    await run_chat(request_id, ChatRequest.model_validate_json(request))
 
-    response_generator = chat(request.query, request.page_id, request_id, redis_repo)
 
-    async for state in response_generator:
-        print(f"Received state: {state}")
-        state = state.model_dump()
+async_chat_task = dramatiq.actor(
+    async_chat, queue_name=CHAT_QUEUE, priority=QUEUE_PRIORITIES[CHAT_QUEUE])
 
-        redis_repo.update_record(record_id=request_id, record=state)
-        print(f"Updated Redis record for request_id: {request_id}")
-    redis_repo.update_record(record_id=request_id, record={"type": "status", "content": "finished"})
-    print("Finished processing Chat request")
+generate_mind_map_task = dramatiq.actor(
+    build_mind_map, actor_name="generate_mind_map",
+    queue_name=GENERATION_QUEUE, priority=QUEUE_PRIORITIES[GENERATION_QUEUE])
 
+generate_flow_task = dramatiq.actor(
+    build_flow, actor_name="generate_flow",
+    queue_name=GENERATION_QUEUE, priority=QUEUE_PRIORITIES[GENERATION_QUEUE])
 
-async_chat_task = dramatiq.actor(async_chat)
+refresh_page_summary_task = dramatiq.actor(
+    refresh_page_summary, actor_name="refresh_page_summary",
+    queue_name=INGESTION_QUEUE, priority=QUEUE_PRIORITIES[INGESTION_QUEUE])
@@ -0,0 +1,80 @@
+"""
+Offline benchmark suite, kept out of the default test run (see `testpaths` in pyproject.toml).
+
+    cd backend
+    pytest benchmarks --benchmark-autosave                                  # record a baseline
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:25%  # fail on regressions
+
+The corpus is generated on first use into a temporary directory, no network access is needed.
+"""
+import random
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR / "app"))
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.corpus import WORDS, paragraph, sentence  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def corpus_dir(tmp_path_factory) -> Path:
+    return tmp_path_factory.mktemp("corpus")
+
+
+@pytest.fixture(scope="session")
+def make_pdf(corpus_dir):
+    import fitz
+
+    def build(pages: int) -> Path:
+        path = corpus_dir / f"document-{pages}.pdf"
+        if path.exists():
+            return path
+        rng = random.Random(pages)
+        document = fitz.open()
+        for index in range(pages):
+            page = document.new_page()
+            page.insert_text((72, 72), f"Section {index + 1}", fontsize=18)
+            page.insert_textbox(fitz.Rect(72, 100, 540, 760), "\n\n".join(
+                paragraph(rng) for _ in range(5)), fontsize=10)
+        document.save(path)
+        return path
+
+    return build
+
+
+@pytest.fixture(scope="session")
+def make_html():
+    def build(size_mb: float) -> str:
+        rng = random.Random(int(size_mb * 100))
+        parts = ["<html><head><title>Benchmark</title></head><body>"]
+        size = 0
+        section = 0
+        while size < size_mb * 1024 * 1024:
+            section += 1
+            block = (
+                f"<h2>Section {section}</h2><p>{paragraph(rng)} <a href='https://example.com/{section}'>link</a></p>"
+                f"<ul>{''.join(f'<li>{sentence(rng, 6)}</li>' for _ in range(4))}</ul>"
+                f"<table><tr><th>Key</th><th>Value</th></tr>"
+                f"{''.join(f'<tr><td>{rng.choice(WORDS)}</td><td>{rng.random():.4f}</td></tr>' for _ in range(3))}</table>"
+            )
+            parts.append(block)
+            size += len(block)
+        parts.append("</body></html>")
+        return "".join(parts)
+
+    return build
+
+
+@pytest.fixture(scope="session")
+def make_transcript():
+    def build(segments: int) -> list[SimpleNamespace]:
+        rng = random.Random(segments)
+        # same shape as the snippets returned by youtube_transcript_api
+        return [SimpleNamespace(text=sentence(rng, 8), start=index * 2.5, duration=2.5) for index in range(segments)]
+
+    return build
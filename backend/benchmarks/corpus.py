@@ -0,0 +1,54 @@
+"""Helpers shared by the benchmarks: synthetic text and throughput/RSS reporting."""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+import multiprocessing
+import random
+import resource
+
+WORDS = ("model source summary transcript document analysis result method data network "
+         "training evaluation system language context retrieval query answer token").split()
+
+
+def sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(rng: random.Random, sentences: int = 6) -> str:
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+
+def _run_and_measure(function: Callable, args: tuple) -> int:
+    function(*args)
+    # VmHWM belongs to the address space of this interpreter, ru_maxrss would also carry the RSS
+    # of the benchmark process it was forked from
+    try:
+        with open("/proc/self/status") as status:
+            return next(int(line.split()[1]) for line in status if line.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss_mb(function: Callable, *args: Any) -> float:
+    """
+    runs `function(*args)` once in a fresh interpreter and returns the peak resident set size of that
+    process, the benchmark process itself keeps the high-water mark of every earlier case
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return round(executor.submit(_run_and_measure, function, args).result() / 1024, 1)
+
+
+def _timed(benchmark) -> bool:
+    # with `--benchmark-disable` the benchmarked call runs once, untimed, and there is no report
+    return not benchmark.disabled and benchmark.stats is not None
+
+
+def record_throughput(benchmark, unit: str, amount: float):
+    """stores the throughput (per second of the mean round) in the benchmark report"""
+    if _timed(benchmark):
+        benchmark.extra_info[f"{unit}_per_s"] = round(amount / benchmark.stats.stats.mean, 2)
+
+
+def record_peak_rss(benchmark, function: Callable, *args: Any):
+    """stores the peak RSS of a separate run of the benchmarked call in the benchmark report"""
+    if _timed(benchmark):
+        benchmark.extra_info["peak_rss_mb"] = peak_rss_mb(function, *args)
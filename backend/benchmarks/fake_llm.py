@@ -0,0 +1,93 @@
+"""Deterministic stand-in for `ChatGoogleGenerativeAI` used by the load and benchmark harnesses."""
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from typing import Any, AsyncIterator, Optional
+import asyncio
+import json
+import re
+import time
+
+_UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that streams a fixed answer at a configurable token rate. Before answering it
+    calls the tools listed in `tool_calls` one per turn, with arguments derived from each tool's
+    schema (strings get the user query, lists get the source ids found in the system prompt).
+    """
+
+    model: str = "fake"
+    temperature: float = 0
+    tokens_per_second: float = 50
+    first_token_latency: float = 0.3
+    response_tokens: int = 60
+    tool_calls: list[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _plan(self, messages: list[BaseMessage], tools: list[dict]) -> AIMessage:
+        query = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        system_prompt = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+
+        # tool results since the latest user message tell how far along the plan we are
+        done = 0
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            done += isinstance(message, ToolMessage)
+
+        available = {tool["function"]["name"]: tool["function"] for tool in tools}
+        planned = [name for name in self.tool_calls if name in available]
+        if done < len(planned):
+            function = available[planned[done]]
+            args = {}
+            for name, schema in function.get("parameters", {}).get("properties", {}).items():
+                if schema.get("type") == "array":
+                    args[name] = _UUID_PATTERN.findall(system_prompt)[:3]
+                elif schema.get("type") == "string":
+                    args[name] = str(query)[:100]
+            return AIMessage(content="", tool_calls=[
+                {"name": function["name"], "args": args, "id": f"call-{done}"}])
+
+        words = [f"token{index}" for index in range(self.response_tokens)]
+        return AIMessage(content=" ".join(words) + " [Source ID: S01]")
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self._plan(messages, kwargs.get("tools", []))
+        time.sleep(self.first_token_latency + self.response_tokens / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._plan(messages, kwargs.get("tools", []))
+        await asyncio.sleep(self.first_token_latency)
+
+        if message.tool_calls:
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}
+                for call in message.tool_calls
+            ]))
+            if run_manager:
+                await run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+            return
+
+        for index, word in enumerate(message.content.split(" ")):
+            if index:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if not index else " " + word))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
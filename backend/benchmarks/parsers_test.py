@@ -0,0 +1,49 @@
+import markdownify
+import pytest
+
+from benchmarks.corpus import record_peak_rss, record_throughput
+from helper.parsers import format_transcript, is_empty_transcript, parse_pdf
+
+
+@pytest.mark.parametrize("pages", [1, 10, 50])
+def test_parse_pdf(benchmark, make_pdf, pages):
+    path = make_pdf(pages)
+
+    content = benchmark.pedantic(parse_pdf, args=(str(path),), rounds=3, iterations=1)
+
+    assert "Section 1" in content
+    record_throughput(benchmark, "pages", pages)
+    record_peak_rss(benchmark, parse_pdf, str(path))
+
+
+@pytest.mark.parametrize("size_mb", [1, 5])
+def test_markdownify(benchmark, make_html, size_mb):
+    html = make_html(size_mb)
+
+    content = benchmark.pedantic(markdownify.markdownify, args=(html,), rounds=3, iterations=1)
+
+    assert "Section 1" in content
+    record_throughput(benchmark, "mb", len(html) / (1024 * 1024))
+    record_peak_rss(benchmark, markdownify.markdownify, html)
+
+
+@pytest.mark.parametrize("segments", [1000, 20000])
+def test_format_transcript(benchmark, make_transcript, segments):
+    transcript = make_transcript(segments)
+
+    content = benchmark(format_transcript, transcript)
+
+    assert content.count("\n") == segments
+    record_throughput(benchmark, "segments", segments)
+    record_peak_rss(benchmark, format_transcript, transcript)
+
+
+@pytest.mark.parametrize("segments", [1000, 20000])
+def test_is_empty_transcript(benchmark, make_transcript, segments):
+    content = format_transcript(make_transcript(segments))
+
+    empty = benchmark(is_empty_transcript, content)
+
+    assert not empty
+    record_throughput(benchmark, "segments", segments)
+    record_peak_rss(benchmark, is_empty_transcript, content)
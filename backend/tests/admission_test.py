@@ -0,0 +1,15 @@
+import services.admission as admission
+from config import MAX_CHAT_BACKLOG
+
+
+def test_backlog_rejection_does_not_take_tokens(monkeypatch):
+    taken = []
+    monkeypatch.setattr(admission, "take_tokens", lambda buckets: taken.append(buckets) or 0)
+    monkeypatch.setattr(admission, "chat_backlog", lambda: MAX_CHAT_BACKLOG)
+
+    assert admission.admit_chat("page", "10.0.0.1") == admission.CHAT_BACKLOG_RETRY_AFTER
+    assert taken == []
+
+    # cached answers skip the backlog and only pay the rate limit
+    assert admission.admit_chat("page", "10.0.0.1", queued=False) is None
+    assert len(taken) == 1
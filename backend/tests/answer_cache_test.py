@@ -0,0 +1,36 @@
+import pytest
+
+import services.answer_cache as answer_cache
+from repository import MemoryLRUCache
+from services.answer_cache import answer_cache_key, cache_answer, get_cached_answer
+
+
+@pytest.fixture
+def conversation(monkeypatch):
+    conversation = {"history": [], "summary": ""}
+    monkeypatch.setattr(answer_cache, "answer_cache", MemoryLRUCache(ttl=60, max_entries=10))
+    monkeypatch.setattr(answer_cache, "get_conversation_data", lambda page_id: conversation)
+    monkeypatch.setattr(answer_cache, "source_set_version", lambda page_id: "v1")
+    return conversation
+
+
+def test_answer_is_served_to_the_same_query_without_context(conversation):
+    # the chat takes the key, then its turn is appended before the answer is cached
+    cache_key = answer_cache_key("What is attention?", "page")
+    conversation["history"].append({"query": "What is attention?", "answer": "A weighting of tokens."})
+    cache_answer(cache_key, "A weighting of tokens.")
+
+    conversation["history"].clear()
+    assert get_cached_answer("what is  attention", "page") == "A weighting of tokens."
+
+
+def test_follow_ups_are_neither_cached_nor_served(conversation):
+    cache_answer(answer_cache_key("What is attention?", "page"), "A weighting of tokens.")
+    conversation["history"].append({"query": "What is attention?", "answer": "A weighting of tokens."})
+
+    assert answer_cache_key("Tell me more", "page") is None
+    assert get_cached_answer("What is attention?", "page") is None
+
+    conversation["history"].clear()
+    conversation["summary"] = "Earlier the user asked about transformers."
+    assert get_cached_answer("What is attention?", "page") is None
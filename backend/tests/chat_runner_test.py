@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+import services.chat_runner as chat_runner
+from config import MERGE_TYPE
+from core.schema import ChatRequest, UpdateState
+from repository import MemoryRepository
+
+REQUEST = ChatRequest(query="What is attention?", page_id="page")
+
+
+@pytest.fixture
+def cached():
+    return []
+
+
+@pytest.fixture
+def repository(monkeypatch, cached):
+    repository = MemoryRepository(MERGE_TYPE)
+    monkeypatch.setattr(chat_runner, "redis_repo", repository)
+    monkeypatch.setattr(chat_runner, "CHAT_CANCEL_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(chat_runner, "track_chat_started", lambda request_id: None)
+    monkeypatch.setattr(chat_runner, "track_chat_finished", lambda request_id: None)
+    monkeypatch.setattr(chat_runner, "answer_cache_key", lambda query, page_id: "key")
+    monkeypatch.setattr(chat_runner, "cache_answer", lambda cache_key, answer: cached.append(answer))
+    return repository
+
+
+def stream(chunks, delay=0.0):
+    async def chat(query, page_id, request_id, redis_repo):
+        answer = ""
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            answer += chunk
+            yield UpdateState(type="message", content=answer)
+    return chat
+
+
+def test_running_chat_is_cancelled(repository, cached, monkeypatch):
+    monkeypatch.setattr(chat_runner, "chat", stream(["Attention ", "weights ", "tokens."], delay=0.2))
+    request_id = repository.create_record()
+
+    async def run():
+        chat = asyncio.create_task(chat_runner.run_chat(request_id, REQUEST))
+        await asyncio.sleep(0.1)
+        assert repository.cancel_record(request_id) == "cancelling"
+        await chat
+
+    asyncio.run(run())
+
+    record = repository.get_record(request_id)
+    assert record["type"] == "status" and record["content"] == "cancelled"
+    assert cached == []
+    # the chat ended, a second cancellation reports it
+    assert repository.cancel_record(request_id) == "cancelled"
+
+
+def test_completed_chat_is_not_cancelled(repository, cached, monkeypatch):
+    monkeypatch.setattr(chat_runner, "chat", stream(["Attention ", "weights tokens."]))
+    request_id = repository.create_record()
+
+    asyncio.run(chat_runner.run_chat(request_id, REQUEST))
+
+    assert repository.cancel_record(request_id) == "finished"
+    assert not repository.is_cancelled(request_id)
+    assert repository.get_record(request_id)["content"] == "finished"
+    assert cached == ["Attention weights tokens."]
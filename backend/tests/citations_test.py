@@ -0,0 +1,67 @@
+import asyncio
+import uuid
+
+import services.citations as citations
+from helper.text import build_citation_index
+from services.citations import CitationResolver, cited_claim
+
+CONTENT = (
+    "Photosynthesis converts light energy into chemical energy inside chloroplasts.\n\n"
+    "Mitochondria produce ATP through cellular respiration using oxygen.\n\n"
+    "Ribosomes assemble proteins from amino acids following messenger RNA."
+)
+
+
+def test_citation_index_chunks_cover_the_content():
+    index = build_citation_index(CONTENT, 100)
+
+    assert index["chunks"][0][0] == 0 and index["chunks"][-1][1] == len(CONTENT)
+    assert all(previous[1] == chunk[0] for previous, chunk in zip(index["chunks"], index["chunks"][1:]))
+    assert index["terms"]["mitochondria"] == [1]
+    assert "the" not in index["terms"]
+
+
+def test_cited_claim_is_the_sentence_before_the_marker():
+    answer = "Cells need energy. ATP is made by mitochondria. [Source ID: S1]"
+
+    assert cited_claim(answer, answer.index("[")) == "ATP is made by mitochondria."
+
+
+def test_resolver_resolves_each_completed_citation_once(monkeypatch):
+    source_id = str(uuid.uuid4())
+    index = build_citation_index(CONTENT, 100)
+    loads = []
+
+    def get_citation_indexes(conversation_id, source_ids):
+        loads.append(sorted(source_ids))
+        return {source_id: index} if source_id in source_ids else {}
+
+    monkeypatch.setattr(citations, "get_citation_indexes", get_citation_indexes)
+    resolver = CitationResolver("page")
+
+    answer = f"Proteins are assembled by ribosomes [Source ID: {source_id}"
+    assert asyncio.run(resolver.resolve(answer)) == []
+
+    unknown_id = str(uuid.uuid4())
+    answer += f"], and ATP comes from mitochondria [Source ID: {source_id}, {unknown_id}]."
+    resolved = asyncio.run(resolver.resolve(answer))
+    assert [citation["chunk"] for citation in resolved] == [2, 1]
+    assert resolved[1]["span"] == index["chunks"][1]
+    assert answer[slice(*resolved[0]["offset"])].startswith("[Source ID:")
+
+    assert asyncio.run(resolver.resolve(answer + f" More text [Source ID: {source_id}]")) != []
+    # the indexes are loaded once per source, in one query per call
+    assert loads == [sorted([source_id, unknown_id])]
+
+
+def test_citations_are_emitted_without_span_when_the_index_fails_to_load(monkeypatch):
+    def get_citation_indexes(conversation_id, source_ids):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(citations, "get_citation_indexes", get_citation_indexes)
+    source_id = str(uuid.uuid4())
+
+    resolved = asyncio.run(CitationResolver("page").resolve(f"ATP comes from mitochondria [Source ID: {source_id}]"))
+
+    assert resolved == [{"source_id": source_id, "offset": resolved[0]["offset"],
+                         "chunk": None, "span": None, "score": None}]
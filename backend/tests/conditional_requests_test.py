@@ -0,0 +1,127 @@
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from config import MERGE_TYPE, SourceTypeEnum
+from helper.text import decode_page_cursor, encode_page_cursor
+from repository import MemoryRepository
+
+
+@pytest.fixture
+def client():
+    # without the context manager the lifespan (embedded pools, expiry scheduler) is not started
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def page(monkeypatch):
+    page = {"title": "Page", "summary": "About the page", "summary_version": 0, "source_count": 1}
+    source = {"id": uuid.uuid4(), "title": "Source", "type": SourceTypeEnum.WEB, "link": "https://example.com",
+              "created_at": datetime.now(timezone.utc)}
+    monkeypatch.setattr(main, "get_page_summary", lambda page_id: dict(page))
+    monkeypatch.setattr(main, "get_sources_page", lambda page_id, limit=None, after=None: [source])
+    return page
+
+
+@pytest.fixture
+def repository(monkeypatch):
+    repository = MemoryRepository(MERGE_TYPE)
+    monkeypatch.setattr(main, "redis_repo", repository)
+    monkeypatch.setattr(main, "RECORD_WAIT_POLL_INTERVAL", 0.01)
+    return repository
+
+
+def test_fetch_page_not_modified(client, page):
+    first = client.get("/fetch-page", params={"page_id": "page"})
+    etag = first.headers["ETag"]
+
+    assert first.status_code == 200
+    assert first.json()["summary"] == "About the page"
+    again = client.get("/fetch-page", params={"page_id": "page"}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+    # a refresh of the page summary changes the representation
+    page.update(summary="About the page and more", summary_version=1)
+    updated = client.get("/fetch-page", params={"page_id": "page"}, headers={"If-None-Match": etag})
+    assert updated.status_code == 200
+    assert updated.headers["ETag"] != etag
+    assert updated.json()["summary"] == "About the page and more"
+
+
+def test_fetch_page_tags_each_slice(client, page, monkeypatch):
+    first_page = client.get("/fetch-page", params={"page_id": "page", "limit": 10})
+    etag = first_page.headers["ETag"]
+
+    assert client.get("/fetch-page", params={"page_id": "page"}).headers["ETag"] != etag
+    assert client.get("/fetch-page", params={"page_id": "page", "limit": 20}).headers["ETag"] != etag
+    next_page = client.get("/fetch-page", params={
+        "page_id": "page", "limit": 10, "cursor": encode_page_cursor(datetime.now(timezone.utc), str(uuid.uuid4()))})
+    assert next_page.headers["ETag"] != etag
+
+    # a revalidation only reads the page row, the sources are not listed
+    list_sources = main.get_sources_page
+    monkeypatch.setattr(main, "get_sources_page", None)
+    again = client.get("/fetch-page", params={"page_id": "page", "limit": 10}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+
+    monkeypatch.setattr(main, "get_sources_page", list_sources)
+    page.update(source_count=2)
+    added = client.get("/fetch-page", params={"page_id": "page", "limit": 10}, headers={"If-None-Match": etag})
+    assert added.status_code == 200
+    assert added.headers["ETag"] != etag
+
+
+def test_record_poll_not_modified(client, repository):
+    request_id = repository.create_record()
+    first = client.get("/chat", params={"request_id": request_id})
+
+    assert first.status_code == 200
+    again = client.get("/chat", params={"request_id": request_id}, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_record_poll_refuses_an_invalid_after(client, repository):
+    request_id = repository.create_record()
+
+    response = client.get("/chat", params={"request_id": request_id, "after": "not-an-id"})
+
+    assert response.status_code == 400
+
+
+def test_record_wait_returns_once_the_version_moves(client, repository):
+    request_id = repository.create_record()
+    etag = client.get("/chat", params={"request_id": request_id}).headers["ETag"]
+    update = threading.Timer(
+        0.2, repository.update_record, args=(request_id, {"type": "message", "content": "Hello"}))
+    update.start()
+
+    response = client.get(
+        "/chat", params={"request_id": request_id, "wait": 10}, headers={"If-None-Match": etag})
+
+    update.join()
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["content"] == "Hello"
+
+
+@pytest.mark.parametrize("cursor", [
+    "1700000000000000:not-a-uuid", f"abc:{uuid.uuid4()}", f"{'9' * 40}:{uuid.uuid4()}"])
+def test_fetch_page_rejects_malformed_cursor(client, page, cursor):
+    response = client.get("/fetch-page", params={"page_id": "page", "cursor": cursor})
+
+    assert response.status_code == 400
+    assert response.text == "Invalid cursor"
+
+
+def test_fetch_page_cursor_round_trip(client, page):
+    created_at, source_id = datetime.now(timezone.utc), str(uuid.uuid4())
+
+    assert decode_page_cursor(encode_page_cursor(created_at, source_id)) == (created_at, source_id)
+    cursor = encode_page_cursor(created_at, source_id)
+    response = client.get("/fetch-page", params={"page_id": "page", "cursor": cursor})
+    assert response.status_code == 200
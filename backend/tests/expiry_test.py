@@ -0,0 +1,69 @@
+import pytest
+
+import services.expiry as expiry
+from config import MERGE_TYPE
+from repository import MemoryRepository
+
+
+class Sweep:
+    """stands in for `delete_expired_conversations`, each call deletes the next batch of `batches`"""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.calls = []
+        self.sleeps = []
+
+    def delete_expired_conversations(self, cutoff, limit):
+        self.calls.append((cutoff, limit))
+        conversations = self.batches.pop(0) if self.batches else 0
+        return {"conversations": conversations, "sources": 2 * conversations, "content_bytes": 100 * conversations}
+
+
+@pytest.fixture
+def sweep(monkeypatch):
+    sweep = Sweep([])
+    monkeypatch.setattr(expiry, "redis_repo", MemoryRepository(MERGE_TYPE))
+    monkeypatch.setattr(expiry, "delete_expired_conversations", sweep.delete_expired_conversations)
+    monkeypatch.setattr(expiry.time, "sleep", sweep.sleeps.append)
+    monkeypatch.setattr(expiry, "CONVERSATION_EXPIRY_BATCH_SIZE", 10)
+    monkeypatch.setattr(expiry, "CONVERSATION_EXPIRY_MAX_BATCHES", 3)
+    return sweep
+
+
+def counts():
+    return [counter._value.get() for counter in (
+        expiry.EXPIRED_CONVERSATIONS, expiry.EXPIRED_SOURCES, expiry.EXPIRED_CONTENT_BYTES)]
+
+
+def test_sweep_stops_on_a_short_batch(sweep):
+    sweep.batches = [10, 4, 10]
+    before = counts()
+
+    expiry.expire_conversations()
+
+    assert [limit for _, limit in sweep.calls] == [10, 10]
+    assert sweep.sleeps == [expiry.CONVERSATION_EXPIRY_BATCH_INTERVAL]
+    assert [after - previous for after, previous in zip(counts(), before)] == [14, 28, 1400]
+
+
+def test_sweep_is_capped_at_max_batches(sweep):
+    sweep.batches = [10] * 5
+    before = counts()
+
+    expiry.expire_conversations()
+
+    assert len(sweep.calls) == 3
+    assert len({cutoff for cutoff, _ in sweep.calls}) == 1
+    assert len(sweep.sleeps) == 2
+    assert [after - previous for after, previous in zip(counts(), before)] == [30, 60, 3000]
+
+
+def test_sweep_is_skipped_while_the_lease_is_held(sweep):
+    sweep.batches = [4, 4]
+
+    expiry.expire_conversations()
+    # another process swept in this interval, the lease is left to expire
+    expiry.expire_conversations()
+
+    assert len(sweep.calls) == 1
+    assert sweep.batches == [4]
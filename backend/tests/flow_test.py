@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import services.flow as flow
+from config import MERGE_TYPE
+from repository import MemoryLRUCache, MemoryRepository
+from services.flow import flow_cache_key
+
+SOURCE_ID = "9d3c1f1e-6a1b-4c2d-8e8f-0a1b2c3d4e5f"
+
+
+def test_flow_cache_key_ignores_instruction_formatting():
+    key = flow_cache_key("page", 2, None, "Show the onboarding process")
+
+    assert flow_cache_key("page", 2, None, "  show the onboarding  process? ") == key
+    assert flow_cache_key("page", 3, None, "Show the onboarding process") != key
+    assert flow_cache_key("page", 2, [SOURCE_ID], "Show the onboarding process") != key
+    assert flow_cache_key("page", 2, None, "Show the billing process") != key
+
+
+def test_flow_request_enqueues_the_page_not_its_content(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main, "redis_repo", MemoryRepository(MERGE_TYPE))
+    monkeypatch.setattr(main, "get_source_count", lambda page_id: 2)
+    monkeypatch.setattr(flow, "flow_cache", MemoryLRUCache(ttl=60, max_entries=10))
+    monkeypatch.setattr(main.generate_flow_task, "send", lambda *args: sent.append(args))
+
+    response = TestClient(main.app).post(
+        "/flow", json={"page_id": "page", "instructions": "Show the process", "source_ids": [SOURCE_ID]})
+
+    assert response.status_code == 200
+    assert sent == [(response.json()["request_id"], "page", [SOURCE_ID], "Show the process")]
+
+
+@pytest.fixture
+def record(monkeypatch):
+    repository = MemoryRepository(MERGE_TYPE)
+    monkeypatch.setattr(flow, "redis_repo", repository)
+    monkeypatch.setattr(flow, "flow_cache", MemoryLRUCache(ttl=60, max_entries=10))
+    monkeypatch.setattr(flow, "get_source_count", lambda page_id: 1)
+    monkeypatch.setattr(flow, "get_source_summaries", lambda page_id, source_ids: [
+        {"id": SOURCE_ID, "title": "Onboarding", "summary": "Sign up, then verify the email."}])
+    return repository
+
+
+def test_build_flow_reads_the_sources_in_the_job(record, monkeypatch):
+    contexts = []
+
+    async def generate_flow(context, instructions):
+        contexts.append(context)
+        yield "```mermaid\nflowchart TD\nA-->B\n```"
+
+    monkeypatch.setattr(flow, "generate_flow", generate_flow)
+    request_id = record.create_record()
+
+    asyncio.run(flow.build_flow(request_id, "page", None, "Show the process"))
+
+    assert contexts == ["### Onboarding\nSign up, then verify the email."]
+    assert record.get_record(request_id)["content"] == "finished"
+    assert flow.get_cached_flow(flow_cache_key("page", 1, None, "Show the process")) == "flowchart TD\nA-->B"
+
+
+def test_build_flow_fails_a_selection_without_sources(record):
+    request_id = record.create_record()
+
+    asyncio.run(flow.build_flow(request_id, "page", ["not-a-source"], "Show the process"))
+
+    assert record.get_record(request_id)["type"] == "error"
@@ -0,0 +1,94 @@
+import asyncio
+import sys
+from pathlib import Path
+
+from services.mcp import MCPServerPool, _fix_schema
+
+STUB_SERVER = str(Path(__file__).resolve().parent / "stub_mcp_server.py")
+FAST_OPTIONS = dict(startup_timeout=20, health_check_interval=0.2,
+                    health_check_timeout=1, restart_backoff=0.1)
+
+
+def stub_config(name: str) -> dict:
+    return {"command": sys.executable, "args": [STUB_SERVER, name]}
+
+
+async def wait_until(condition, timeout: float = 20):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise TimeoutError("condition not met in time")
+        await asyncio.sleep(0.05)
+
+
+def test_pool_starts_all_servers():
+    async def scenario():
+        pool = MCPServerPool({"alpha": stub_config("alpha"), "beta": stub_config("beta")}, **FAST_OPTIONS)
+        await pool.start()
+        try:
+            assert pool.health() == {"alpha": True, "beta": True}
+            tools = {tool.name: tool for tool in pool.get_tools()}
+            assert set(tools) == {"alpha_echo", "alpha_crash", "beta_echo", "beta_crash"}
+            assert await tools["beta_echo"].ainvoke({"text": "hi"}) == "beta: hi"
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_crashed_server_is_restarted_without_affecting_others():
+    async def scenario():
+        pool = MCPServerPool({"alpha": stub_config("alpha"), "beta": stub_config("beta")}, **FAST_OPTIONS)
+        await pool.start()
+        try:
+            tools = {tool.name: tool for tool in pool.get_tools()}
+            beta_session = pool.servers["beta"].session
+
+            # the crash is reported back to the agent instead of raising
+            await tools["alpha_crash"].ainvoke({})
+            await wait_until(lambda: pool.servers["alpha"].restarts == 1 and pool.servers["alpha"].healthy)
+
+            assert pool.servers["beta"].session is beta_session
+            assert pool.servers["beta"].restarts == 0
+            # the tool objects handed out before the crash keep working
+            assert await tools["alpha_echo"].ainvoke({"text": "back"}) == "alpha: back"
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_failing_server_only_degrades_its_own_tools():
+    async def scenario():
+        pool = MCPServerPool({
+            "alpha": stub_config("alpha"),
+            "broken": {"command": sys.executable, "args": ["-c", "import sys; sys.exit(1)"]}
+        }, **dict(FAST_OPTIONS, startup_timeout=3))
+        await pool.start()
+        try:
+            assert pool.health() == {"alpha": True, "broken": False}
+            assert {tool.name for tool in pool.get_tools()} == {"alpha_echo", "alpha_crash"}
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_start_without_waiting_returns_before_the_servers_are_up():
+    async def scenario():
+        pool = MCPServerPool({"alpha": stub_config("alpha")}, **FAST_OPTIONS)
+        await pool.start(wait=False)
+        try:
+            assert pool.health() == {"alpha": False}
+            await pool.start()
+            assert pool.health() == {"alpha": True}
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_type_unions_are_rewritten_as_any_of():
+    schema = {"type": "object", "properties": {"limit": {"type": ["integer", "null"]}}}
+
+    assert _fix_schema(schema)["properties"]["limit"] == {"anyOf": [{"type": "integer"}, {"type": "null"}]}
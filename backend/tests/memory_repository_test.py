@@ -0,0 +1,68 @@
+import pytest
+
+import repository
+from repository import MemoryLRUCache, MemoryRepository
+
+MERGE_TYPE = "message"
+
+
+def test_record_keeps_superseded_states_as_updates():
+    repo = MemoryRepository(MERGE_TYPE)
+    record_id = repo.create_record()
+    repo.update_record(record_id, {"type": "tool", "content": "search"})
+    repo.update_record(record_id, {"type": "message", "content": "Hel"})
+    repo.update_record(record_id, {"type": "message", "content": "Hello"})
+    repo.update_record(record_id, {"type": "status", "content": "finished"})
+
+    record = repo.get_record(record_id)
+    assert record["content"] == "finished"
+    assert record["version"] == 4
+    # message chunks replace each other, only the last one is kept in the update log
+    assert [update["content"] for update in record["updates"]] == ["queued", "search", "Hello"]
+
+    assert repo.get_record(record_id, after=record["last_update_id"])["updates"] == []
+    with pytest.raises(ValueError):
+        repo.get_record(record_id, after="not-an-id")
+
+
+def test_update_log_is_capped_and_missing_records():
+    repo = MemoryRepository(MERGE_TYPE, max_updates=2)
+    record_id = repo.create_record()
+    for index in range(5):
+        repo.update_record(record_id, {"type": "tool", "content": str(index)})
+    assert [update["content"] for update in repo.get_record(record_id)["updates"]] == ["2", "3"]
+
+    assert repo.get_record("missing") is None
+    assert not repo.update_record("missing", {"type": "status"})
+    assert repo.cancel_record("missing") is None
+    assert repo.cancel_record(record_id) == "cancelling" and repo.is_cancelled(record_id)
+
+
+def test_lock_is_held_until_released():
+    repo = MemoryRepository(MERGE_TYPE)
+    assert repo.acquire_lock("page", ttl=60)
+    assert not repo.acquire_lock("page", ttl=60)
+    repo.release_lock("page")
+    assert repo.acquire_lock("page", ttl=60)
+
+
+def test_version_follows_updates():
+    repo = MemoryRepository(MERGE_TYPE)
+    record_id = repo.create_record()
+    assert repo.get_version(record_id) == 0
+    repo.update_record(record_id, {"type": "message", "content": "Hi"})
+    assert repo.get_version(record_id) == repo.get_record(record_id)["version"] == 1
+    assert repo.get_version("missing") is None
+
+
+def test_expired_cache_entries_do_not_evict_live_ones(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(repository.time, "monotonic", lambda: now[0])
+    cache = MemoryLRUCache(ttl=100, max_entries=2)
+    cache.set("live", 1)
+    cache.set("short", 2, ttl=1)
+    now[0] += 5
+    cache.set("new", 3)
+
+    assert cache.get("live") == 1 and cache.get("new") == 3
+    assert cache.get("short") is None
@@ -0,0 +1,93 @@
+import asyncio
+
+import services.mind_map as mind_map
+from config import MERGE_TYPE
+from repository import MemoryLRUCache, MemoryRepository
+from services.mind_map import assign_ids, merge_subtree
+from services.mind_map_agent import Cluster, Clusters, Node
+
+
+def node(label: str, *children: Node) -> Node:
+    return Node(id=label, label=label, children=list(children))
+
+
+def labels(tree: Node) -> dict:
+    return {tree.label: [labels(child) for child in tree.children]}
+
+
+def test_merge_subtree_merges_matching_labels():
+    tree = node("Machine Learning", node("Models", node("Transformers")), node("Training"))
+    subtree = node("machine  learning", node("Models", node("Diffusion")), node("Evaluation"))
+
+    merge_subtree(tree, subtree)
+
+    assert labels(tree) == {"Machine Learning": [
+        {"Models": [{"Transformers": []}, {"Diffusion": []}]},
+        {"Training": []},
+        {"Evaluation": []},
+    ]}
+
+
+def test_merge_subtree_attaches_new_subject_as_theme():
+    tree = node("Machine Learning", node("Models"))
+
+    merge_subtree(tree, node("Robotics", node("Sensors")))
+
+    assert labels(tree) == {"Machine Learning": [{"Models": []}, {"Robotics": [{"Sensors": []}]}]}
+
+
+def test_assign_ids_is_unique_by_position():
+    tree = assign_ids(node("Root", node("A", node("A")), node("B")))
+
+    assert [tree.id, tree.children[0].id, tree.children[0].children[0].id, tree.children[1].id] == \
+        ["root", "root.0", "root.0.0", "root.1"]
+
+
+def test_cluster_maps_groups_sources_into_themes(monkeypatch):
+    async def generate_clusters(context):
+        assert context.splitlines()[0] == "1. Transformers: Attention"
+        return Clusters(label="AI", clusters=[
+            Cluster(label="Models", sources=[1, 3]), Cluster(label="Robots", sources=[9])])
+
+    monkeypatch.setattr(mind_map, "generate_clusters", generate_clusters)
+    trees = [node("Transformers", node("Attention")), node("Sensors"), node("Diffusion")]
+
+    tree = asyncio.run(mind_map.cluster_maps(trees))
+
+    assert labels(tree) == {"AI": [
+        {"Models": [{"Transformers": [{"Attention": []}]}, {"Diffusion": []}]},
+        {"Sensors": []},
+    ]}
+
+
+def test_new_sources_are_mapped_into_the_cached_map(monkeypatch):
+    stored = {"s1": node("Machine Learning", node("Models")).model_dump()}
+    sources = [
+        {"id": "s1", "title": "Models", "summary": "About models.", "outline": None, "mind_map": stored["s1"]},
+        {"id": "s2", "title": "Training", "summary": "About training.",
+         "outline": [{"level": 1, "title": "Optimizers"}], "mind_map": None},
+    ]
+    contexts = []
+
+    async def generate_map(context):
+        contexts.append(context)
+        return node("Machine Learning", node("Training"))
+
+    repository = MemoryRepository(MERGE_TYPE)
+    cache = MemoryLRUCache(ttl=60, max_entries=10)
+    cache.set("page", {"version": "1", "source_ids": ["s1"], "map": stored["s1"]})
+    monkeypatch.setattr(mind_map, "redis_repo", repository)
+    monkeypatch.setattr(mind_map, "mind_map_cache", cache)
+    monkeypatch.setattr(mind_map, "source_set_version", lambda page_id: "2")
+    monkeypatch.setattr(mind_map, "get_mind_map_sources", lambda page_id: sources)
+    monkeypatch.setattr(mind_map, "set_source_mind_map", lambda source_id, tree: stored.update({source_id: tree}))
+    monkeypatch.setattr(mind_map, "generate_map", generate_map)
+    request_id = repository.create_record()
+
+    asyncio.run(mind_map.build_mind_map(request_id, "page"))
+
+    assert contexts == ["### Training\nAbout training.\n\nOutline:\n- Optimizers"]
+    assert "s2" in stored
+    assert cache.get("page")["source_ids"] == ["s1", "s2"]
+    assert labels(Node.model_validate(cache.get("page")["map"])) == {
+        "Machine Learning": [{"Models": []}, {"Training": []}]}
@@ -0,0 +1,57 @@
+from helper.text import find_section, parse_outline
+
+DOCUMENT = (
+    "# Guide\n"
+    "Intro text.\n"
+    "\n"
+    "Installation\n"
+    "============\n"
+    "Run the installer.\n"
+    "\n"
+    "## Requirements\n"
+    "Python 3.11.\n"
+    "\n"
+    "```bash\n"
+    "# not a heading\n"
+    "pip install guide\n"
+    "```\n"
+    "\n"
+    "Usage\n"
+    "-----\n"
+    "Call **guide**.\n"
+    "### Options\n"
+    "Flags.\n"
+)
+
+
+def section(title):
+    heading = find_section(parse_outline(DOCUMENT), title)
+    return DOCUMENT[heading["start"]:heading["end"]]
+
+
+def test_outline_recognizes_atx_and_setext_headings_outside_code():
+    outline = parse_outline(DOCUMENT)
+
+    assert [(heading["level"], heading["title"]) for heading in outline] == [
+        (1, "Guide"), (1, "Installation"), (2, "Requirements"), (2, "Usage"), (3, "Options")]
+    assert parse_outline("") == []
+
+
+def test_sections_span_their_subsections():
+    assert section("Guide") == "# Guide\nIntro text.\n\n"
+    assert section("Installation").startswith("Installation\n====")
+    assert section("Installation").endswith("### Options\nFlags.\n")
+    # the fenced comment belongs to the section, it does not end it
+    assert section("Requirements") == (
+        "## Requirements\nPython 3.11.\n\n```bash\n# not a heading\npip install guide\n```\n\n")
+    assert section("Usage").startswith("Usage\n-----") and section("Usage").endswith("Flags.\n")
+    assert section("Options") == "### Options\nFlags.\n"
+
+
+def test_find_section_prefers_exact_matches():
+    outline = parse_outline("# Setup and Usage\nA.\n# Usage\nB.\n")
+
+    assert find_section(outline, " usage ")["title"] == "Usage"
+    assert find_section(outline, "setup")["title"] == "Setup and Usage"
+    assert find_section(outline, "Deployment") is None
+    assert find_section(outline, "  ") is None
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+import services.page_summary as page_summary
+from config import MERGE_TYPE
+from repository import MemoryRepository
+
+
+class FakePage:
+    """stands in for the conversation row and its sources, `update_page_summary` compares-and-sets the version"""
+
+    def __init__(self, sources):
+        self.summary = None
+        self.version = 0
+        self.sources = sources  # (id, title, summary, in_page_summary)
+        self.updates = []
+
+    def get_page_summary(self, page_id):
+        return {"title": "Page", "summary": self.summary, "summary_version": self.version}
+
+    def get_unsummarized_sources(self, page_id):
+        return [{"id": source[0], "title": source[1], "summary": source[2]} for source in self.sources if not source[3]]
+
+    def update_page_summary(self, page_id, summary, source_ids, previous_version):
+        self.updates.append(source_ids)
+        if previous_version != self.version:
+            return False
+        self.summary, self.version = summary, self.version + 1
+        self.sources = [(*source[:3], source[3] or source[0] in source_ids) for source in self.sources]
+        return True
+
+
+@pytest.fixture
+def page(monkeypatch):
+    page = FakePage([("a", "A", "about a", False), ("b", "B", "about b", False)])
+    monkeypatch.setattr(page_summary, "redis_repo", MemoryRepository(MERGE_TYPE))
+    for name in ("get_page_summary", "get_unsummarized_sources", "update_page_summary"):
+        monkeypatch.setattr(page_summary, name, getattr(page, name))
+    return page
+
+
+def fold(summarized):
+    async def summarize_page(summary, sources):
+        summarized.append([source["id"] for source in sources])
+        return " ".join(filter(None, [summary] + [source["summary"] for source in sources]))
+    return summarize_page
+
+
+def test_refresh_is_claimed_once_per_burst(page, monkeypatch):
+    monkeypatch.setattr(page_summary, "summarize_page", fold([]))
+
+    assert page_summary.claim_page_summary_refresh("page")
+    assert not page_summary.claim_page_summary_refresh("page")
+
+    # the refresh releases the claim when it starts, the next upload schedules a new one
+    asyncio.run(page_summary.refresh_page_summary("page"))
+    assert page_summary.claim_page_summary_refresh("page")
+
+
+def test_refresh_folds_sources_committed_late(page, monkeypatch):
+    summarized = []
+    monkeypatch.setattr(page_summary, "summarize_page", fold(summarized))
+
+    asyncio.run(page_summary.refresh_page_summary("page"))
+    # committed after the refresh, with a creation time earlier than the folded sources
+    page.sources.insert(0, ("late", "Late", "about late", False))
+    asyncio.run(page_summary.refresh_page_summary("page"))
+    asyncio.run(page_summary.refresh_page_summary("page"))
+
+    assert summarized == [["a", "b"], ["late"]]
+    assert page.summary == "about a about b about late"
+
+
+def test_concurrent_refresh_folds_again(page, monkeypatch):
+    summarized = []
+    concurrent = fold([])
+
+    async def summarize_page(summary, sources):
+        if not summarized:
+            # another refresh stores its summary of the first source meanwhile
+            page.update_page_summary("page", await concurrent("", sources[:1]), ["a"], page.version)
+        return await fold(summarized)(summary, sources)
+
+    monkeypatch.setattr(page_summary, "summarize_page", summarize_page)
+
+    asyncio.run(page_summary.refresh_page_summary("page"))
+
+    assert summarized == [["a", "b"], ["b"]]
+    assert page.updates == [["a"], ["a", "b"], ["b"]]
+    assert page.summary == "about a about b" and page.version == 2
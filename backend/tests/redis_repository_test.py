@@ -0,0 +1,83 @@
+import os
+import uuid
+
+import pytest
+import redis
+
+from repository import RedisRepository
+
+MERGE_TYPE = "message"
+
+
+@pytest.fixture
+def make_repo():
+    """repositories on the Redis server of `REDIS_HOST` under a throwaway prefix, skipped when it is not reachable"""
+    host = os.getenv("REDIS_HOST", "localhost")
+    prefix = f"test-{uuid.uuid4()}"
+    client = redis.StrictRedis(host=host, socket_connect_timeout=1)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip(f"no Redis server on {host}")
+
+    yield lambda **options: RedisRepository(prefix, host, MERGE_TYPE, **options)
+    keys = list(client.scan_iter(f"{prefix}:*"))
+    if keys:
+        client.delete(*keys)
+
+
+def test_record_keeps_superseded_states_as_updates(make_repo):
+    repo = make_repo()
+    record_id = repo.create_record()
+    assert repo.update_record(record_id, {"type": "tool", "content": "search"})
+    repo.update_record(record_id, {"type": "message", "content": "Hel"})
+    repo.update_record(record_id, {"type": "message", "content": "Hello"})
+    repo.update_record(record_id, {"type": "status", "content": "finished"})
+
+    record = repo.get_record(record_id)
+    assert record["content"] == "finished"
+    assert record["version"] == repo.get_version(record_id) == 4
+    # message chunks replace each other, only the last one is kept in the update log
+    assert [update["content"] for update in record["updates"]] == ["queued", "search", "Hello"]
+
+
+def test_after_is_exclusive(make_repo):
+    repo = make_repo()
+    record_id = repo.create_record()
+    repo.update_record(record_id, {"type": "tool", "content": "search"})
+    seen = repo.get_record(record_id)["last_update_id"]
+
+    assert repo.get_record(record_id, after=seen)["updates"] == []
+    assert repo.get_record(record_id, after=seen)["last_update_id"] == seen
+    repo.update_record(record_id, {"type": "tool", "content": "fetch"})
+    assert [update["content"] for update in repo.get_record(record_id, after=seen)["updates"]] == ["search"]
+
+
+def test_update_log_is_capped_and_missing_records(make_repo):
+    repo = make_repo(max_updates=2)
+    record_id = repo.create_record()
+    for index in range(5):
+        repo.update_record(record_id, {"type": "tool", "content": str(index)})
+
+    assert [update["content"] for update in repo.get_record(record_id)["updates"]] == ["2", "3"]
+    assert repo.get_record("missing") is None
+    assert repo.get_version("missing") is None
+    assert not repo.update_record("missing", {"type": "status"})
+
+
+def test_invalid_after_is_refused(make_repo):
+    repo = make_repo()
+    record_id = repo.create_record()
+
+    with pytest.raises(ValueError):
+        repo.get_record(record_id, after="not-an-id")
+
+
+def test_cancel_reports_the_terminal_status(make_repo):
+    repo = make_repo()
+    running, finished = repo.create_record(), repo.create_record()
+    repo.update_record(finished, {"type": "status", "content": "finished"})
+
+    assert repo.cancel_record("missing") is None
+    assert repo.cancel_record(running) == "cancelling" and repo.is_cancelled(running)
+    assert repo.cancel_record(finished) == "finished" and not repo.is_cancelled(finished)
@@ -0,0 +1,24 @@
+"""Minimal stdio MCP server used in place of the DuckDuckGo/arXiv servers in tests."""
+import os
+import sys
+
+from mcp.server.fastmcp import FastMCP
+
+name = sys.argv[1] if len(sys.argv) > 1 else "stub"
+server = FastMCP(name)
+
+
+@server.tool(name=f"{name}_echo")
+def echo(text: str) -> str:
+    """Echoes the given text back, prefixed with the server name."""
+    return f"{name}: {text}"
+
+
+@server.tool(name=f"{name}_crash")
+def crash() -> str:
+    """Terminates the server process to simulate a crash."""
+    os._exit(1)
+
+
+if __name__ == "__main__":
+    server.run()
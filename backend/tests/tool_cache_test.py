@@ -0,0 +1,66 @@
+import asyncio
+
+from langchain_core.tools import BaseTool, tool
+
+import services.tool_cache as tool_cache
+from core.metrics import TOOL_CACHE_LOOKUPS
+from repository import MemoryLRUCache
+from services.tool_cache import CachedTool, cached_tools, tool_cache_key
+
+
+def test_only_free_text_arguments_are_folded():
+    assert tool_cache_key("search", {"query": "  Attention   Is All "}) == \
+        tool_cache_key("search", {"query": "attention is all"})
+    assert tool_cache_key("fetch_content", {"url": "https://x/Page"}) != \
+        tool_cache_key("fetch_content", {"url": "https://x/page"})
+    assert tool_cache_key("scrape_recent_category_papers", {"category": "cs.AI"}) != \
+        tool_cache_key("scrape_recent_category_papers", {"category": "cs.ai"})
+
+
+def test_ttl_is_configured_per_tool_with_a_server_default():
+    @tool
+    async def scrape_recent_category_papers(category: str) -> str:
+        """recent papers"""
+        return category
+
+    @tool
+    async def list_authors(paper_id: str) -> str:
+        """authors"""
+        return paper_id
+
+    recent, other = cached_tools({"arXivPaper": [scrape_recent_category_papers, list_authors]})
+
+    assert recent.ttl == 30 * 60
+    assert other.ttl == 60 * 60
+
+
+def test_lookups_are_counted_by_tool_and_outcome(monkeypatch):
+    monkeypatch.setattr(tool_cache, "tool_cache", MemoryLRUCache(ttl=60, max_entries=10))
+
+    calls_made = []
+
+    class Search(BaseTool):
+        name: str = "search"
+        description: str = "web search"
+
+        def _run(self, **kwargs):
+            raise NotImplementedError
+
+        async def _arun(self, query: str) -> str:
+            calls_made.append(query)
+            await asyncio.sleep(0.01)
+            return query
+
+    cached = CachedTool.wrap(Search(), ttl=60)
+    lookups = {outcome: TOOL_CACHE_LOOKUPS.labels("search", outcome) for outcome in ("hit", "miss", "shared")}
+    before = {outcome: counter._value.get() for outcome, counter in lookups.items()}
+
+    async def calls():
+        await asyncio.gather(cached._arun(query="a"), cached._arun(query="a"))
+        await cached._arun(query="A")
+
+    asyncio.run(calls())
+
+    assert {outcome: counter._value.get() - before[outcome] for outcome, counter in lookups.items()} == \
+        {"hit": 1, "miss": 1, "shared": 1}
+    assert calls_made == ["a"]
@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import services.tools as tools
+from helper.text import encode_cursor
+from repository import MemoryRepository
+
+FIRST = SimpleNamespace(id="s1", title="First", content="alpha beta gamma delta\n" * 20, token_count=None)
+SECOND = SimpleNamespace(id="s2", title="Second", content="epsilon zeta eta theta", token_count=None)
+
+
+def retrieve(monkeypatch, cursor=None, budget=1000):
+    monkeypatch.setattr(tools, "get_sources", lambda source_ids: [SECOND, FIRST])
+    monkeypatch.setattr(tools, "RETRIEVAL_TOKEN_BUDGET", budget)
+    return asyncio.run(tools.retrieve_sources_complete(
+        ["s1", "s2"], cursor=cursor, request_id="request", redis_repo=MemoryRepository("message")))
+
+
+def test_sources_fitting_the_budget_are_returned_whole_in_requested_order(monkeypatch):
+    output = retrieve(monkeypatch)
+
+    assert output.index("**First:**") < output.index("**Second:**")
+    assert "truncated" not in output
+
+
+def test_truncation_cuts_at_a_line_break_and_resumes_from_the_cursor(monkeypatch):
+    output = retrieve(monkeypatch, budget=40)
+
+    cursor = output.split('cursor="')[1].split('"')[0]
+    source_id, offset = cursor.split(":")
+    assert source_id == "s1" and FIRST.content[int(offset) - 1] == "\n"
+    assert "**Second:**" not in output
+
+    resumed = retrieve(monkeypatch, cursor=cursor)
+    assert resumed.startswith("**First (continued):**\n" + FIRST.content[int(offset):])
+    assert "**Second:**" in resumed
+
+
+def test_bad_cursors_are_reported_to_the_model(monkeypatch):
+    assert retrieve(monkeypatch, cursor="not a cursor").startswith("Invalid cursor - not a cursor")
+    assert retrieve(monkeypatch, cursor=encode_cursor("s9", 10)).startswith("Invalid cursor - source s9")
+
+
+GUIDE = SimpleNamespace(
+    id="s3", title="Guide", outline=None, token_count=None,
+    content="# Guide\nIntro.\n## Install\n" + "Run the installer step.\n" * 40 + "## Usage\nCall it.\n")
+
+
+def call(monkeypatch, tool, budget=1000, **kwargs):
+    monkeypatch.setattr(tools, "get_sources", lambda source_ids: [GUIDE])
+    monkeypatch.setattr(tools, "RETRIEVAL_TOKEN_BUDGET", budget)
+    return asyncio.run(tool(request_id="request", redis_repo=MemoryRepository("message"), **kwargs))
+
+
+def test_outline_lists_nested_sections(monkeypatch):
+    output = call(monkeypatch, tools.get_source_outline, source_id="s3")
+
+    assert output.startswith("**Outline of Guide:**\n- Guide (~")
+    assert "\n  - Install (~" in output and "\n  - Usage (~" in output
+
+
+def test_section_is_returned_up_to_the_next_section(monkeypatch):
+    output = call(monkeypatch, tools.retrieve_source_section, source_id="s3", section="install")
+
+    assert output.startswith("**Guide - Install:**\n## Install\nRun the installer step.")
+    assert "## Usage" not in output and "truncated" not in output
+
+
+def test_unknown_section_points_to_the_outline(monkeypatch):
+    output = call(monkeypatch, tools.retrieve_source_section, source_id="s3", section="Deployment")
+
+    assert output.startswith("No section named \"Deployment\" in Guide")
+
+
+def test_long_section_is_truncated_at_the_budget_with_a_cursor(monkeypatch):
+    output = call(monkeypatch, tools.retrieve_source_section, budget=30, source_id="s3", section="Install")
+
+    cursor = output.split('cursor="')[1].split('"')[0]
+    source_id, offset = cursor.split(":")
+    assert source_id == "s3" and GUIDE.content[int(offset) - 1] == "\n"
+    assert "[Output truncated at the 30 token budget." in output
+    assert output.count("Run the installer step.") < 40
@@ -0,0 +1,81 @@
+import asyncio
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+import helper.parsers as parsers
+import main
+from services.admission import InFlightLimiter
+
+WEB_UPLOAD = {"url": "https://example.com", "source_type": "web", "page_id": "page"}
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    slots = InFlightLimiter(1)
+    monkeypatch.setattr(main, "upload_slots", slots)
+    monkeypatch.setattr(main, "admit_upload", lambda page_id, client_id: None)
+    return slots
+
+
+def test_failed_ingestion_releases_its_slot(slots, monkeypatch):
+    def get_web_content(url):
+        raise ConnectionError(url)
+
+    monkeypatch.setattr(parsers, "get_web_content", get_web_content)
+
+    response = TestClient(main.app).post("/upload-source", data=WEB_UPLOAD)
+
+    assert response.json()["error"] is True
+    assert slots.in_flight == 0
+
+
+def test_setup_failure_does_not_take_a_slot(slots, monkeypatch):
+    # the parsers are imported with the first upload, before the slot is taken
+    monkeypatch.setitem(sys.modules, "helper.parsers", None)
+
+    response = TestClient(main.app, raise_server_exceptions=False).post("/upload-source", data=WEB_UPLOAD)
+
+    assert response.status_code == 500
+    assert slots.in_flight == 0
+
+
+def test_uploads_above_the_limit_are_refused(slots):
+    assert slots.try_acquire()
+
+    response = TestClient(main.app).post("/upload-source", data=WEB_UPLOAD)
+
+    assert response.status_code == 429
+    assert slots.in_flight == 1
+
+
+def test_document_is_processed_off_the_event_loop(slots, monkeypatch):
+    on_loop = []
+
+    def off_loop(name, result):
+        def call(*args):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(name)
+            except RuntimeError:
+                pass
+            return result
+        return call
+
+    async def get_brief_summary(source_type, content):
+        return {"brief": "Brief", "summary": "Summary"}
+
+    monkeypatch.setattr(parsers, "get_web_content", off_loop("get_web_content", "# Title\nContent"))
+    monkeypatch.setattr(main, "count_tokens", off_loop("count_tokens", 3))
+    monkeypatch.setattr(main, "parse_outline", off_loop("parse_outline", []))
+    monkeypatch.setattr(main, "build_citation_index", off_loop("build_citation_index", {}))
+    monkeypatch.setattr(main, "get_brief_summary", get_brief_summary)
+    monkeypatch.setattr(main, "create_source", lambda source: "source")
+    monkeypatch.setattr(main, "schedule_page_summary", lambda page_id: None)
+
+    response = TestClient(main.app).post("/upload-source", data=WEB_UPLOAD)
+
+    assert response.json() == {"source_id": "source"}
+    assert on_loop == []
+    assert slots.in_flight == 0
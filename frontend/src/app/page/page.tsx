@@ -217,7 +217,8 @@ function PageContent() {
         for (let i = lastProcessedIndex + 1; i < data.updates.length; i++) {
           const update = data.updates[i];
           if (
-            (update.type === "status" && update.content === "finished") ||
+            (update.type === "status" &&
+              (update.content === "finished" || update.content === "cancelled")) ||
             update.type === "error"
           ) {
             shouldStopPolling = true;
@@ -227,7 +228,8 @@ function PageContent() {
 
         if (!shouldStopPolling) {
           if (
-            (data.type === "status" && data.content === "finished") ||
+            (data.type === "status" &&
+              (data.content === "finished" || data.content === "cancelled")) ||
             data.type === "error"
           ) {
             shouldStopPolling = true;